@@ -0,0 +1,303 @@
+"""
+Offline benchmark for the paper archive pipeline (scripts/fetch_papers.py).
+
+Usage:
+  python scripts/bench_fetch.py [--workers 1,8,32] [--latency-ms 80] [--jitter-ms 40]
+                                [--fail-rate 0.05] [--drop-rate 0.02] [--pdf-kb 512]
+                                [--host-latency pmc.ncbi.nlm.nih.gov=400] [--incremental-pass]
+                                [--with-markdown] [--hedge-after 0.5] [--papers 500] [--shards 4] [--out bench.json]
+
+Behavior:
+  - Starts a local stub server that impersonates Europe PMC search, the PMC / Europe PMC
+    PDF mirrors and Unpaywall; every request from the pipeline is routed to it through
+    APTUM_HTTP_OVERRIDE (see scripts/http_client.py), so no network is touched
+  - Injects per-request latency (global and per host), 503 failures with Retry-After
+    and truncated PDF bodies, each with a configurable rate; seeded for repeatability
+  - Runs fetch_papers.py once per --workers value in a fresh temp directory (plus an
+    optional second --incremental pass in the same directory) and reads each run's
+    docs/papers/METRICS.json
+  - Uses the repo's docs/papers/registry.json, or --papers N synthetic PMIDs; with
+    --shards N each run is N concurrent `--shard i/N` processes followed by `--merge N`
+  - Prints one row per run (wall time, phase times, outcomes, retries, p50/p95 download
+    latency, requests served by the stub) and optionally writes all reports to --out
+"""
+
+from __future__ import annotations
+import argparse
+import hashlib
+import json
+import os
+import random
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, urlsplit
+
+SCRIPTS = os.path.dirname(os.path.abspath(__file__))
+REGISTRY = os.path.join(os.path.dirname(SCRIPTS), "docs", "papers", "registry.json")
+
+
+def make_pdf(pmid: str, size: int) -> bytes:
+    """A small valid one-page PDF saying "Synthetic paper <pmid>", padded to ~`size` bytes."""
+    text = f"BT /F1 12 Tf 72 720 Td (Synthetic paper {pmid}) Tj ET".encode()
+    pad = os.urandom(max(0, size - 700))
+    objs = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents 4 0 R /Resources << /Font << /F1 5 0 R >> >> >>",
+        b"<< /Length %d >>\nstream\n" % len(text) + text + b"\nendstream",
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+        b"<< /Length %d /Filter /FlateDecode >>\nstream\n" % len(zlib.compress(pad)) + zlib.compress(pad) + b"\nendstream",
+    ]
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for n, body in enumerate(objs, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % n + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objs) + 1)
+    for off in offsets:
+        out += b"%010d 00000 n \n" % off
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objs) + 1, xref)
+    return bytes(out)
+
+
+class StubConfig:
+    def __init__(self, args: argparse.Namespace):
+        self.latency = args.latency_ms / 1000.0
+        self.jitter = args.jitter_ms / 1000.0
+        self.fail_rate = args.fail_rate
+        self.drop_rate = args.drop_rate
+        self.pdf_size = args.pdf_kb * 1024
+        self.restricted_every = args.restricted_every
+        self.host_latency: Dict[str, float] = {}
+        for item in args.host_latency or []:
+            host, ms = item.split("=", 1)
+            self.host_latency[host] = float(ms) / 1000.0
+        self.rng = random.Random(args.seed)
+        self.lock = threading.Lock()
+        self.requests: Dict[str, int] = {}
+        self.pdfs: Dict[str, bytes] = {}
+
+    def roll(self) -> float:
+        with self.lock:
+            return self.rng.random()
+
+    def count(self, host: str) -> None:
+        with self.lock:
+            self.requests[host] = self.requests.get(host, 0) + 1
+
+    def pdf(self, pmid: str) -> bytes:
+        with self.lock:
+            if pmid not in self.pdfs:
+                self.pdfs[pmid] = make_pdf(pmid, self.pdf_size)
+            return self.pdfs[pmid]
+
+    def record(self, pmid: str) -> Dict:
+        restricted = self.restricted_every and int(pmid) % self.restricted_every == 0
+        return {
+            "id": pmid,
+            "pmid": pmid,
+            "title": f"Synthetic paper {pmid}",
+            "authorString": "Bench A, Stub B.",
+            "license": "cc by-nc-nd" if restricted else "cc by",
+            "isOpenAccess": "Y",
+            "doi": f"10.5555/bench.{pmid}",
+            "fullTextIdList": {"fullTextId": [f"PMC{pmid}"]},
+            "fullTextUrlList": {"fullTextUrl": []},
+            "abstractText": f"Synthetic abstract for {pmid}.",
+            "journalTitle": "Journal of Benchmarks",
+            "pubYear": "2024",
+        }
+
+
+def make_handler(cfg: StubConfig):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def send_json(self, obj, status: int = 200) -> None:
+            body = json.dumps(obj).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            host = self.headers.get("X-Forwarded-Host", "")
+            cfg.count(host)
+            delay = cfg.host_latency.get(host, cfg.latency) + cfg.jitter * cfg.roll()
+            if delay:
+                time.sleep(delay)
+            if cfg.roll() < cfg.fail_rate:
+                self.send_response(503)
+                self.send_header("Retry-After", "0")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            parts = urlsplit(self.path)
+            if parts.path.endswith("/search"):
+                return self.search(parse_qs(parts.query))
+            m = re.search(r"/articles/PMC(\d+)", parts.path)
+            if m:
+                return self.pdf(m.group(1))
+            m = re.search(r"/v2/10\.5555/bench\.(\d+)", parts.path)
+            if m:
+                url = f"https://europepmc.org/articles/PMC{m.group(1)}/pdf"
+                loc = {"url_for_pdf": url, "host_type": "repository", "license": "cc-by"}
+                return self.send_json({"oa_locations": [loc], "best_oa_location": loc})
+            self.send_json({"error": "not found"}, 404)
+
+        def search(self, qs: Dict[str, List[str]]) -> None:
+            pmids = re.findall(r"EXT_ID:(\d+)", qs.get("query", [""])[0])
+            size = int(qs.get("pageSize", ["25"])[0])
+            cursor = qs.get("cursorMark", ["*"])[0]
+            start = 0 if cursor == "*" else int(cursor)
+            page = pmids[start : start + size]
+            nxt = str(start + len(page))
+            self.send_json({"nextCursorMark": nxt, "resultList": {"result": [cfg.record(p) for p in page]}})
+
+        def pdf(self, pmid: str) -> None:
+            body = cfg.pdf(pmid)
+            etag = '"%s"' % hashlib.sha256(body).hexdigest()[:16]
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            start = 0
+            rng = self.headers.get("Range")
+            if rng and self.headers.get("If-Range") in (None, etag):
+                start = int(rng.split("=", 1)[1].split("-", 1)[0])
+            self.send_response(206 if start else 200)
+            self.send_header("Content-Type", "application/pdf")
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", str(len(body) - start))
+            self.end_headers()
+            if cfg.roll() < cfg.drop_rate:
+                # truncate mid-body and hang up; the client should resume with Range
+                self.wfile.write(body[start : start + (len(body) - start) // 2])
+                self.close_connection = True
+                return
+            self.wfile.write(body[start:])
+
+    return Handler
+
+
+def write_registry(workdir: str, papers: int) -> str:
+    """Registry for one run: the repo's own, or `papers` synthetic PMIDs."""
+    path = os.path.join(workdir, "registry.json")
+    if not papers:
+        shutil.copyfile(REGISTRY, path)
+        return path
+    entries = [{"pmid": str(40000000 + k), "title": f"Synthetic paper {40000000 + k}", "area": "bench", "topics": []}
+               for k in range(papers)]
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"version": 1, "papers": entries}, f)
+    return path
+
+
+def run_fetch(workdir: str, base: str, workers: int, extra: List[str], shards: int = 0) -> Dict:
+    env = dict(os.environ, APTUM_HTTP_OVERRIDE=base)
+    cmd = [sys.executable, os.path.join(SCRIPTS, "fetch_papers.py"), "--workers", str(workers),
+           "--rate", "100000", "--burst", "100000", *extra]
+    t0 = time.monotonic()
+    if shards > 1:
+        # one process per shard, all at once (as CI matrix jobs would), then the merge
+        procs = [subprocess.Popen(cmd + ["--shard", f"{i}/{shards}"], cwd=workdir, env=env,
+                                  stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+                 for i in range(shards)]
+        for p in procs:
+            out, _ = p.communicate()
+            if p.returncode != 0:
+                print(out[-4000:])
+                raise SystemExit(f"fetch_papers.py shard failed with exit code {p.returncode}")
+        cmd = cmd + ["--merge", str(shards)]
+    proc = subprocess.run(cmd, cwd=workdir, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    wall = time.monotonic() - t0
+    if proc.returncode != 0:
+        print(proc.stdout[-4000:])
+        raise SystemExit(f"fetch_papers.py failed with exit code {proc.returncode}")
+    with open(os.path.join(workdir, "docs/papers/METRICS.json"), encoding="utf-8") as f:
+        report = json.load(f)
+    report["bench_wall_seconds"] = round(wall, 4)
+    return report
+
+
+def row(label: str, report: Dict, served: int) -> str:
+    s = report["summary"]
+    ph = report["phases"]
+    dl = s["download_seconds"]
+    outcomes = ",".join(f"{k}={v}" for k, v in sorted(s["outcomes"].items()))
+    return (f"{label:<26} {report['bench_wall_seconds']:>7.2f}s  meta {ph.get('metadata', 0):>5.2f}s  "
+            f"dl {ph.get('download', 0):>6.2f}s  md {ph.get('markdown', 0):>5.2f}s  "
+            f"p50 {dl['p50']:>5.2f}s p95 {dl['p95']:>5.2f}s  retries {s['retries']:>3}  req {served:>4}  {outcomes}")
+
+
+def main(argv: Optional[List[str]] = None):
+    ap = argparse.ArgumentParser(description="Benchmark fetch_papers.py against a local stub server.")
+    ap.add_argument("--workers", default="1,8,32", help="comma-separated worker counts, one run each")
+    ap.add_argument("--latency-ms", type=float, default=80, help="base latency added to every stub response")
+    ap.add_argument("--jitter-ms", type=float, default=40, help="uniform random extra latency")
+    ap.add_argument("--host-latency", action="append", metavar="HOST=MS", help="override latency for one upstream host")
+    ap.add_argument("--fail-rate", type=float, default=0.0, help="probability of a 503 (Retry-After: 0) per request")
+    ap.add_argument("--drop-rate", type=float, default=0.0, help="probability a PDF body is truncated mid-transfer")
+    ap.add_argument("--pdf-kb", type=int, default=256, help="approximate size of each synthetic PDF")
+    ap.add_argument("--restricted-every", type=int, default=5, help="every Nth PMID gets a non-free license (0: none)")
+    ap.add_argument("--hedge-after", type=float, help="pass --hedge-after to fetch_papers.py (0: sequential mirrors)")
+    ap.add_argument("--incremental-pass", action="store_true", help="re-run each variant with --incremental in the same directory")
+    ap.add_argument("--with-markdown", action="store_true", help="also run the PDF -> Markdown stage (needs pdfminer.six)")
+    ap.add_argument("--papers", type=int, default=0, help="synthetic registry size (default: the repo's registry)")
+    ap.add_argument("--shards", type=int, default=0, help="run N `--shard i/N` processes plus `--merge N` per pass")
+    ap.add_argument("--seed", type=int, default=1234)
+    ap.add_argument("--keep", action="store_true", help="keep the temp run directories")
+    ap.add_argument("--out", help="write all METRICS reports (plus bench settings) to this JSON file")
+    args = ap.parse_args(argv)
+
+    cfg = StubConfig(args)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(cfg))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_port}"
+    extra = [] if args.with_markdown else ["--skip-markdown"]
+    if args.hedge_after is not None:
+        extra += ["--hedge-after", str(args.hedge_after)]
+
+    results = []
+    print(f"stub at {base}; latency {args.latency_ms}+{args.jitter_ms}ms, fail {args.fail_rate}, drop {args.drop_rate}")
+    try:
+        for workers in [int(w) for w in args.workers.split(",") if w.strip()]:
+            workdir = tempfile.mkdtemp(prefix=f"aptum-bench-w{workers}-")
+            registry = write_registry(workdir, args.papers)
+            passes = [("cold", extra)] + ([("incremental", extra + ["--incremental"])] if args.incremental_pass else [])
+            for name, flags in passes:
+                before = sum(cfg.requests.values())
+                report = run_fetch(workdir, base, workers, flags + ["--registry", registry], args.shards)
+                served = sum(cfg.requests.values()) - before
+                label = f"workers={workers}{f' x{args.shards}' if args.shards > 1 else ''} {name}"
+                print(row(label, report, served))
+                results.append({"label": label, "workers": workers, "pass": name, "requests_served": served, "report": report})
+            if not args.keep:
+                shutil.rmtree(workdir, ignore_errors=True)
+    finally:
+        server.shutdown()
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump({"settings": vars(args), "runs": results}, f, indent=2)
+        print(f"wrote {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,298 @@
+"""
+Retrieval benchmark for the KB index formats (scripts/build_kb_index.py + scripts/kb_query.py).
+
+Usage:
+  python scripts/bench_kb.py [--index public/kb_index | --synthetic 2615 --dim 1536]
+                             [--variants exact,float16,int8,sharded,sharded-int8] [--k 10]
+                             [--queries 200] [--repeat 3] [--out bench-kb.json]
+  python scripts/bench_kb.py --synthetic 2615 --dim 1536 --write-golden   # regenerate the golden set
+
+Behavior:
+  - Takes chunk metadata and vectors from a built index (--index) or generates a clustered
+    synthetic corpus (--synthetic N), then rebuilds it once per variant with
+    build_kb_index.write_index into a temp directory:
+      exact         float32, one shard per kind, no ANN (the reference)
+      float16/int8  quantized, one shard per kind, no ANN
+      sharded       float16, shards cut at the default --shard-bytes, with IVF
+      sharded-int8  int8, shards cut at the default --shard-bytes, with IVF
+      half/quarter  float16, one shard per kind, no ANN, vectors truncated to 1/2 and 1/4 of
+                    the dimension and renormalized (build_kb_index.py --dim); queries are
+                    truncated the same way
+  - Golden set (docs/kb_bench/golden_queries.json): query vectors stored with relevance
+    labels (the chunk ids of one synthetic topic, some restricted by a kind filter). It is
+    generated deterministically from the synthetic corpus it names (--write-golden) and used
+    when the bench runs on that same corpus; per variant it reports golden_recall@k and
+    golden_ndcg@k (binary gain) of the cosine top-k against the labels
+  - Secondary self-queries: --queries rows of the corpus with noise added, scored against the
+    exact float32 scan, so they measure what each format loses against it
+  - Per variant: recall@k and nDCG@k of the self-query top-k (IVF probing where present)
+    against the reference exact top-k (gain = reference cosine), overlap of the MMR results
+    with the reference MMR results, p50/p99 latency of KBIndex.search (filters + probing +
+    MMR), index size on disk and build time
+  - Prints one row per variant and optionally writes everything to --out
+
+Requires numpy.
+"""
+
+from __future__ import annotations
+import argparse
+import json
+import math
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+import build_kb_index
+from kb_query import KBIndex
+
+# name -> (dtype, shard bytes, build IVF, fraction of the dimension kept)
+VARIANTS: Dict[str, Tuple[str, int, bool, float]] = {
+    "exact": ("float32", 1 << 40, False, 1.0),
+    "float16": ("float16", 1 << 40, False, 1.0),
+    "int8": ("int8", 1 << 40, False, 1.0),
+    "sharded": ("float16", build_kb_index.SHARD_BYTES, True, 1.0),
+    "sharded-int8": ("int8", build_kb_index.SHARD_BYTES, True, 1.0),
+    "half": ("float16", 1 << 40, False, 0.5),
+    "quarter": ("float16", 1 << 40, False, 0.25),
+}
+KINDS = ("paper", "note", "video_note", "video_claim")
+
+SCRIPTS = Path(__file__).resolve().parent
+GOLDEN = SCRIPTS.parent / "docs" / "kb_bench" / "golden_queries.json"
+# Golden queries whose labels are restricted to the derived (non-paper) kinds
+DERIVED_KINDS = ["note", "video_note", "video_claim"]
+# Norm of the noise added to a golden query, relative to its unit topic direction
+GOLDEN_NOISE = 4.0
+
+
+def synthetic_corpus(n: int, dim: int, seed: int = 0) -> Tuple[List[Dict], np.ndarray]:
+    """Clustered unit vectors (~n/12 topics) with the kind mix of the real index; entries carry their topic."""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(max(1, n // 12), dim))
+    topic = rng.integers(0, len(centers), n)
+    x = centers[topic] + rng.normal(scale=0.8, size=(n, dim))
+    kinds = rng.choice(KINDS, size=n, p=[0.8, 0.12, 0.03, 0.05])
+    entries = [
+        {"id": f"syn:{i}", "text": f"synthetic chunk {i} on topic {topic[i]} " + "x" * 600, "kind": str(k),
+         "license": "derived" if k != "paper" else "cc by", "topic": int(topic[i])}
+        for i, k in enumerate(kinds)
+    ]
+    return entries, x / np.linalg.norm(x, axis=1, keepdims=True)
+
+
+def index_corpus(index_dir: str) -> Tuple[List[Dict], np.ndarray]:
+    index = KBIndex(Path(index_dir))
+    shards = index.shards()
+    return [c for s in shards for c in s.chunks], np.concatenate([s.matrix for s in shards])
+
+
+def sample_queries(corpus: np.ndarray, n: int, seed: int) -> List[Dict]:
+    """`n` corpus rows with Gaussian noise (about half the norm of a unit row) as query vectors."""
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(len(corpus), size=min(n, len(corpus)), replace=False)
+    noisy = corpus[rows] + rng.normal(scale=0.5 / math.sqrt(corpus.shape[1]), size=(len(rows), corpus.shape[1]))
+    return [{"id": f"row{r}", "vector": v.tolist()} for r, v in zip(rows, noisy)]
+
+
+def golden_queries(entries: List[Dict], vectors: np.ndarray, n: int, seed: int) -> List[Dict]:
+    """`n` labelled queries over a synthetic corpus: one topic's unit centroid plus GOLDEN_NOISE times
+    as much Gaussian noise (a faint topic signal, as in a short question), relevant = that topic's chunks.
+
+    Every fourth query filters to DERIVED_KINDS and only labels the derived chunks of its topic.
+    """
+    rng = np.random.default_rng(seed)
+    by_topic: Dict[int, List[int]] = {}
+    for i, e in enumerate(entries):
+        by_topic.setdefault(e["topic"], []).append(i)
+    queries: List[Dict] = []
+    for t in rng.permutation(sorted(by_topic)):
+        if len(queries) >= n:
+            break
+        rows = by_topic[int(t)]
+        kinds = DERIVED_KINDS if len(queries) % 4 == 3 else None
+        relevant = [entries[i]["id"] for i in rows if kinds is None or entries[i]["kind"] in kinds]
+        if not relevant:
+            continue
+        centroid = vectors[rows].mean(axis=0)
+        vec = centroid / np.linalg.norm(centroid) + rng.normal(scale=GOLDEN_NOISE / math.sqrt(vectors.shape[1]), size=vectors.shape[1])
+        q = {"id": f"topic-{t}" + ("-derived" if kinds else ""), "query": f"synthetic topic {t}"}
+        if kinds:
+            q["kinds"] = kinds
+        q.update({"relevant": relevant, "vector": [round(float(v), 5) for v in vec / np.linalg.norm(vec)]})
+        queries.append(q)
+    return queries
+
+
+def load_golden(path: Path, corpus: Dict, entries: List[Dict]) -> Optional[List[Dict]]:
+    """The golden queries when `path` was generated for `corpus` and its labels exist, else None."""
+    if not path.exists():
+        return None
+    doc = json.loads(path.read_text(encoding="utf-8"))
+    ids = {e["id"] for e in entries}
+    if doc.get("corpus") != corpus or not all(set(q["relevant"]) <= ids for q in doc["queries"]):
+        return None
+    return doc["queries"]
+
+
+def write_golden(path: Path, corpus: Dict, queries: List[Dict]) -> None:
+    doc = {
+        "version": 2,
+        "description": "Golden queries for scripts/bench_kb.py: stored query vectors with relevance labels "
+                       "(chunk ids) over the synthetic corpus in `corpus`. Regenerate with "
+                       "`python scripts/bench_kb.py --synthetic N --dim D --seed S --write-golden`.",
+        "corpus": corpus,
+        "queries": queries,
+    }
+    # one query per line keeps the file diffable despite the vectors
+    head = json.dumps({key: v for key, v in doc.items() if key != "queries"}, indent=2)[:-2]
+    body = ",\n".join("    " + json.dumps(q) for q in queries)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(f'{head},\n  "queries": [\n{body}\n  ]\n}}\n', encoding="utf-8")
+
+
+def ndcg(ids: List[str], ref_scores: Dict[str, float], ideal: List[float]) -> float:
+    dcg = sum(max(0.0, ref_scores.get(i, 0.0)) / math.log2(r + 2) for r, i in enumerate(ids))
+    idcg = sum(max(0.0, s) / math.log2(r + 2) for r, s in enumerate(ideal))
+    return dcg / idcg if idcg > 0 else 1.0
+
+
+def run_variants(
+    entries: List[Dict],
+    vectors: np.ndarray,
+    queries: List[Dict],
+    names: List[str],
+    k: int,
+    repeat: int,
+    workdir: str,
+    golden: Optional[List[Dict]] = None,
+) -> List[Dict]:
+    rows: List[Dict] = []
+    ref_top: List[List[Dict]] = []
+    ref_scores: List[Dict[str, float]] = []
+    ref_mmr: List[List[str]] = []
+    for name in ["exact"] + [n for n in names if n != "exact"]:
+        dtype, shard_bytes, ann, keep = VARIANTS[name]
+        out = Path(workdir) / name
+        out.mkdir(parents=True, exist_ok=True)
+        t0 = time.perf_counter()
+        stored = build_kb_index.reduce_dim(vectors, max(1, int(vectors.shape[1] * keep)))
+        manifest = build_kb_index.write_index(out, entries, stored, dtype, shard_bytes=shard_bytes, ann=ann)
+        build_s = time.perf_counter() - t0
+        index = KBIndex(out)
+        index.shards()  # load everything up front; latency below is per query
+        if name == "exact":
+            for q in queries:
+                ranked = index.top_k(q["vector"], len(entries), q.get("kinds"), exact=True)
+                ref_top.append(ranked[:k])
+                ref_scores.append({r["id"]: r["score"] for r in ranked})
+                ref_mmr.append([r["id"] for r in index.search(q["vector"], k, q.get("kinds"), exact=True)])
+
+        recalls, ndcgs, overlaps, latencies = [], [], [], []
+        for q, top, scores, mmr_ids in zip(queries, ref_top, ref_scores, ref_mmr):
+            got = [r["id"] for r in index.top_k(q["vector"], k, q.get("kinds"), exact=False)]
+            ref_ids = [r["id"] for r in top]
+            recalls.append(len(set(got) & set(ref_ids)) / max(1, len(ref_ids)))
+            ndcgs.append(ndcg(got, scores, [r["score"] for r in top]))
+            for _ in range(repeat):
+                t = time.perf_counter()
+                res = index.search(q["vector"], k, q.get("kinds"))
+                latencies.append((time.perf_counter() - t) * 1000)
+            overlaps.append(len({r["id"] for r in res} & set(mmr_ids)) / max(1, len(mmr_ids)))
+        golden_recalls, golden_ndcgs = [], []
+        for q in golden or []:
+            got = [r["id"] for r in index.top_k(q["vector"], k, q.get("kinds"), exact=False)]
+            relevant = set(q["relevant"])
+            golden_recalls.append(len(relevant.intersection(got)) / min(k, len(relevant)))
+            golden_ndcgs.append(ndcg(got, dict.fromkeys(relevant, 1.0), [1.0] * min(k, len(relevant))))
+        if name in names:
+            row = {
+                "variant": name,
+                "dtype": dtype,
+                "dim": manifest["embedding_dim"],
+                "shards": len(manifest["shards"]),
+                "ivf": any("ivf" in sh for sh in manifest["shards"]),
+                "bytes": manifest["total_bytes"],
+                "build_s": round(build_s, 3),
+                f"recall@{k}": round(float(np.mean(recalls)), 4),
+                f"ndcg@{k}": round(float(np.mean(ndcgs)), 4),
+                "mmr_overlap": round(float(np.mean(overlaps)), 4),
+                "p50_ms": round(float(np.percentile(latencies, 50)), 3),
+                "p99_ms": round(float(np.percentile(latencies, 99)), 3),
+            }
+            if golden:
+                row[f"golden_recall@{k}"] = round(float(np.mean(golden_recalls)), 4)
+                row[f"golden_ndcg@{k}"] = round(float(np.mean(golden_ndcgs)), 4)
+            rows.append(row)
+    return rows
+
+
+def main(argv: Optional[List[str]] = None):
+    ap = argparse.ArgumentParser(description="Benchmark KB retrieval quality and latency across index variants.")
+    src = ap.add_mutually_exclusive_group()
+    src.add_argument("--index", help="built index directory to take chunks and vectors from")
+    src.add_argument("--synthetic", type=int, metavar="N", help="generate N clustered synthetic chunks instead")
+    ap.add_argument("--dim", type=int, default=1536, help="dimension of --synthetic vectors")
+    ap.add_argument("--variants", default=",".join(VARIANTS), help="comma-separated subset of: " + ", ".join(VARIANTS))
+    ap.add_argument("--golden", type=Path, default=GOLDEN, help="golden query set with stored vectors and relevance labels")
+    ap.add_argument("--golden-queries", type=int, default=24, help="queries generated by --write-golden")
+    ap.add_argument("--write-golden", action="store_true", help="(re)generate --golden from the --synthetic corpus and exit")
+    ap.add_argument("--queries", type=int, default=200, help="number of sampled self-query rows")
+    ap.add_argument("--k", type=int, default=10)
+    ap.add_argument("--repeat", type=int, default=3, help="timed searches per query and variant")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--keep", action="store_true", help="keep the temp index directories")
+    ap.add_argument("--out", help="write settings and results to this JSON file")
+    args = ap.parse_args(argv)
+
+    names = [n for n in args.variants.split(",") if n]
+    unknown = [n for n in names if n not in VARIANTS]
+    if unknown:
+        ap.error(f"unknown variants: {', '.join(unknown)}")
+    if args.write_golden and not args.synthetic:
+        ap.error("--write-golden needs --synthetic (labels come from the synthetic topics)")
+    if args.synthetic:
+        entries, vectors = synthetic_corpus(args.synthetic, args.dim, args.seed)
+        source = f"synthetic {args.synthetic}x{args.dim}"
+        corpus = {"synthetic": args.synthetic, "dim": args.dim, "seed": args.seed}
+    else:
+        entries, vectors = index_corpus(args.index or "public/kb_index")
+        source = args.index or "public/kb_index"
+        corpus = {"index": source}
+    if args.write_golden:
+        write_golden(args.golden, corpus, golden_queries(entries, vectors, args.golden_queries, args.seed))
+        print(f"Wrote {args.golden_queries} golden queries for {source} -> {args.golden}")
+        return
+    golden = load_golden(args.golden, corpus, entries)
+    queries = sample_queries(vectors, args.queries, args.seed)
+    print(f"Corpus: {source} ({len(entries)} chunks); {len(golden or [])} golden and {len(queries)} sampled queries; k={args.k}")
+    if golden is None:
+        print(f"  {args.golden} was not generated for this corpus; golden metrics skipped")
+
+    workdir = tempfile.mkdtemp(prefix="bench-kb-")
+    try:
+        rows = run_variants(entries, vectors, queries, names, args.k, args.repeat, workdir, golden)
+    finally:
+        if args.keep:
+            print(f"Indexes kept in {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    k = args.k
+    gold = f"{f'gold R@{k}':>10}{f'gold nDCG':>10}" if golden else ""
+    print(f"{'variant':<14}{'dtype':>8}{'dim':>6}{'shards':>7}{'MB':>8}{gold}{f'recall@{k}':>11}{f'nDCG@{k}':>9}{'MMR':>7}{'p50 ms':>9}{'p99 ms':>9}")
+    for r in rows:
+        gold = f"{r[f'golden_recall@{k}']:>10.4f}{r[f'golden_ndcg@{k}']:>10.4f}" if golden else ""
+        print(f"{r['variant']:<14}{r['dtype']:>8}{r['dim']:>6}{r['shards']:>7}{r['bytes'] / 1e6:>8.2f}{gold}{r[f'recall@{k}']:>11.4f}"
+              f"{r[f'ndcg@{k}']:>9.4f}{r['mmr_overlap']:>7.3f}{r['p50_ms']:>9.2f}{r['p99_ms']:>9.2f}")
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump({"source": source, "golden": len(golden or []), "queries": len(queries), "k": k, "results": rows}, f, indent=2)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,6 +3,7 @@ Build a compact local retrieval index from allowed KB sources.
 
 Sources included:
 - public/papers_md/*.md            -> kind: "paper" (free CC licenses only; already enforced upstream)
+                                      page ranges come from the matching *.pages.json offset map
 - docs/papers_notes/*.md           -> kind: "note" (derived writing)
 - docs/videos/*/notes.md           -> kind: "video_note" (derived)
 - docs/videos/*/claims.json        -> kind: "video_claim" (derived)
@@ -10,45 +11,148 @@ Sources included:
 Outputs (written under public/kb_index/):
 - manifest.json
   {
-    "version": "1.0",
+    "version": "3.0",
     "created_at": <epoch>,
     "embedding_model": "text-embedding-3-small",
     "embedding_dim": 1536,
+    "normalized": true,
+    "embedding_dtype": "float16",
+    "recall_at_10": 0.999,
     "total_chunks": N,
-    "files": ["chunks-000.json"]
+    "total_bytes": ...,
+    "files": ["chunks-note-000.json", ...],
+    "shards": [
+      { "id": "note-000", "kind": "note", "licenses": ["derived"], "chunks": n, "bytes": ...,
+        "file": "chunks-note-000.json",
+        "embeddings": { "file": "embeddings-note-000.bin", "dtype": "float16", "shape": [n, 1536],
+                        "byte_order": "little", "bytes": ...,
+                        "sections": {"vectors": {"offset": 0, "bytes": ...}} } },   # int8 adds "scales"
+      ...
+    ]
   }
-- chunks-000.json
+  A shard with at least 256 chunks also has "ivf": {"file": "ivf-<id>.bin", "nlist", "nprobe",
+  "recall_at_10", "scanned", "sections": {centroids, offsets, ids}} (scripts/kb_ann.py), and
+  the manifest gets "ann": {"type": "ivf", "recall_at_10", "scanned", ...} for the whole index.
+  Shards hold one kind each (one kind and licence with --split-license, which also sets
+  "license") and stay under ~--shard-bytes, so a filtered search only downloads its shards.
+  "bm25": {"file": "bm25.bin", "terms": "bm25-terms.json", "docs", "vocab", "postings", "avgdl",
+  "k1", "b", "stopwords", "sections": {offsets, docs, tfs, doc_len, idf}} is the lexical index
+  over the same chunks (scripts/kb_lexical.py; skipped with --no-bm25); doc ids count chunks in
+  shard order.
+  "dedup": {"method": "minhash", "threshold", "input_chunks", "kept_chunks", "dropped",
+  "boilerplate_lines", "chars_before", "chars_after", ...} reports the near-duplicate pass
+  (scripts/kb_dedup.py; skipped with --no-dedup); kept chunks list the chunks merged into
+  them under "alsoIn".
+  With --dim below 1536 the manifest also has "dimension_reduction": {"method": "truncate" | "api",
+  "source_dim": 1536, "recall_at_10"} (top-10 overlap with the full-dimension vectors).
+- embeddings-<shard>.bin: row i is the unit-normalized embedding of chunk i in chunks-<shard>.json
+  (scripts/kb_vectors.py; --dtype float32 | float16 | int8 with per-row scales), so clients score
+  with a dot product after truncating and normalizing the query the same way
+- chunks-<shard>.json (metadata only)
   [
-    { "id": "paper:PMID:35445953:c0", "text": "...", "embedding": [...],
+    { "id": "paper:PMID:35445953:c0", "text": "...",
       "kind": "paper", "license": "cc by", "pmid": "35445953",
-      "title": "...", "sourceUrl": "/public/papers/35445953.pdf" },
-    { "id": "note:PMID:40133968", "text": "...", "embedding": [...],
+      "title": "...", "sourceUrl": "/public/papers/35445953.pdf",
+      "pageStart": 3, "pageEnd": 4,
+      "alsoIn": [{"id": "note:PMID:35445953:c2", "kind": "note", "title": "...", "sourceUrl": "...", "pmid": "35445953"}] },
+    { "id": "note:PMID:40133968", "text": "...",
       "kind": "note", "license": "derived", "pmid": "40133968",
       "title": "...", "sourceUrl": "/docs/papers_notes/40133968.md" },
     { "id": "video_note:yt_DzjWEn2BS_k", ... },
     { "id": "video_claim:claim_low_vol_cut", ... }
   ]
 
+Before embedding, repeated header/footer lines are cut from paper chunks and near-identical
+chunks are merged (MinHash over word 5-grams, Jaccard >= 0.85; scripts/kb_dedup.py), so
+duplicates cost neither embeddings nor index space.
+
+The build is a generator pipeline: iter_sources() yields one source file's chunks at a
+time, dedup_stream() filters them, embed_stream() embeds windows of about
+KB_EMBED_WINDOW_TOKENS and IndexWriter writes each shard as soon as it is full, keeping
+the unit rows in a temporary file. finish() writes the last shards, measures recall by
+reading the shards back one at a time, then writes the BM25 index and manifest.json. Peak
+memory is one open shard per kind (and licence) plus a window, whatever the corpus size;
+what still grows with it are the BM25 postings (~10 bytes per term and chunk) and one
+1 KiB MinHash signature per kept chunk.
+
+Paper titles and licenses not in a file's front matter come from the shared Europe PMC
+metadata store (scripts/metadata_store.py); only PMIDs missing or expired there are fetched.
+
+Embeddings are cached in .cache/embeddings.sqlite (scripts/embedding_cache.py) under
+sha256(model, dimension, chunk text): only new or changed chunks are sent to the API, every
+batch is saved as it arrives so an interrupted build resumes, and the hit rate is printed.
+
+--dim N stores N-dimensional vectors. text-embedding-3 models are trained so a prefix of the
+vector is itself an embedding (Matryoshka representation learning): by default the full
+vectors are embedded (and cached) and cut to their first N values, then renormalized;
+--dim-source api asks the API for N dimensions instead (its `dimensions` parameter), cached
+under N.
+
 Environment:
-- Requires OPENAI_API_KEY in environment for embeddings.
+- Requires OPENAI_API_KEY in environment for embeddings (not needed when every chunk is cached).
+- Requires numpy.
+- KB_EMBED_DTYPE sets the default for --dtype, KB_EMBED_DIM the default for --dim.
+- APTUM_EMBEDDING_CACHE overrides the cache path.
+- KB_EMBED_BATCH_TOKENS (default 60000, estimated at ~4 chars/token) bounds one embeddings
+  request; KB_EMBED_WORKERS (default 8) bounds the requests in flight, which adapt to 429s
+  and x-ratelimit-remaining-* headers (AdaptiveLimiter in scripts/http_client.py);
+  KB_EMBED_RETRIES (default 6) is the number of attempts per request.
+- KB_EMBED_WINDOW_TOKENS (default 4 x KB_EMBED_BATCH_TOKENS) is how much text the build
+  embeds or reads from the cache per step.
+- OPENAI_BASE_URL overrides https://api.openai.com/v1.
 
 Usage:
-  python scripts/build_kb_index.py
+  python scripts/build_kb_index.py [--dtype float32|float16|int8] [--dim 1536] [--dim-source truncate|api]
+                                   [--workers 8] [--shard-bytes 4194304] [--split-license]
+                                   [--no-ann] [--ann-target 0.95] [--no-bm25] [--no-dedup]
 """
 
 from __future__ import annotations
+import argparse
 import os
 import re
 import json
+import tempfile
 import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
 from pathlib import Path
-from typing import Dict, List, Tuple, Optional
-import urllib.request
+from typing import Dict, Iterable, Iterator, List, Sequence, Tuple, Optional
+
+import numpy as np
+
+from embedding_cache import EmbeddingCache, embedding_key
+from http_client import AdaptiveLimiter, HttpClient
+from kb_ann import MIN_ROWS as ANN_MIN_ROWS, TARGET_RECALL, build_ivf, probed_recall, read_ivf, sample_queries, tune_nprobe, unit, write_ivf
+from kb_dedup import dedup_stream
+from kb_lexical import Bm25Builder, write_bm25
+from kb_vectors import DTYPES, matrix_row_bytes, overlap_at_k, read_matrix, write_matrix
+from metadata_store import MetadataStore
+from openai_batch import base_url
 
 ROOT = Path('.')
 PUB = ROOT / 'public'
 DOCS = ROOT / 'docs'
 
+# Shared keep-alive client: one TLS handshake to api.openai.com, retries 429/5xx with backoff
+CLIENT = HttpClient(user_agent='aptum-kb/1.0', timeout=60)
+
+EMBED_MODEL = 'text-embedding-3-small'
+# native dimension of EMBED_MODEL; --dim / KB_EMBED_DIM store fewer
+EMBED_DIM = 1536
+# Embeddings requests: estimated-token and input-count bounds per request (the API allows
+# 300k tokens and 2048 inputs), and the most requests in flight
+EMBED_BATCH_TOKENS = int(os.environ.get('KB_EMBED_BATCH_TOKENS', '60000'))
+EMBED_BATCH_INPUTS = 2048
+EMBED_WORKERS = int(os.environ.get('KB_EMBED_WORKERS', '8'))
+# Attempts per embeddings request; 429s are expected while the limiter finds the ceiling
+EMBED_RETRIES = int(os.environ.get('KB_EMBED_RETRIES', '6'))
+# Chunks embedded (or read from the cache) per step of the streaming build; a few full
+# requests' worth keeps every worker busy while bounding what is held in memory
+EMBED_WINDOW_TOKENS = int(os.environ.get('KB_EMBED_WINDOW_TOKENS', str(4 * EMBED_BATCH_TOKENS)))
+# approximate upper bound on one shard (chunk JSON + embedding rows)
+SHARD_BYTES = 4 * 1024 * 1024
+
 
 def read_json(fp: Path):
     return json.loads(fp.read_text(encoding='utf-8'))
@@ -74,70 +178,249 @@ def parse_front_matter(md: str) -> Tuple[Dict[str, str], str]:
     return {}, md
 
 
-def chunk_text(text: str, target_chars: int = 1200, overlap: int = 200) -> List[str]:
-    """Greedy paragraph-based chunking with approximate char limits."""
+def paragraphs(text: str) -> Iterator[Tuple[str, int, int]]:
+    """Yield (stripped paragraph, start, end) for blank-line separated paragraphs."""
+    pos = 0
+    for sep in list(re.finditer(r"\n\s*\n", text)) + [None]:
+        stop = sep.start() if sep else len(text)
+        raw = text[pos:stop]
+        p = raw.strip()
+        if p:
+            start = pos + len(raw) - len(raw.lstrip())
+            yield p, start, start + len(p)
+        if sep:
+            pos = sep.end()
+
+
+def chunk_spans(text: str, target_chars: int = 1200, overlap: int = 200) -> List[Tuple[str, int, int]]:
+    """chunk_text plus the approximate [start, end) character span of each chunk in `text`.
+
+    Spans follow the source paragraphs; the overlap tail carried into a chunk moves its
+    start back by at most `overlap` characters.
+    """
     # Normalize line breaks
     text = text.replace('\r\n', '\n').replace('\r', '\n')
-    paras = re.split(r"\n\s*\n", text)
-    chunks: List[str] = []
+    chunks: List[Tuple[str, int, int]] = []
     buf: List[str] = []
+    span = [0, 0]
     curr = 0
-    for p in paras:
-        p = p.strip()
-        if not p:
-            continue
+    for p, start, end in paragraphs(text):
         if curr + len(p) + 2 <= target_chars:
+            if not buf:
+                span[0] = start
             buf.append(p)
+            span[1] = end
             curr += len(p) + 2
         else:
             if buf:
-                chunks.append('\n\n'.join(buf))
+                chunks.append(('\n\n'.join(buf), span[0], span[1]))
             # start new buffer; try to preserve some overlap from previous
             if overlap > 0 and chunks:
-                tail = chunks[-1][-overlap:]
+                tail = chunks[-1][0][-overlap:]
                 buf = [tail, p]
+                span = [max(chunks[-1][1], chunks[-1][2] - len(tail)), end]
                 curr = len(tail) + len(p) + 2
             else:
                 buf = [p]
+                span = [start, end]
                 curr = len(p)
     if buf:
-        chunks.append('\n\n'.join(buf))
+        chunks.append(('\n\n'.join(buf), span[0], span[1]))
     # post-process: trim overly long chunk tails
-    out = [c.strip()[: target_chars + 200] for c in chunks if c.strip()]
+    out = []
+    for c, start, end in chunks:
+        c = c.strip()[: target_chars + 200]
+        if c:
+            out.append((c, start, min(end, start + len(c))))
     return out
 
 
-def openai_embed_batch(texts: List[str], model: str = 'text-embedding-3-small') -> List[List[float]]:
+def chunk_text(text: str, target_chars: int = 1200, overlap: int = 200) -> List[str]:
+    """Greedy paragraph-based chunking with approximate char limits."""
+    return [c for c, _, _ in chunk_spans(text, target_chars, overlap)]
+
+
+def load_page_map(md_fp: Path, sha256: Optional[str]) -> List[Dict]:
+    """Page offsets written by extract_markdown.py (<stem>.pages.json), if they match this Markdown."""
+    fp = md_fp.with_suffix('.pages.json')
+    if not fp.exists():
+        return []
+    try:
+        data = read_json(fp)
+    except Exception:
+        return []
+    if sha256 and data.get('sha256') != sha256:
+        return []
+    return data.get('pages') or []
+
+
+def page_range(pages: List[Dict], start: int, end: int) -> Tuple[Optional[int], Optional[int]]:
+    """First and last page whose text overlaps the [start, end) span of the body."""
+    hit = [pg['page'] for pg in pages if pg['end'] > pg['start'] and pg['start'] < end and start < pg['end']]
+    return (hit[0], hit[-1]) if hit else (None, None)
+
+
+def openai_embed_batch(
+    texts: List[str],
+    model: str = EMBED_MODEL,
+    limiter: Optional[AdaptiveLimiter] = None,
+    dimensions: Optional[int] = None,
+) -> List[List[float]]:
     api_key = os.environ.get('OPENAI_API_KEY')
     if not api_key:
         raise RuntimeError('OPENAI_API_KEY is not set for embedding build')
-    body = json.dumps({"model": model, "input": texts}).encode()
-    req = urllib.request.Request(
-        'https://api.openai.com/v1/embeddings',
-        data=body,
-        headers={
-            'Authorization': f'Bearer {api_key}',
-            'Content-Type': 'application/json'
-        }
-    )
-    with urllib.request.urlopen(req, timeout=60) as resp:
-        data = json.loads(resp.read().decode())
-    embs = [item['embedding'] for item in data.get('data', [])]
+    body: Dict = {"model": model, "input": texts}
+    if dimensions:
+        body["dimensions"] = dimensions
+    with limiter.slot() if limiter else nullcontext():
+        data = CLIENT.post_json(
+            f'{base_url()}/embeddings',
+            body,
+            headers={'Authorization': f'Bearer {api_key}'},
+            retries=EMBED_RETRIES,
+            on_response=limiter.observe if limiter else None,
+        )
+    items = sorted(data.get('data', []), key=lambda item: item.get('index', 0))
+    embs = [item['embedding'] for item in items]
     if len(embs) != len(texts):
         raise RuntimeError('Embedding count mismatch')
     return embs  # type: ignore
 
 
-def collect_sources() -> List[Dict]:
-    # Load paper metadata index for titles/licenses/links
+def estimate_tokens(text: str) -> int:
+    # ~4 characters per token for English prose; generous enough to stay under request limits
+    return len(text) // 4 + 1
+
+
+def token_batches(texts: List[str], max_tokens: int = EMBED_BATCH_TOKENS, max_inputs: int = EMBED_BATCH_INPUTS) -> List[List[int]]:
+    """Indices of `texts` packed in order into requests of at most max_tokens / max_inputs."""
+    batches: List[List[int]] = []
+    current: List[int] = []
+    used = 0
+    for i, t in enumerate(texts):
+        cost = estimate_tokens(t)
+        if current and (used + cost > max_tokens or len(current) >= max_inputs):
+            batches.append(current)
+            current, used = [], 0
+        current.append(i)
+        used += cost
+    if current:
+        batches.append(current)
+    return batches
+
+
+def embed_texts(
+    texts: List[str],
+    cache: EmbeddingCache,
+    max_tokens: int = EMBED_BATCH_TOKENS,
+    max_inputs: int = EMBED_BATCH_INPUTS,
+    workers: int = EMBED_WORKERS,
+    dimensions: Optional[int] = None,
+    limiter: Optional[AdaptiveLimiter] = None,
+) -> Tuple[List[List[float]], Dict]:
+    """Embeddings for `texts` in input order, calling the API only for cache misses.
+
+    Misses are packed into token-bounded requests (token_batches) and sent on a thread
+    pool; an AdaptiveLimiter keeps the number in flight below what the rate limits allow.
+    Each batch is written to the cache as soon as it returns, so a build that dies halfway
+    keeps its progress. `dimensions` is sent as the API's `dimensions` parameter and is part
+    of the cache key. Pass `limiter` to carry the learned concurrency across calls.
+    Returns (vectors, {"requests", "concurrency", "seconds"}).
+    """
+    keys = [embedding_key(t, EMBED_MODEL, dimensions or EMBED_DIM) for t in texts]
+    found = cache.get_many(keys)
+    # identical chunk texts share one key and one API slot
+    todo = list(dict.fromkeys(k for k in keys if k not in found))
+    text_of = dict(zip(keys, texts))
+    missing = sum(1 for k in keys if k not in found)
+    cache.hits += len(keys) - missing
+    cache.misses += missing
+
+    workers = max(1, workers)
+    limiter = limiter or AdaptiveLimiter(initial=min(4, workers), maximum=workers)
+
+    def run(batch: List[str]) -> None:
+        embs = openai_embed_batch([text_of[k] for k in batch], limiter=limiter, dimensions=dimensions)
+        fresh = dict(zip(batch, embs))
+        cache.put_many(fresh)
+        found.update(fresh)
+
+    batches = [[todo[i] for i in b] for b in token_batches([text_of[k] for k in todo], max_tokens, max_inputs)]
+    t0 = time.monotonic()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(run, batches))
+    stats = {"requests": len(batches), "concurrency": limiter.stats(), "seconds": round(time.monotonic() - t0, 3)}
+    return [found[k] for k in keys], stats
+
+
+def embed_stream(
+    entries: Iterable[Dict],
+    cache: EmbeddingCache,
+    stats: Dict,
+    window_tokens: int = EMBED_WINDOW_TOKENS,
+    workers: int = EMBED_WORKERS,
+    dimensions: Optional[int] = None,
+) -> Iterator[Tuple[Dict, List[float]]]:
+    """(entry, embedding) pairs in input order, embedding windows of about `window_tokens`.
+
+    Each window goes through embed_texts with one shared AdaptiveLimiter, so only a window's
+    texts and vectors are held at a time. `stats` accumulates {"requests", "seconds"} and
+    ends with the limiter's "concurrency".
+    """
+    workers = max(1, workers)
+    limiter = AdaptiveLimiter(initial=min(4, workers), maximum=workers)
+    stats.update(requests=0, seconds=0.0, concurrency=limiter.stats())
+    window: List[Dict] = []
+    used = 0
+
+    def flush() -> Iterator[Tuple[Dict, List[float]]]:
+        vectors, st = embed_texts([e['text'] for e in window], cache, workers=workers, dimensions=dimensions, limiter=limiter)
+        stats['requests'] += st['requests']
+        stats['seconds'] = round(stats['seconds'] + st['seconds'], 3)
+        stats['concurrency'] = st['concurrency']
+        yield from zip(window, vectors)
+
+    for e in entries:
+        window.append(e)
+        used += estimate_tokens(e['text'])
+        if used >= window_tokens:
+            yield from flush()
+            window, used = [], 0
+    if window:
+        yield from flush()
+
+
+def paper_metadata(pmids: List[str]) -> Dict[str, Dict]:
+    """Title/license per PMID from the shared metadata store, archive links from index.json."""
     paper_index = (PUB / 'papers' / 'index.json')
     idx = read_json(paper_index) if paper_index.exists() else {"papers": []}
-    pmid_meta: Dict[str, Dict] = {m.get('pmid'): m for m in idx.get('papers', [])}
+    pmid_meta: Dict[str, Dict] = {m['pmid']: dict(m) for m in idx.get('papers', []) if m.get('pmid')}
+    store = MetadataStore()
+    try:
+        records = store.resolve(pmids, client=CLIENT)
+    except Exception as e:
+        print('Europe PMC unavailable, using stored metadata only:', e)
+        records = store.resolve(pmids, offline=True)
+    store.close()
+    print(f"Metadata store: {store.summary()}")
+    for pmid, rec in records.items():
+        m = pmid_meta.setdefault(pmid, {})
+        m['title'] = rec.get('title') or m.get('title') or ''
+        m['license'] = (rec.get('license') or m.get('license') or '').lower()
+    return pmid_meta
+
+
+def iter_sources() -> Iterator[List[Dict]]:
+    """Chunk entries of one source file at a time (a paper, a note, a video's notes or claims)."""
+    papers_md_dir = PUB / 'papers_md'
+    notes_dir = DOCS / 'papers_notes'
+    stems = [fp.stem for d in (papers_md_dir, notes_dir) if d.exists() for fp in d.glob('*.md')]
+    pmid_meta = paper_metadata(sorted({s for s in stems if s.isdigit()}))
 
-    entries: List[Dict] = []
+    # running chunk count, part of the fallback id of claims without one
+    count = 0
 
     # 1) Free paper markdown
-    papers_md_dir = PUB / 'papers_md'
     if papers_md_dir.exists():
         for md_fp in sorted(papers_md_dir.glob('*.md')):
             pmid = md_fp.stem
@@ -151,9 +434,10 @@ def collect_sources() -> List[Dict]:
                 src = f"/public/papers/{pmid}.pdf"
             else:
                 src = pmid_meta.get(pmid, {}).get('pdf_url') or pmid_meta.get(pmid, {}).get('source') or ''
-            chunks = chunk_text(body)
-            for i, ch in enumerate(chunks):
-                entries.append({
+            pages = load_page_map(md_fp, fm.get('sha256'))
+            entries: List[Dict] = []
+            for i, (ch, start, end) in enumerate(chunk_spans(body)):
+                entry = {
                     'id': f'paper:PMID:{pmid}:c{i}',
                     'text': ch,
                     'kind': 'paper',
@@ -161,10 +445,16 @@ def collect_sources() -> List[Dict]:
                     'pmid': pmid,
                     'title': title,
                     'sourceUrl': src
-                })
+                }
+                page_start, page_end = page_range(pages, start, end)
+                if page_start is not None:
+                    entry['pageStart'] = page_start
+                    entry['pageEnd'] = page_end
+                entries.append(entry)
+            count += len(entries)
+            yield entries
 
     # 2) Notes for restricted/unknown license papers (derived)
-    notes_dir = DOCS / 'papers_notes'
     if notes_dir.exists():
         for note_fp in sorted(notes_dir.glob('*.md')):
             pmid = note_fp.stem
@@ -172,16 +462,16 @@ def collect_sources() -> List[Dict]:
             fm, body = parse_front_matter(md)
             title = fm.get('title') or (pmid_meta.get(pmid, {}).get('title') or '')
             chunks = chunk_text(body, target_chars=1000, overlap=120)
-            for i, ch in enumerate(chunks):
-                entries.append({
-                    'id': f'note:PMID:{pmid}:c{i}',
-                    'text': ch,
-                    'kind': 'note',
-                    'license': 'derived',
-                    'pmid': pmid,
-                    'title': title,
-                    'sourceUrl': f'/docs/papers_notes/{pmid}.md'
-                })
+            count += len(chunks)
+            yield [{
+                'id': f'note:PMID:{pmid}:c{i}',
+                'text': ch,
+                'kind': 'note',
+                'license': 'derived',
+                'pmid': pmid,
+                'title': title,
+                'sourceUrl': f'/docs/papers_notes/{pmid}.md'
+            } for i, ch in enumerate(chunks)]
 
     # 3) Video notes and claims (derived)
     videos_dir = DOCS / 'videos'
@@ -200,24 +490,25 @@ def collect_sources() -> List[Dict]:
             if nfp.exists():
                 body = read_text(nfp)
                 chunks = chunk_text(body, target_chars=1000, overlap=120)
-                for i, ch in enumerate(chunks):
-                    entries.append({
-                        'id': f'video_note:{vid}:c{i}',
-                        'text': ch,
-                        'kind': 'video_note',
-                        'license': 'derived',
-                        'videoId': vid,
-                        'title': vtitle,
-                        'sourceUrl': vurl or f'/docs/videos/{sub.name}/notes.md'
-                    })
+                count += len(chunks)
+                yield [{
+                    'id': f'video_note:{vid}:c{i}',
+                    'text': ch,
+                    'kind': 'video_note',
+                    'license': 'derived',
+                    'videoId': vid,
+                    'title': vtitle,
+                    'sourceUrl': vurl or f'/docs/videos/{sub.name}/notes.md'
+                } for i, ch in enumerate(chunks)]
 
             # claims.json
             cfp = sub / 'claims.json'
             if cfp.exists():
+                entries = []
                 try:
                     claims = read_json(cfp)
                     for claim in claims:
-                        cid = claim.get('id') or f'claim:{vid}:{len(entries)}'
+                        cid = claim.get('id') or f'claim:{vid}:{count + len(entries)}'
                         text = claim.get('text') or ''
                         if not text.strip():
                             continue
@@ -232,52 +523,354 @@ def collect_sources() -> List[Dict]:
                         })
                 except Exception:
                     pass
-
-    return entries
-
-
-def main():
+                count += len(entries)
+                yield entries
+
+
+def reduce_dim(embeddings, dim: Optional[int] = None) -> np.ndarray:
+    """Unit rows of the first `dim` columns (all columns when dim is None).
+
+    For text-embedding-3 vectors this is Matryoshka truncation; renormalizing keeps cosine
+    a dot product.
+    """
+    matrix = np.asarray(embeddings, dtype=np.float64).reshape(len(embeddings), -1)
+    if dim and dim < matrix.shape[1]:
+        matrix = matrix[:, :dim]
+    return unit(matrix)
+
+
+def shard_label(kind: str, lic: str, split_license: bool) -> str:
+    return kind + (f"-{re.sub(r'[^a-z0-9]+', '_', lic.lower()).strip('_') or 'unknown'}" if split_license else '')
+
+
+class IndexWriter:
+    """Streaming writer for the sharded index: add() chunks one at a time, finish() writes the manifest.
+
+    Chunks are grouped by kind (and licence) into open shards; a shard is written - chunk
+    JSON, embedding matrix, IVF index - as soon as the next chunk would take it past
+    `shard_bytes` (chunk JSON plus embedding rows; one oversized chunk still gets a shard of
+    its own), and only its BM25 postings are kept. The unit float32 rows also go to a
+    temporary file, which finish() reads back shard by shard to measure recall against the
+    stored (quantized) rows and the IVF probes, so memory stays at one shard per open group
+    whatever the corpus size. With `dim`, rows are truncated to `dim` dimensions and the full
+    ones are kept in the temporary file too, for the recall of the reduction.
+    """
+
+    def __init__(
+        self,
+        out_dir: Path,
+        dtype: str,
+        shard_bytes: int = SHARD_BYTES,
+        split_license: bool = False,
+        ann: bool = True,
+        ann_target: float = TARGET_RECALL,
+        bm25: bool = True,
+        dim: Optional[int] = None,
+    ):
+        self.out_dir = Path(out_dir)
+        self.dtype, self.shard_bytes, self.split_license = dtype, shard_bytes, split_license
+        self.ann, self.ann_target, self.dim = ann, ann_target, dim
+        self.lexical = Bm25Builder() if bm25 else None
+        self.tmp = tempfile.TemporaryDirectory(prefix='kb-index-')
+        self.rows_fp = (Path(self.tmp.name) / 'rows.f32').open('wb')
+        self.full_fp = (Path(self.tmp.name) / 'full.f32').open('wb') if dim else None
+        self.open: Dict[Tuple[str, str], Dict] = {}
+        self.counts: Dict[str, int] = {}
+        # (group, shard descriptor, first row in the temporary file, BM25 part)
+        self.written: List[Tuple[Tuple[str, str], Dict, int, Optional[int]]] = []
+        self.width: Optional[int] = None
+        self.rows = 0
+
+    def add(self, entry: Dict, vector: Sequence[float], merged: Optional[Dict[str, List[Dict]]] = None) -> None:
+        """Queue one chunk; `merged` (kb_dedup) supplies "alsoIn" for chunks of the shards written."""
+        full = np.asarray(vector, dtype=np.float64).reshape(-1)
+        row = unit(full[: self.dim] if self.dim else full)
+        if self.width is None:
+            self.width = len(row)
+        elif len(row) != self.width:
+            raise RuntimeError(f'Embedding of {entry.get("id")} has {len(row)} dimensions, expected {self.width}')
+        row_bytes = matrix_row_bytes(len(row), self.dtype)
+        lic = entry.get('license', '') if self.split_license else ''
+        key = (entry['kind'], lic)
+        cost = len(json.dumps(entry)) + row_bytes
+        group = self.open.get(key)
+        if group and group['size'] + cost > self.shard_bytes:
+            self._write(key, merged)
+            group = None
+        if group is None:
+            group = self.open[key] = {'entries': [], 'rows': [], 'full': [], 'size': 0}
+        group['entries'].append(entry)
+        group['rows'].append(row)
+        if self.full_fp:
+            group['full'].append(unit(full).astype(np.float32))
+        group['size'] += cost
+
+    def _write(self, key: Tuple[str, str], merged: Optional[Dict[str, List[Dict]]]) -> None:
+        group = self.open.pop(key)
+        kind, lic = key
+        label = shard_label(kind, lic, self.split_license)
+        n = self.counts.get(label, 0)
+        self.counts[label] = n + 1
+        sid = f"{label}-{n:03d}"
+        entries = group['entries']
+        if merged:
+            entries = [dict(e, alsoIn=e.get('alsoIn', []) + merged.pop(e['id'])) if e['id'] in merged else e for e in entries]
+        rows = np.stack(group['rows'])
+        chunks_name = f"chunks-{sid}.json"
+        with (self.out_dir / chunks_name).open('w', encoding='utf-8') as f:
+            json.dump(entries, f)
+        desc = write_matrix(self.out_dir / f"embeddings-{sid}.bin", rows, self.dtype)
+        ivf_desc = None
+        if self.ann and len(rows) >= ANN_MIN_ROWS:
+            # built from the stored (quantized) rows, which is what the client scores
+            stored = read_matrix(self.out_dir, desc)
+            ivf = build_ivf(stored)
+            ivf_desc = write_ivf(self.out_dir / f"ivf-{sid}.bin", ivf)
+            ivf_desc.update(tune_nprobe(stored, ivf, self.ann_target))
+        shard = {
+            'id': sid,
+            'kind': kind,
+            'licenses': sorted({e.get('license', '') for e in entries}),
+            'chunks': len(entries),
+            'bytes': (self.out_dir / chunks_name).stat().st_size + desc['bytes'] + (ivf_desc['bytes'] if ivf_desc else 0),
+            'file': chunks_name,
+            'embeddings': desc,
+        }
+        if ivf_desc:
+            shard['ivf'] = ivf_desc
+        if self.split_license:
+            shard['license'] = lic
+        self.rows_fp.write(rows.astype(np.float32).tobytes())
+        if self.full_fp:
+            self.full_fp.write(np.stack(group['full']).tobytes())
+        part = self.lexical.add(e['text'] for e in entries) if self.lexical else None
+        self.written.append((key, shard, self.rows, part))
+        self.rows += len(entries)
+
+    def _patch(self, merged: Dict[str, List[Dict]], shards: List[Dict]) -> None:
+        """Add "alsoIn" to chunks of shards written before their duplicates turned up."""
+        for shard in shards:
+            if not merged:
+                return
+            fp = self.out_dir / shard['file']
+            chunks = read_json(fp)
+            if not any(c['id'] in merged for c in chunks):
+                continue
+            for c in chunks:
+                if c['id'] in merged:
+                    c.setdefault('alsoIn', []).extend(merged.pop(c['id']))
+            before = fp.stat().st_size
+            with fp.open('w', encoding='utf-8') as f:
+                json.dump(chunks, f)
+            shard['bytes'] += fp.stat().st_size - before
+
+    def _rows(self, name: str, width: int, first: int, count: int) -> np.ndarray:
+        """`count` rows from `first` on of a temporary row file."""
+        return np.fromfile(Path(self.tmp.name) / name, dtype=np.float32, count=count * width, offset=first * width * 4).reshape(count, width)
+
+    def _blocks(self, name: str, width: int, placed: List[Tuple[Dict, int]]) -> Iterator[np.ndarray]:
+        """Rows of each shard, in manifest order, from a temporary row file."""
+        for shard, first in placed:
+            yield self._rows(name, width, first, shard['chunks'])
+
+    def finish(self, merged: Optional[Dict[str, List[Dict]]] = None, reduction: Optional[Dict] = None, dedup: Optional[Dict] = None) -> Dict:
+        """Write the open shards, BM25 index and manifest.json; returns the manifest.
+
+        Shards are listed by kind (and licence), then number, as they were before the build
+        streamed. `reduction` (see main) is recorded when the vectors were cut to fewer
+        dimensions (its recall_at_10 is filled in when this writer did the truncation),
+        `dedup` (kb_dedup report) when chunks were merged. Files left over from an earlier
+        build are removed.
+        """
+        try:
+            for key in sorted(self.open):
+                self._write(key, merged)
+            self.rows_fp.close()
+            if self.full_fp:
+                self.full_fp.close()
+            written = sorted(self.written, key=lambda w: (w[0], w[1]['id']))
+            shards = [w[1] for w in written]
+            if merged:
+                self._patch(merged, shards)
+            keep = {sh['file'] for sh in shards} | {sh['embeddings']['file'] for sh in shards}
+            keep |= {sh['ivf']['file'] for sh in shards if sh.get('ivf')}
+            for pattern in ('chunks-*.json', 'embeddings-*.bin', 'ivf-*.bin', 'bm25*'):
+                for old in list(self.out_dir.glob(pattern)):
+                    if old.name not in keep:
+                        old.unlink()
+
+            width = self.width or 0
+            placed = [(w[1], w[2]) for w in written]
+            recall, ann_recall, n = 1.0, None, self.rows
+            if n > 1:
+                picks = sample_queries(n)
+                k = min(10, n - 1)
+                # picks count chunks in manifest order; map them to rows of the temporary files
+                first = np.cumsum([0] + [sh['chunks'] for sh in shards])
+                at = np.searchsorted(first, picks, side='right') - 1
+                rows = np.array([placed[s][1] for s in at]) + (picks - first[at])
+                queries = np.concatenate([self._rows('rows.f32', width, r, 1) for r in rows])
+                stored = (unit(read_matrix(self.out_dir, sh['embeddings'])) for sh in shards)
+                recall = overlap_at_k(queries, self._blocks('rows.f32', width, placed), queries, stored, picks, k)
+                if reduction is not None and self.dim:
+                    fwidth = (Path(self.tmp.name) / 'full.f32').stat().st_size // (4 * n)
+                    fq = np.concatenate([self._rows('full.f32', fwidth, r, 1) for r in rows])
+                    reduction['recall_at_10'] = round(overlap_at_k(
+                        fq, self._blocks('full.f32', fwidth, placed), queries, self._blocks('rows.f32', width, placed), picks, k), 4)
+                if any(sh.get('ivf') for sh in shards):
+                    parts = (
+                        (unit(read_matrix(self.out_dir, sh['embeddings'])),
+                         read_ivf(self.out_dir, sh['ivf']) if sh.get('ivf') else None,
+                         sh['ivf']['nprobe'] if sh.get('ivf') else 0)
+                        for sh in shards
+                    )
+                    ann_recall = probed_recall(queries, picks, parts, k)
+        finally:
+            self.tmp.cleanup()
+
+        manifest = {
+            'version': '3.0',
+            'created_at': time.time(),
+            'embedding_model': EMBED_MODEL,
+            'embedding_dim': width,
+            # rows (and IVF centroids) have unit length: cosine is a dot product
+            'normalized': True,
+            'embedding_dtype': self.dtype,
+            'recall_at_10': round(recall, 4),
+            'total_chunks': n,
+            'total_bytes': sum(sh['bytes'] for sh in shards),
+            'files': [sh['file'] for sh in shards],
+            'shards': shards,
+        }
+        if reduction:
+            manifest['dimension_reduction'] = reduction
+        if dedup:
+            manifest['dedup'] = dedup
+        if self.lexical:
+            manifest['bm25'] = write_bm25(self.out_dir, self.lexical.finish([w[3] for w in written]))
+        if ann_recall:
+            manifest['ann'] = {
+                'type': 'ivf',
+                'metric': 'cosine',
+                'min_rows': ANN_MIN_ROWS,
+                'target_recall': self.ann_target,
+                # whole index: probe every shard, merge, compare with an exact scan
+                'recall_at_10': round(ann_recall[0], 4),
+                'scanned': round(ann_recall[1], 4),
+            }
+        with (self.out_dir / 'manifest.json').open('w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2)
+        return manifest
+
+
+def write_index(
+    out_dir: Path,
+    entries: List[Dict],
+    embeddings: List[List[float]],
+    dtype: str,
+    shard_bytes: int = SHARD_BYTES,
+    split_license: bool = False,
+    ann: bool = True,
+    ann_target: float = TARGET_RECALL,
+    reduction: Optional[Dict] = None,
+    bm25: bool = True,
+    dedup_report: Optional[Dict] = None,
+) -> Dict:
+    """IndexWriter over in-memory entries and vectors (already reduced; `reduction` is recorded as is).
+
+    Writes one chunk-metadata JSON and one binary embedding matrix per shard, then
+    manifest.json; with `ann`, shards of at least kb_ann.MIN_ROWS chunks also get an IVF index
+    (ivf-<id>.bin) whose nprobe is tuned to `ann_target` recall@10, with `bm25` a BM25 index
+    over all chunks in shard order. Returns the manifest.
+    """
+    if len(embeddings) != len(entries):
+        raise RuntimeError('Embeddings length mismatch with entries')
+    writer = IndexWriter(out_dir, dtype, shard_bytes, split_license, ann, ann_target, bm25)
+    for entry, vector in zip(entries, embeddings):
+        writer.add(entry, vector)
+    return writer.finish(reduction=reduction, dedup=dedup_report)
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    ap = argparse.ArgumentParser(description='Build the local KB retrieval index.')
+    ap.add_argument('--dtype', choices=DTYPES, default=os.environ.get('KB_EMBED_DTYPE', 'float16'),
+                    help='storage type of the embedding matrices (default: float16 or $KB_EMBED_DTYPE)')
+    ap.add_argument('--dim', type=int, default=int(os.environ.get('KB_EMBED_DIM', EMBED_DIM)),
+                    help=f'stored embedding dimension, at most {EMBED_DIM} (default: {EMBED_DIM} or $KB_EMBED_DIM)')
+    ap.add_argument('--dim-source', choices=('truncate', 'api'), default='truncate',
+                    help='cut cached full vectors to --dim (default) or request --dim from the API')
+    ap.add_argument('--workers', type=int, default=EMBED_WORKERS,
+                    help='upper bound on concurrent embeddings requests (default: 8 or $KB_EMBED_WORKERS)')
+    ap.add_argument('--shard-bytes', type=int, default=SHARD_BYTES,
+                    help='approximate upper bound per shard, chunk JSON plus embeddings (default: %(default)s)')
+    ap.add_argument('--split-license', action='store_true',
+                    help='partition shards by licence as well as by kind')
+    ap.add_argument('--no-ann', dest='ann', action='store_false',
+                    help='skip the IVF index; clients scan every chunk of a shard')
+    ap.add_argument('--ann-target', type=float, default=TARGET_RECALL,
+                    help='recall@10 each IVF shard is tuned to (default: %(default)s)')
+    ap.add_argument('--no-bm25', dest='bm25', action='store_false',
+                    help='skip the BM25 lexical index; clients can only run vector search')
+    ap.add_argument('--no-dedup', dest='dedup', action='store_false',
+                    help='embed every chunk, without boilerplate stripping or near-duplicate merging')
+    args = ap.parse_args(argv)
+    if not 0 < args.dim <= EMBED_DIM:
+        ap.error(f'--dim must be between 1 and {EMBED_DIM}')
+    return args
+
+
+def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
     out_dir = PUB / 'kb_index'
     out_dir.mkdir(parents=True, exist_ok=True)
 
-    entries = collect_sources()
-    texts = [e['text'] for e in entries]
-    embeddings: List[List[float]] = []
-    # embed in batches of up to 96 to stay safe
-    BATCH = 96
-    for i in range(0, len(texts), BATCH):
-        batch = texts[i : i + BATCH]
-        if not batch:
-            continue
-        embs = openai_embed_batch(batch)
-        embeddings.extend(embs)
-        time.sleep(0.2)
-
-    # Attach embeddings
-    if len(embeddings) != len(entries):
-        raise RuntimeError('Embeddings length mismatch with entries')
-    for e, vec in zip(entries, embeddings):
-        e['embedding'] = vec
-
-    # Write output
-    chunks_fp = out_dir / 'chunks-000.json'
-    manifest_fp = out_dir / 'manifest.json'
-
-    with chunks_fp.open('w', encoding='utf-8') as f:
-        json.dump(entries, f)
-
-    manifest = {
-        'version': '1.0',
-        'created_at': time.time(),
-        'embedding_model': 'text-embedding-3-small',
-        'embedding_dim': 1536,
-        'total_chunks': len(entries),
-        'files': ['chunks-000.json'],
-    }
-    with manifest_fp.open('w', encoding='utf-8') as f:
-        json.dump(manifest, f, indent=2)
-
-    print(f"KB index built: {len(entries)} chunks -> {manifest_fp}")
+    # sources -> chunks -> (dedup) -> embeddings -> shard files; each stage pulls from the last
+    merged: Dict[str, List[Dict]] = {}
+    dedup_report: Dict = {}
+    sources = iter_sources()
+    entries = dedup_stream(sources, merged, dedup_report) if args.dedup else (e for src in sources for e in src)
+    reduced = args.dim < EMBED_DIM
+    dimensions = args.dim if reduced and args.dim_source == 'api' else None
+    truncate = args.dim if reduced and args.dim_source == 'truncate' else None
+    writer = IndexWriter(out_dir, args.dtype, args.shard_bytes, args.split_license, args.ann, args.ann_target,
+                         args.bm25, dim=truncate)
+    stats: Dict = {}
+    cache = EmbeddingCache()
+    try:
+        for entry, vector in embed_stream(entries, cache, stats, workers=args.workers, dimensions=dimensions):
+            writer.add(entry, vector, merged)
+    finally:
+        cache.close()
+    c = stats['concurrency']
+    print(f"Embedding cache: {cache.summary()}; {stats['requests']} embeddings requests in {stats['seconds']:.1f}s "
+          f"(concurrency peak {c['peak']}, final {c['limit']}, {c['throttled']} throttled responses)")
+    if args.dedup:
+        d = dedup_report
+        print(f"Dedup: {d['input_chunks']} -> {d['kept_chunks']} chunks ({d['dropped']} near-duplicates merged, "
+              f"{d['empty_after_boilerplate']} boilerplate-only dropped, {d['boilerplate_lines']} boilerplate lines cut); "
+              f"{d['chars_before']} -> {d['chars_after']} chars "
+              f"({1 - d['chars_after'] / max(1, d['chars_before']):.1%} less text to embed)")
+
+    # api vectors have no full-dimension counterpart to compare with here
+    reduction = {'method': args.dim_source, 'source_dim': EMBED_DIM} if reduced else None
+    manifest = writer.finish(merged, reduction, dedup_report if args.dedup else None)
+    n = manifest['total_chunks']
+    emb_bytes = sum(sh['embeddings']['bytes'] for sh in manifest['shards'])
+    print(f"Embeddings: {args.dtype} {n}x{manifest['embedding_dim']} unit rows, {emb_bytes} bytes "
+          f"({emb_bytes / max(1, n):.0f} per chunk), recall@10 {manifest['recall_at_10']:.4f}")
+    if reduction and 'recall_at_10' in reduction:
+        print(f"Dimension: {EMBED_DIM} -> {args.dim} by truncation, recall@10 {reduction['recall_at_10']:.4f} vs full vectors")
+    for sh in manifest['shards']:
+        ivf = sh.get('ivf')
+        ann = f" ivf nlist {ivf['nlist']} nprobe {ivf['nprobe']} recall@10 {ivf['recall_at_10']:.3f}" if ivf else ''
+        print(f"  shard {sh['id']:<24} {sh['chunks']:>5} chunks {sh['bytes']:>10} bytes{ann}")
+    if 'bm25' in manifest:
+        lex = manifest['bm25']
+        print(f"BM25: {lex['vocab']} terms, {lex['postings']} postings, {lex['bytes']} bytes")
+    if 'ann' in manifest:
+        a = manifest['ann']
+        print(f"ANN: recall@10 {a['recall_at_10']:.4f} vs exact search, scoring {a['scanned']:.1%} of chunks per query")
+    print(f"KB index built: {n} chunks -> {out_dir / 'manifest.json'}")
 
 
 if __name__ == '__main__':
@@ -0,0 +1,80 @@
+"""
+On-disk embedding cache for build_kb_index.py.
+
+Behavior:
+  - Keeps one vector per chunk in SQLite (.cache/embeddings.sqlite by default), keyed by
+    sha256 of the embedding model, dimension and chunk text; any change to one of them is
+    a miss, so stale vectors are never served
+  - Vectors are stored as float64 blobs, so cached and freshly fetched embeddings write
+    byte-identical index files
+  - put_many() commits immediately; the build stores every batch as soon as it comes back,
+    so an interrupted build resumes where it stopped
+
+Environment:
+  - APTUM_EMBEDDING_CACHE overrides the database path
+"""
+
+from __future__ import annotations
+import hashlib
+import os
+import sqlite3
+import threading
+from array import array
+from typing import Dict, Iterable, List
+
+CACHE_PATH = os.environ.get("APTUM_EMBEDDING_CACHE", ".cache/embeddings.sqlite")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS embeddings (
+    key TEXT PRIMARY KEY,
+    vector BLOB NOT NULL
+)
+"""
+
+
+def embedding_key(text: str, model: str, dim: int) -> str:
+    return hashlib.sha256(f"{model}\0{dim}\0{text}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """sha256(model, dim, text) -> embedding vector."""
+
+    def __init__(self, path: str = CACHE_PATH):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(SCHEMA)
+        self._db.commit()
+        self._lock = threading.Lock()
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, List[float]]:
+        wanted = list(dict.fromkeys(keys))
+        out: Dict[str, List[float]] = {}
+        with self._lock:
+            # stay well below SQLite's bound-parameter limit
+            for start in range(0, len(wanted), 500):
+                batch = wanted[start : start + 500]
+                marks = ",".join("?" * len(batch))
+                for key, blob in self._db.execute(f"SELECT key, vector FROM embeddings WHERE key IN ({marks})", batch):
+                    out[key] = array("d", blob).tolist()
+        return out
+
+    def put_many(self, vectors: Dict[str, List[float]]) -> None:
+        rows = [(key, array("d", vec).tobytes()) for key, vec in vectors.items()]
+        with self._lock:
+            self._db.executemany("INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)", rows)
+            self._db.commit()
+
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 1.0
+
+    def summary(self) -> str:
+        return f"{self.hits} hits, {self.misses} misses ({self.hit_rate():.1%} hit rate, {self.path})"
@@ -0,0 +1,103 @@
+"""
+Europe PMC metadata helpers shared by fetch_papers.py and extract_notes.py.
+
+Behavior:
+  - Splits a PMID list into OR-combined `EXT_ID:<pmid>` search queries
+  - Follows `cursorMark` pagination until Europe PMC stops returning results
+  - Returns a {pmid: core record} map; PMIDs Europe PMC does not know are absent
+  - Requests go through the shared HttpClient (scripts/http_client.py); callers pass
+    their own client to share its connection pool, retries and rate limit
+
+Environment:
+  - EPMC_SEARCH_URL overrides the search endpoint (used by tests and local stubs)
+"""
+
+from __future__ import annotations
+import os
+import time
+from typing import Dict, Iterable, Iterator, List, Optional
+from urllib.parse import urlencode
+
+from http_client import HttpClient
+
+EPMC_SEARCH_URL = "https://www.ebi.ac.uk/europepmc/webservices/rest/search"
+
+# ~100 IDs keep the GET URL well under common 8 KB limits; 1000 is the API's page cap.
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_PAGE_SIZE = 1000
+
+_default_client: Optional[HttpClient] = None
+
+
+def default_client() -> HttpClient:
+    global _default_client
+    if _default_client is None:
+        _default_client = HttpClient(user_agent="aptum-epmc/1.0", timeout=60)
+    return _default_client
+
+
+def search_url() -> str:
+    return os.environ.get("EPMC_SEARCH_URL", EPMC_SEARCH_URL)
+
+
+def build_query(pmids: Iterable[str]) -> str:
+    ors = " OR ".join(f"EXT_ID:{p}" for p in pmids)
+    return f"({ors}) AND SRC:MED"
+
+
+def search_pages(
+    query: str,
+    page_size: int = DEFAULT_PAGE_SIZE,
+    client: Optional[HttpClient] = None,
+) -> Iterator[List[dict]]:
+    """Yield successive `resultList.result` pages for a core search query."""
+    client = client or default_client()
+    cursor = "*"
+    while True:
+        params = urlencode({
+            "query": query,
+            "resultType": "core",
+            "format": "json",
+            "pageSize": page_size,
+            "cursorMark": cursor,
+        })
+        data = client.get_json(f"{search_url()}?{params}")
+        results = data.get("resultList", {}).get("result", [])
+        yield results
+        nxt = data.get("nextCursorMark")
+        if not results or not nxt or nxt == cursor:
+            return
+        cursor = nxt
+
+
+def epmc_core_bulk(
+    pmids: Iterable[str],
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    page_size: int = DEFAULT_PAGE_SIZE,
+    client: Optional[HttpClient] = None,
+    stats: Optional[List[Dict]] = None,
+) -> Dict[str, dict]:
+    """Resolve many PMIDs to Europe PMC core records with one query per batch.
+
+    When `stats` is given, one {"pmids", "pages", "seconds"} entry per batch is appended.
+    """
+    wanted = list(dict.fromkeys(str(p) for p in pmids))
+    out: Dict[str, dict] = {}
+    for start in range(0, len(wanted), max(1, batch_size)):
+        batch = wanted[start : start + max(1, batch_size)]
+        batch_set = set(batch)
+        t0 = time.monotonic()
+        pages = 0
+        for page in search_pages(build_query(batch), page_size=page_size, client=client):
+            pages += 1
+            for rec in page:
+                pmid = str(rec.get("pmid") or rec.get("id") or "")
+                if pmid in batch_set and pmid not in out:
+                    out[pmid] = rec
+        if stats is not None:
+            stats.append({"pmids": batch, "pages": pages, "seconds": round(time.monotonic() - t0, 4)})
+    return out
+
+
+def epmc_core(pmid: str, client: Optional[HttpClient] = None) -> dict:
+    return epmc_core_bulk([pmid], client=client).get(str(pmid), {})
@@ -0,0 +1,278 @@
+"""
+Extract Markdown from locally archived free-licensed PDFs (public/papers -> public/papers_md).
+
+Usage:
+  python scripts/extract_markdown.py [--workers N] [--timeout 180] [--force]
+
+Behavior:
+  - Reads public/papers/index.json and selects papers with a local PDF under a free license
+  - Skips a PDF whose SHA-256 matches the `sha256:` recorded in the front matter of the
+    existing public/papers_md/<pmid>.md (named after the PDF) (unless --force)
+  - Extracts the rest in a process pool (one process per core by default); each file
+    gets its own timeout so one pathological PDF cannot stall the stage
+  - Streams each PDF page by page (pdfminer's page iterator), writing each page's text
+    as it is laid out, so memory does not grow with document length
+  - Writes public/papers_md/<pmid>.pages.json next to each Markdown file:
+    {"sha256": <pdf hash>, "pages": [{"page": 1, "start": 0, "end": 4120}, ...]} with
+    character offsets into the Markdown body (after the front matter); build_kb_index.py
+    uses it to tag chunks with page ranges. A missing or stale map forces re-extraction.
+  - Reports extracted / skipped / failed counts and throughput in pages per second
+
+Notes:
+  - Requires pdfminer.six (installed by the paper-archive workflow); without it the
+    stage is skipped with a message rather than installing packages at runtime
+  - fetch_papers.py runs this stage after writing index.json unless --skip-markdown is given
+"""
+
+from __future__ import annotations
+import argparse
+import hashlib
+import io
+import json
+import os
+import shutil
+import signal
+import time
+from multiprocessing import Pool
+from typing import Dict, Iterable, Iterator, List, Optional, TextIO, Tuple
+
+FREE_LICENSES = {"cc by", "cc0", "cc by-sa"}
+INDEX_PATH = "public/papers/index.json"
+MD_DIR = "public/papers_md"
+PAGES_SUFFIX = ".pages.json"
+
+
+class ExtractTimeout(Exception):
+    pass
+
+
+def file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def read_front_matter(md_fp: str) -> Dict[str, str]:
+    """Return the `key: value` pairs of a Markdown file's front matter (reads only the header)."""
+    meta: Dict[str, str] = {}
+    if not os.path.exists(md_fp):
+        return meta
+    with open(md_fp, encoding="utf-8", errors="ignore") as f:
+        if f.readline().strip() != "---":
+            return meta
+        for line in f:
+            if line.strip() == "---":
+                break
+            if ":" in line:
+                k, v = line.split(":", 1)
+                meta[k.strip()] = v.strip()
+    return meta
+
+
+def paper_key(m: Dict) -> str:
+    """PMID, or the registry id for papers without one (arXiv, DOI)."""
+    return m.get("pmid") or m.get("id") or ""
+
+
+def md_path(m: Dict, md_dir: str) -> str:
+    """Markdown file named after the archived PDF (public/papers/<stem>.pdf -> <md_dir>/<stem>.md)."""
+    stem = os.path.splitext(os.path.basename(m["local_path"]))[0]
+    return os.path.join(md_dir, f"{stem}.md")
+
+
+def pages_path(md_fp: str) -> str:
+    """Page-offset map next to a Markdown file (<stem>.md -> <stem>.pages.json)."""
+    return os.path.splitext(md_fp)[0] + PAGES_SUFFIX
+
+
+def read_page_map(md_fp: str) -> Dict:
+    fp = pages_path(md_fp)
+    if not os.path.exists(fp):
+        return {}
+    try:
+        with open(fp, encoding="utf-8") as f:
+            return json.load(f)
+    except Exception:
+        return {}
+
+
+def front_matter(m: Dict, sha: str, pages: int) -> str:
+    return (
+        f"---\npmid: {paper_key(m)}\nlicense: {m.get('license', '')}\nsource: {m.get('source', '')}\n"
+        f"title: {(m.get('title') or '').replace(':', ' -')}\nsha256: {sha}\npages: {pages}\n---\n\n"
+    )
+
+
+def _on_alarm(signum, frame):
+    raise ExtractTimeout()
+
+
+def iter_page_text(pdf_fp: str) -> Iterator[str]:
+    """Yield the text of each page in turn (same output as pdfminer's extract_text, split per page).
+
+    Only the current page's layout is held in memory, so long documents stay flat.
+    """
+    from pdfminer.converter import TextConverter  # type: ignore
+    from pdfminer.layout import LAParams  # type: ignore
+    from pdfminer.pdfinterp import PDFPageInterpreter, PDFResourceManager  # type: ignore
+    from pdfminer.pdfpage import PDFPage  # type: ignore
+
+    buf = io.StringIO()
+    rsrcmgr = PDFResourceManager()
+    device = TextConverter(rsrcmgr, buf, laparams=LAParams())
+    interpreter = PDFPageInterpreter(rsrcmgr, device)
+    try:
+        with open(pdf_fp, "rb") as f:
+            for page in PDFPage.get_pages(f):
+                interpreter.process_page(page)
+                yield buf.getvalue()
+                buf.seek(0)
+                buf.truncate()
+    finally:
+        device.close()
+
+
+def write_pages(outf: TextIO, pages: Iterable[str]) -> List[Dict]:
+    """Stream page texts into `outf` as one stripped body; returns the page-offset map.
+
+    Offsets are character positions in the body (the text after the front matter),
+    `end` exclusive; pages without text get an empty span. Whitespace between pages
+    is held back until more text follows, so the body equals "".join(pages).strip().
+    """
+    offsets: List[Dict] = []
+    pos = 0
+    pending = ""
+    for n, text in enumerate(pages, 1):
+        if not pos:
+            text = text.lstrip()
+        core = text.rstrip()
+        if core:
+            outf.write(pending)
+            pos += len(pending)
+            start = pos + (len(core) - len(core.lstrip()))
+            outf.write(core)
+            pos += len(core)
+            pending = text[len(core):]
+            offsets.append({"page": n, "start": start, "end": pos})
+        else:
+            pending += text
+            offsets.append({"page": n, "start": pos, "end": pos})
+    outf.write("\n")
+    return offsets
+
+
+def extract_one(task: Dict) -> Dict:
+    """Worker: extract one PDF page by page into its Markdown and page map; returns a small status dict."""
+    m = task["meta"]
+    pdf_fp = m["local_path"]
+    md_fp = md_path(m, task["md_dir"])
+    t0 = time.monotonic()
+    use_alarm = hasattr(signal, "SIGALRM") and task["timeout"] > 0
+    if use_alarm:
+        signal.signal(signal.SIGALRM, _on_alarm)
+        signal.alarm(int(task["timeout"]))
+    tmp = md_fp + ".tmp"
+    try:
+        # The page count goes in the front matter before the body, so the body is
+        # streamed to a scratch file first and appended after the header.
+        body_tmp = md_fp + ".body.tmp"
+        with open(body_tmp, "w", encoding="utf-8") as bodyf:
+            offsets = write_pages(bodyf, iter_page_text(pdf_fp))
+        with open(tmp, "w", encoding="utf-8") as outf, open(body_tmp, encoding="utf-8") as bodyf:
+            outf.write(front_matter(m, task["sha256"], len(offsets)))
+            shutil.copyfileobj(bodyf, outf)
+        os.remove(body_tmp)
+        page_map = {"sha256": task["sha256"], "pages": offsets}
+        with open(pages_path(tmp), "w", encoding="utf-8") as pf:
+            json.dump(page_map, pf)
+        os.replace(tmp, md_fp)
+        os.replace(pages_path(tmp), pages_path(md_fp))
+        return {"pmid": paper_key(m), "ok": True, "pages": len(offsets), "seconds": time.monotonic() - t0}
+    except ExtractTimeout:
+        return {"pmid": paper_key(m), "ok": False, "error": f"timed out after {task['timeout']}s"}
+    except Exception as e:
+        return {"pmid": paper_key(m), "ok": False, "error": str(e)}
+    finally:
+        if use_alarm:
+            signal.alarm(0)
+        for leftover in (tmp, md_fp + ".body.tmp", pages_path(tmp)):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+
+
+def plan_tasks(papers: List[Dict], md_dir: str, timeout: float, force: bool) -> Tuple[List[Dict], List[str]]:
+    """Select PDFs that need (re-)extraction; returns (tasks, unchanged PMIDs)."""
+    tasks: List[Dict] = []
+    skipped: List[str] = []
+    for m in papers:
+        pdf_fp = m.get("local_path")
+        if not pdf_fp or m.get("license") not in FREE_LICENSES or not os.path.exists(pdf_fp):
+            continue
+        sha = file_sha256(pdf_fp)
+        md_fp = md_path(m, md_dir)
+        if not force and read_front_matter(md_fp).get("sha256") == sha and read_page_map(md_fp).get("sha256") == sha:
+            skipped.append(paper_key(m))
+            continue
+        tasks.append({"meta": m, "sha256": sha, "md_dir": md_dir, "timeout": timeout})
+    return tasks, skipped
+
+
+def run(papers: List[Dict], md_dir: str = MD_DIR, workers: Optional[int] = None, timeout: float = 180, force: bool = False) -> Dict:
+    try:
+        import pdfminer  # type: ignore  # noqa: F401
+    except Exception as e:
+        print("skip markdown conversion (pdfminer.six not installed):", e)
+        return {"extracted": 0, "skipped": 0, "failed": 0, "pages": 0, "seconds": 0.0, "results": []}
+
+    os.makedirs(md_dir, exist_ok=True)
+    tasks, skipped = plan_tasks(papers, md_dir, timeout, force)
+    workers = max(1, min(workers or os.cpu_count() or 1, len(tasks) or 1))
+    t0 = time.monotonic()
+    results: List[Dict] = []
+    if tasks:
+        with Pool(processes=workers) as pool:
+            pending = [(t, pool.apply_async(extract_one, (t,))) for t in tasks]
+            for t, res in pending:
+                try:
+                    # the worker enforces the timeout itself; this is only a backstop
+                    results.append(res.get(timeout=timeout + 30 if timeout > 0 else None))
+                except Exception as e:
+                    results.append({"pmid": paper_key(t["meta"]), "ok": False, "error": f"worker failed: {e}"})
+    elapsed = time.monotonic() - t0
+
+    for r in results:
+        if not r["ok"]:
+            print("markdown-extract failed", r["pmid"], r.get("error"))
+    done = [r for r in results if r["ok"]]
+    pages = sum(r["pages"] for r in done)
+    rate = pages / elapsed if elapsed > 0 else 0.0
+    print(f"Markdown: {len(done)} extracted, {len(skipped)} unchanged, {len(results) - len(done)} failed; "
+          f"{pages} pages in {elapsed:.1f}s ({rate:.1f} pages/s, {workers} workers)")
+    per_pmid = [dict(r, outcome="extracted" if r["ok"] else "failed") for r in results]
+    per_pmid += [{"pmid": p, "ok": True, "outcome": "unchanged"} for p in skipped]
+    return {
+        "extracted": len(done),
+        "skipped": len(skipped),
+        "failed": len(results) - len(done),
+        "pages": pages,
+        "seconds": elapsed,
+        "results": per_pmid,
+    }
+
+
+def main(argv: Optional[List[str]] = None):
+    ap = argparse.ArgumentParser(description="Extract Markdown from archived free-licensed PDFs.")
+    ap.add_argument("--workers", type=int, default=None, help="worker processes (default: all cores)")
+    ap.add_argument("--timeout", type=float, default=180, help="per-PDF extraction timeout in seconds (0 disables)")
+    ap.add_argument("--force", action="store_true", help="re-extract even when the PDF hash is unchanged")
+    args = ap.parse_args(argv)
+
+    with open(INDEX_PATH, encoding="utf-8") as f:
+        papers = json.load(f).get("papers", [])
+    run(papers, workers=args.workers, timeout=args.timeout, force=args.force)
+
+
+if __name__ == "__main__":
+    main()
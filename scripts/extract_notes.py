@@ -4,11 +4,41 @@ Generate rewritten, coach-ready notes for papers we cannot rehost (non-free/ND l
 Behavior:
   - Reads public/papers/index.json
   - Selects items whose license IS NOT in FREE_LICENSES
-  - Fetches abstract and core metadata from Europe PMC
+  - Reads abstract and core metadata from the shared metadata store (scripts/metadata_store.py);
+    only PMIDs missing or expired there are fetched from Europe PMC in batched queries
   - If OPENAI_API_KEY is set, uses OpenAI to paraphrase the abstract into
     concise bullet points (no verbatim copying, no quotes > 90 chars)
-  - Writes notes to docs/papers_notes/{pmid}.md with YAML front matter
+  - Runs many OpenAI requests at once (up to --workers); the number in flight adapts
+    to 429s and x-ratelimit-remaining-* headers (AdaptiveLimiter in scripts/http_client.py),
+    and 429/5xx are retried with backoff ($NOTES_RETRIES attempts) before a paper
+    falls back to naive bullets
+  - Writes notes to docs/papers_notes/{pmid}.md with YAML front matter; `generator`
+    records whether the text came from the LLM or the fallback, `fingerprint` hashes
+    the abstract, OPENAI_MODEL, system prompt (plus the pack prompt and JSON reply format
+    for notes taken from a packed reply) and temperature
+  - Skips papers whose LLM-written note already carries the current fingerprint
+    (--force regenerates everything) and prints cache hit/miss counts
+  - Writes docs/papers/NOTES.json (LLM vs fallback per PMID, with the fallback reason)
+    and prints the counts
   - Updates docs/papers/README.md to add a Notes column linking to notes (if present)
+  - --pack TOKENS: groups several papers (metadata + abstract) into one request up to an
+    estimated token budget and asks for JSON keyed by PMID; entries missing or malformed
+    in the reply are regenerated through the single-paper request. Packed notes carry the
+    packed fingerprint, so a changed PACK_PROMPT regenerates them; a --pack run accepts
+    both kinds of note as current, a run without it only single-paper notes
+  - --batch: writes all pending requests to .cache/notes-batch.jsonl, submits them as one
+    OpenAI Batch API job (scripts/openai_batch.py), polls until it finishes and ingests
+    the results through write_note. If --batch-timeout passes first, the job id is kept
+    in .cache/notes-batch.json and the next --batch run resumes it instead of resubmitting.
+
+Usage:
+  python scripts/extract_notes.py [--workers 16] [--pack 8000] [--force] [--offline]
+                                  [--batch [--batch-poll 30] [--batch-timeout 3600]]
+
+Environment:
+  - NOTES_WORKERS, NOTES_PACK_TOKENS: defaults for --workers and --pack
+  - OPENAI_API_KEY, OPENAI_MODEL (default gpt-4o-mini), OPENAI_BASE_URL (default
+    https://api.openai.com/v1; point it at a stub for tests)
 
 Safeguards:
   - No verbatim text beyond 90 characters
@@ -17,67 +47,226 @@ Safeguards:
 """
 
 from __future__ import annotations
+import argparse
+import hashlib
 import json
 import os
 import re
 import textwrap
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from functools import partial
 from pathlib import Path
-from typing import Optional
-from urllib.request import urlopen, Request
+from typing import Dict, List, Optional
+
+import openai_batch
+from http_client import AdaptiveLimiter, HttpClient
+from metadata_store import MetadataStore
 
 FREE_LICENSES = {"cc by", "cc0", "cc by-sa"}
 
-def epmc_core(pmid: str) -> dict:
-    url = f"https://www.ebi.ac.uk/europepmc/webservices/rest/search?query=EXT_ID:{pmid}&resultType=core&format=json"
-    with urlopen(Request(url, headers={"User-Agent": "aptum-notes/1.0"})) as r:
-        data = json.loads(r.read().decode())
-    results = data.get("resultList", {}).get("result", [])
-    return results[0] if results else {}
+# One keep-alive client for Europe PMC and OpenAI; retries 429/5xx honouring Retry-After
+CLIENT = HttpClient(user_agent="aptum-notes/1.0", timeout=60)
 
+# Attempts per OpenAI request before a paper falls back to naive bullets
+NOTES_RETRIES = int(os.environ.get("NOTES_RETRIES", "6"))
+REPORT_PATH = "docs/papers/NOTES.json"
 
-def openai_notes(abstract: str, meta: dict) -> str:
-    import os
-    import json
-    import urllib.request
+# --batch: the JSONL request file and the id of the job still waiting to be ingested
+BATCH_INPUT = ".cache/notes-batch.jsonl"
+BATCH_STATE = ".cache/notes-batch.json"
 
-    api_key = os.environ.get("OPENAI_API_KEY")
-    if not api_key:
-        return ""
-    model = os.environ.get("OPENAI_MODEL", "gpt-4o-mini")
+SYSTEM_PROMPT = (
+    "You are a scientific editor creating coach-ready notes."
+    " Rewrite in your own words."
+    " Do not quote the paper. Do not include verbatim text beyond 90 characters."
+    " Focus on: population, design, sample size, intervention/exposure, outcomes, key results, practical implications, and limitations."
+)
+TEMPERATURE = 0.2
 
-    system = (
-        "You are a scientific editor creating coach-ready notes."
-        " Rewrite in your own words."
-        " Do not quote the paper. Do not include verbatim text beyond 90 characters."
-        " Focus on: population, design, sample size, intervention/exposure, outcomes, key results, practical implications, and limitations."
-    )
+# --pack: asked of the model on top of SYSTEM_PROMPT when several papers share one request
+PACK_PROMPT = (
+    "You will receive several papers as a JSON list of {pmid, meta, abstract}."
+    " Write notes for every paper separately and reply with one JSON object only:"
+    ' {"notes": {"<pmid>": "- bullet\\n- bullet ..."}} with one key per pmid.'
+)
+# Completion tokens reserved per paper when sizing a pack (6-10 short bullets)
+NOTE_TOKENS = 400
+
+
+def notes_model() -> str:
+    return os.environ.get("OPENAI_MODEL", "gpt-4o-mini")
+
+
+def note_fingerprint(abstract: str, packed: bool = False) -> str:
+    """Hash of everything that decides the LLM output: abstract, model, system prompt, temperature.
+
+    `packed` notes were written from a packed_body reply, whose prompt and reply format differ.
+    """
+    parts = [abstract, notes_model(), SYSTEM_PROMPT, TEMPERATURE]
+    if packed:
+        parts += [PACK_PROMPT, "json_object"]
+    blob = json.dumps(parts, ensure_ascii=False)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+def read_note_meta(target: Path) -> Dict[str, str]:
+    """Front matter of an existing note (notes start with a blank line before `---`)."""
+    if not target.exists():
+        return {}
+    text = target.read_text(encoding="utf-8", errors="ignore").lstrip()
+    if not text.startswith("---"):
+        return {}
+    meta: Dict[str, str] = {}
+    for line in text[3:].split("\n---", 1)[0].splitlines():
+        if ":" in line:
+            k, v = line.split(":", 1)
+            meta[k.strip()] = v.strip().strip('"')
+    return meta
+
+
+def is_note_current(target: Path, *fingerprints: str) -> bool:
+    """An LLM-written note with one of `fingerprints`; fallback notes are always retried."""
+    meta = read_note_meta(target)
+    return meta.get("fingerprint") in fingerprints and meta.get("generator", "").startswith("llm")
+
+
+def chat_body(abstract: str, meta: dict) -> Dict:
+    """Chat-completions request body for one paper (live calls and batch files alike)."""
     user = (
         "Paper metadata (JSON):\n" + json.dumps(meta, ensure_ascii=False) +
         "\n\nAbstract:\n" + abstract +
         "\n\nWrite 6-10 bullet points. Use short, plain language sentences."
     )
-    body = {
-        "model": model,
+    return {
+        "model": notes_model(),
         "messages": [
-            {"role": "system", "content": system},
+            {"role": "system", "content": SYSTEM_PROMPT},
             {"role": "user", "content": user},
         ],
-        "temperature": 0.2,
+        "temperature": TEMPERATURE,
     }
-    req = urllib.request.Request(
-        "https://api.openai.com/v1/chat/completions",
-        data=json.dumps(body).encode(),
-        headers={
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json",
-        },
-    )
-    with urllib.request.urlopen(req, timeout=60) as resp:
-        out = json.loads(resp.read().decode())
+
+
+def openai_notes(abstract: str, meta: dict, limiter: Optional[AdaptiveLimiter] = None) -> str:
+    api_key = os.environ.get("OPENAI_API_KEY")
+    if not api_key:
+        return ""
+    body = chat_body(abstract, meta)
+    with limiter.slot() if limiter else nullcontext():
+        out = CLIENT.post_json(
+            f"{openai_batch.base_url()}/chat/completions",
+            body,
+            headers={"Authorization": f"Bearer {api_key}"},
+            retries=NOTES_RETRIES,
+            on_response=limiter.observe if limiter else None,
+        )
     content = out.get("choices", [{}])[0].get("message", {}).get("content", "")
     return content.strip()
 
 
+def estimate_tokens(text: str) -> int:
+    # ~4 characters per token for English prose; only used to size packs
+    return len(text) // 4 + 1
+
+
+def pack_entry(job: Dict) -> Dict:
+    return {"pmid": job["pmid"], "meta": job["meta"], "abstract": job["abstract"]}
+
+
+def pack_jobs(jobs: List[Dict], budget: int) -> List[List[Dict]]:
+    """Greedily group jobs so each group's prompt plus reserved completion fits `budget` tokens."""
+    groups: List[List[Dict]] = []
+    current: List[Dict] = []
+    used = estimate_tokens(SYSTEM_PROMPT + PACK_PROMPT)
+    base = used
+    for job in jobs:
+        cost = estimate_tokens(json.dumps(pack_entry(job), ensure_ascii=False)) + NOTE_TOKENS
+        if current and used + cost > budget:
+            groups.append(current)
+            current, used = [], base
+        current.append(job)
+        used += cost
+    if current:
+        groups.append(current)
+    return groups
+
+
+def packed_body(group: List[Dict]) -> Dict:
+    """One chat request covering every paper in `group`, answered as JSON keyed by PMID."""
+    user = (
+        "Papers (JSON):\n" + json.dumps([pack_entry(j) for j in group], ensure_ascii=False) +
+        "\n\nFor each paper write 6-10 bullet points. Use short, plain language sentences."
+    )
+    return {
+        "model": notes_model(),
+        "messages": [
+            {"role": "system", "content": SYSTEM_PROMPT + " " + PACK_PROMPT},
+            {"role": "user", "content": user},
+        ],
+        "temperature": TEMPERATURE,
+        "response_format": {"type": "json_object"},
+    }
+
+
+def parse_packed(content: str, pmids: List[str]) -> Dict[str, str]:
+    """{pmid: bullets} for the well-formed entries of a packed reply; anything else is left out."""
+    try:
+        data = json.loads(content)
+    except ValueError:
+        return {}
+    if not isinstance(data, dict):
+        return {}
+    notes = data.get("notes", data)
+    if not isinstance(notes, dict):
+        return {}
+    out: Dict[str, str] = {}
+    for pmid in pmids:
+        value = notes.get(pmid)
+        if isinstance(value, list) and value and all(isinstance(v, str) for v in value):
+            value = "\n".join(v if v.lstrip().startswith("-") else f"- {v.strip()}" for v in value)
+        if isinstance(value, str) and value.strip():
+            out[pmid] = value.strip()
+    return out
+
+
+def openai_packed(group: List[Dict], limiter: Optional[AdaptiveLimiter] = None) -> Dict[str, str]:
+    api_key = os.environ.get("OPENAI_API_KEY")
+    if not api_key:
+        return {}
+    with limiter.slot() if limiter else nullcontext():
+        out = CLIENT.post_json(
+            f"{openai_batch.base_url()}/chat/completions",
+            packed_body(group),
+            headers={"Authorization": f"Bearer {api_key}"},
+            retries=NOTES_RETRIES,
+            on_response=limiter.observe if limiter else None,
+        )
+    content = out.get("choices", [{}])[0].get("message", {}).get("content", "")
+    return parse_packed(content, [j["pmid"] for j in group])
+
+
+def write_group(group: List[Dict], out_dir: Path, limiter: Optional[AdaptiveLimiter] = None) -> List[Dict]:
+    """Notes for a pack in one request; papers missing or malformed in the reply go through write_note alone."""
+    notes: Dict[str, str] = {}
+    if len(group) > 1:
+        try:
+            notes = openai_packed(group, limiter)
+        except Exception as e:
+            print(f"packed request for {len(group)} papers failed ({type(e).__name__}: {e}); retrying one by one")
+    results = []
+    for j in group:
+        if j["pmid"] in notes:
+            r = write_note(j["pmid"], j["meta"], j["abstract"], out_dir, completion={"content": notes[j["pmid"]]}, packed=True)
+            r["packed"] = len(group)
+        else:
+            r = write_note(j["pmid"], j["meta"], j["abstract"], out_dir, limiter)
+            r["packed"] = 1
+        results.append(r)
+    return results
+
+
 def naive_bullets(abstract: str) -> str:
     # Fallback: produce minimal bullets without copying long sequences.
     # We split into short sentences and compress aggressively.
@@ -98,18 +287,41 @@ def naive_bullets(abstract: str) -> str:
     return "\n".join(bullets) if bullets else "- Summary not available."
 
 
-def write_note(pmid: str, meta: dict, abstract: str, out_dir: Path) -> None:
+def write_note(
+    pmid: str,
+    meta: dict,
+    abstract: str,
+    out_dir: Path,
+    limiter: Optional[AdaptiveLimiter] = None,
+    completion: Optional[Dict] = None,
+    packed: bool = False,
+) -> Dict:
+    """Write one note; returns {"pmid", "generator": "llm" | "fallback", "reason", "seconds"}.
+
+    `completion` ({"content", "error"}, from a batch result or a packed reply) is used instead
+    of a live call; `packed` marks it as coming from a packed request (see note_fingerprint).
+    """
     out_dir.mkdir(parents=True, exist_ok=True)
     target = out_dir / f"{pmid}.md"
     title = meta.get("title") or ""
     lic = meta.get("license") or ""
     source = f"https://europepmc.org/abstract/MED/{pmid}"
 
+    t0 = time.monotonic()
     body = ""
+    reason = None
     try:
-        body = openai_notes(abstract, meta)
-    except Exception:
+        if completion is not None:
+            body = (completion.get("content") or "").strip()
+            reason = None if body else completion.get("error") or "empty completion"
+        else:
+            body = openai_notes(abstract, meta, limiter)
+            if not body:
+                reason = "empty completion" if os.environ.get("OPENAI_API_KEY") else "OPENAI_API_KEY not set"
+    except Exception as e:
         body = ""
+        reason = f"{type(e).__name__}: {e}"
+    generator = "llm:" + notes_model() if body else "fallback"
     if not body:
         body = naive_bullets(abstract)
 
@@ -120,9 +332,59 @@ def write_note(pmid: str, meta: dict, abstract: str, out_dir: Path) -> None:
     license: "{lic}"
     source: "{source}"
     note: "These notes are original writing derived from public metadata/abstract; not a copy of the paper."
+    generator: "{generator}"
+    fingerprint: "{note_fingerprint(abstract, packed)}"
     ---
     """)
     target.write_text(fm + "\n" + body + "\n", encoding="utf-8")
+    return {
+        "pmid": pmid,
+        "generator": "fallback" if generator == "fallback" else "llm",
+        "reason": reason,
+        "seconds": round(time.monotonic() - t0, 3),
+    }
+
+
+def generate_notes(jobs: List[Dict], notes_dir: Path, workers: int, pack_tokens: int = 0) -> Dict:
+    """Write all notes on a thread pool; the adaptive limiter decides how many LLM calls are in flight.
+
+    With `pack_tokens` > 0 the jobs are grouped into packs of that many (estimated) tokens
+    and each pack is one request (write_group).
+    """
+    workers = max(1, workers)
+    limiter = AdaptiveLimiter(initial=min(4, workers), maximum=workers)
+    t0 = time.monotonic()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        if pack_tokens > 0:
+            groups = pack_jobs(jobs, pack_tokens)
+            work = partial(write_group, out_dir=notes_dir, limiter=limiter)
+            results = [r for rs in pool.map(work, groups) for r in rs]
+        else:
+            work = partial(write_note, out_dir=notes_dir, limiter=limiter)
+            results = list(pool.map(
+                work,
+                [j["pmid"] for j in jobs],
+                [j["meta"] for j in jobs],
+                [j["abstract"] for j in jobs],
+            ))
+    llm = [r for r in results if r["generator"] == "llm"]
+    fallback = [r for r in results if r["generator"] == "fallback"]
+    report = {
+        "generatedAt": time.time(),
+        "seconds": round(time.monotonic() - t0, 3),
+        "llm": len(llm),
+        "fallback": len(fallback),
+        "concurrency": limiter.stats(),
+        "notes": results,
+    }
+    if pack_tokens > 0:
+        report["packing"] = {
+            "budget": pack_tokens,
+            "packs": sum(1 for g in groups if len(g) > 1),
+            "packed": sum(1 for r in results if r["packed"] > 1),
+            "single": sum(1 for r in results if r["packed"] == 1),
+        }
+    return report
 
 
 def update_readme_index(idx_path: Path, readme_path: Path, notes_dir: Path) -> None:
@@ -130,13 +392,13 @@ def update_readme_index(idx_path: Path, readme_path: Path, notes_dir: Path) -> N
     rows = []
     for i, m in enumerate(idx["papers"], 1):
         title = (m.get("title") or "").replace("|", "-")
-        pmid = m.get("pmid") or ""
+        pmid = m.get("pmid") or m.get("id") or ""
         lic = m.get("license") or "—"
         if m.get("local_path"):
-            link = f"/public/papers/{pmid}.pdf"
+            link = "/" + m["local_path"]
         else:
             link = m.get("pdf_url") or m.get("source") or ""
-        notes_link = f"docs/papers_notes/{pmid}.md" if (notes_dir / f"{pmid}.md").exists() else ""
+        notes_link = f"docs/papers_notes/{pmid}.md" if m.get("pmid") and (notes_dir / f"{pmid}.md").exists() else ""
         rows.append((i, title, pmid, lic, link, notes_link))
 
     lines = []
@@ -153,22 +415,106 @@ def update_readme_index(idx_path: Path, readme_path: Path, notes_dir: Path) -> N
     readme_path.write_text("\n".join(lines) + "\n", encoding="utf-8")
 
 
-def main():
+def batch_completion(item: Optional[Dict], batch: Dict) -> Dict:
+    """{"content", "error"} for one line of a batch output/error file."""
+    if item is None:
+        return {"content": "", "error": f"no result in batch {batch.get('id')} (status {batch.get('status')})"}
+    response = item.get("response") or {}
+    body = response.get("body") or {}
+    if response.get("status_code") == 200:
+        content = body.get("choices", [{}])[0].get("message", {}).get("content", "")
+        return {"content": content, "error": None}
+    err = item.get("error") or body.get("error") or {}
+    return {"content": "", "error": f"batch status {response.get('status_code')}: {err.get('message') or err}"}
+
+
+def run_batch(todo: List[Dict], lookup: Dict[str, Dict], notes_dir: Path, poll: float, timeout: float) -> Optional[Dict]:
+    """Submit pending notes as one batch job (or resume the recorded one), wait, then ingest.
+
+    Returns None while the job is still running; its id stays in BATCH_STATE and the
+    next --batch run picks it up instead of submitting again.
+    """
+    if not os.environ.get("OPENAI_API_KEY"):
+        raise SystemExit("--batch needs OPENAI_API_KEY")
+    t0 = time.monotonic()
+    if os.path.exists(BATCH_STATE):
+        with open(BATCH_STATE, encoding="utf-8") as f:
+            state = json.load(f)
+        print(f"Resuming batch {state['batch_id']} ({len(state['pmids'])} notes)")
+    else:
+        if not todo:
+            return {"generatedAt": time.time(), "seconds": 0.0, "llm": 0, "fallback": 0, "notes": []}
+        os.makedirs(os.path.dirname(BATCH_INPUT), exist_ok=True)
+        n = openai_batch.write_requests(BATCH_INPUT, (
+            openai_batch.request_line(j["pmid"], "/v1/chat/completions", chat_body(j["abstract"], j["meta"])) for j in todo
+        ))
+        batch = openai_batch.submit(CLIENT, BATCH_INPUT, "/v1/chat/completions", {"source": "extract_notes"})
+        state = {"batch_id": batch["id"], "pmids": [j["pmid"] for j in todo], "submitted_at": time.time()}
+        with open(BATCH_STATE, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        print(f"Submitted batch {batch['id']} with {n} requests")
+
+    batch = openai_batch.wait(CLIENT, state["batch_id"], poll=poll, timeout=timeout)
+    if batch.get("status") not in openai_batch.FINAL_STATUSES:
+        return None
+    items = openai_batch.results(CLIENT, batch)
+    # batch lines are chat_body requests, i.e. the single-paper prompt
+    notes = [
+        write_note(pmid, lookup[pmid]["meta"], lookup[pmid]["abstract"], notes_dir,
+                   completion=batch_completion(items.get(pmid), batch), packed=False)
+        for pmid in state["pmids"] if pmid in lookup
+    ]
+    os.remove(BATCH_STATE)
+    return {
+        "generatedAt": time.time(),
+        "seconds": round(time.monotonic() - t0, 3),
+        "llm": sum(1 for r in notes if r["generator"] == "llm"),
+        "fallback": sum(1 for r in notes if r["generator"] == "fallback"),
+        "batch": {"id": batch.get("id"), "status": batch.get("status"), "request_counts": batch.get("request_counts")},
+        "notes": notes,
+    }
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    ap = argparse.ArgumentParser(description="Generate coach-ready notes for papers we cannot rehost.")
+    ap.add_argument("--workers", type=int, default=int(os.environ.get("NOTES_WORKERS", "16")),
+                    help="upper bound on concurrent LLM requests (default: 16 or $NOTES_WORKERS)")
+    ap.add_argument("--offline", action="store_true",
+                    help="take abstracts only from the metadata store (scripts/metadata_store.py), never Europe PMC")
+    ap.add_argument("--force", action="store_true", help="regenerate every note even when its fingerprint is unchanged")
+    ap.add_argument("--pack", type=int, default=int(os.environ.get("NOTES_PACK_TOKENS", "0")), metavar="TOKENS",
+                    help="send several abstracts per request, up to this many estimated tokens (0: one per request)")
+    ap.add_argument("--batch", action="store_true",
+                    help="send pending notes as one OpenAI Batch API job (or resume the one in progress) instead of live calls")
+    ap.add_argument("--batch-poll", type=float, default=30, help="seconds between batch status checks")
+    ap.add_argument("--batch-timeout", type=float, default=3600,
+                    help="stop waiting after this many seconds; re-run with --batch to ingest later")
+    return ap.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
     root = Path('.')
     idx_path = root / 'public/papers/index.json'
     readme_path = root / 'docs/papers/README.md'
     notes_dir = root / 'docs/papers_notes'
     idx = json.loads(idx_path.read_text())
 
-    for m in idx["papers"]:
+    # Generate notes for restricted license or unknown license
+    pending = [
+        m for m in idx["papers"]
+        if m.get("pmid") and (m.get("license") or "").lower() not in FREE_LICENSES
+    ]
+    store = MetadataStore()
+    records = store.resolve([m["pmid"] for m in pending], client=CLIENT, offline=args.offline)
+    store.close()
+    print(f"Metadata store: {store.summary()}")
+
+    jobs: List[Dict] = []
+    for m in pending:
         lic = (m.get("license") or "").lower()
-        pmid = m.get("pmid")
-        if not pmid:
-            continue
-        if lic in FREE_LICENSES:
-            continue
-        # Generate notes for restricted license or unknown license
-        rec = epmc_core(pmid)
+        pmid = m["pmid"]
+        rec = records.get(pmid) or {}
         abstract = rec.get("abstractText") or ""
         meta = {
             "pmid": pmid,
@@ -178,7 +524,41 @@ def main():
             "pubYear": rec.get("pubYear") or "",
             "license": lic,
         }
-        write_note(pmid, meta, abstract, notes_dir)
+        jobs.append({"pmid": pmid, "meta": meta, "abstract": abstract})
+
+    # Only notes whose abstract/model/prompt/temperature fingerprint changed cost an LLM call;
+    # a --pack run may write a paper either way (packed, or alone as the fallback)
+    def current(j: Dict) -> bool:
+        fps = [note_fingerprint(j["abstract"])]
+        if args.pack > 0 and not args.batch:
+            fps.append(note_fingerprint(j["abstract"], packed=True))
+        return is_note_current(notes_dir / f"{j['pmid']}.md", *fps)
+
+    stale = [args.force or not current(j) for j in jobs]
+    todo = [j for j, s in zip(jobs, stale) if s]
+    cached = [j["pmid"] for j, s in zip(jobs, stale) if not s]
+    print(f"Notes cache: {len(cached)} hits, {len(todo)} misses{' (--force)' if args.force else ''}")
+    if args.batch:
+        report = run_batch(todo, {j["pmid"]: j for j in jobs}, notes_dir, args.batch_poll, args.batch_timeout)
+        if report is None:
+            print(f"Batch still running; re-run with --batch to ingest it (state in {BATCH_STATE}).")
+            return
+        print(f"Notes: {report['llm']} from LLM, {report['fallback']} fallback via batch "
+              f"{report.get('batch', {}).get('id')} in {report['seconds']:.1f}s")
+    else:
+        report = generate_notes(todo, notes_dir, args.workers, args.pack)
+        c = report["concurrency"]
+        print(f"Notes: {report['llm']} from LLM, {report['fallback']} fallback in {report['seconds']:.1f}s "
+              f"(concurrency peak {c['peak']}, final {c['limit']}, {c['throttled']} throttled responses)")
+        if "packing" in report:
+            p = report["packing"]
+            print(f"Packing: {p['packed']} notes from {p['packs']} packed requests, {p['single']} sent alone")
+    report["cache"] = {"hits": len(cached), "misses": len(todo), "cached": cached}
+    for r in report["notes"]:
+        if r["generator"] == "fallback":
+            print(f"  fallback {r['pmid']}: {r['reason']}")
+    with open(root / REPORT_PATH, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
 
     update_readme_index(idx_path, readme_path, notes_dir)
     print("Notes generation complete.")
@@ -2,313 +2,961 @@
 Fetch open/free-licensed papers (by PMID) from Europe PMC and store PDFs + metadata.
 
 Usage:
-  python scripts/fetch_papers.py
+  python scripts/fetch_papers.py [--registry docs/papers/registry.json] [--workers 8] [--rate 5] [--burst 5]
+                                 [--incremental] [--skip-markdown] [--shard I/N | --merge N]
 
 Behavior:
-  - Parses the hardcoded paper list text below to extract PMIDs
-  - Queries Europe PMC for each PMID to retrieve license and full-text URLs
+  - Reads the papers to archive from docs/papers/registry.json: one entry per paper with a
+    `pmid` (or `arxiv` / `doi` for papers outside PubMed), title, research area and topics
+  - Resolves all PMIDs against Europe PMC in batched OR-queries (scripts/epmc.py) for license and full-text URLs;
+    full records are kept in the shared metadata store (scripts/metadata_store.py) and only
+    missing or expired PMIDs (--metadata-ttl days) hit the network (--offline: none do)
+  - Processes PMIDs concurrently on a thread pool (--workers); every request goes
+    through the shared keep-alive client (scripts/http_client.py) with a per-host token
+    bucket (--rate requests/s, --burst), backoff on 429/5xx and per-host circuit breakers
+  - arXiv / DOI entries use the license declared in the registry; free arXiv PDFs come from
+    arxiv.org, DOIs go through Unpaywall, everything else is linked
   - Filters to free licenses (cc by, cc0, cc by-sa) and downloads PDF to public/papers
+  - Races the PMC / Europe PMC mirror candidates with hedged requests: the next mirror
+    starts when the current one fails or is still running after --hedge-after seconds,
+    the first valid %PDF- body wins and the rest are cancelled. Wins per mirror are kept
+    in the fetch cache so later runs try the usual winner first.
   - Tries Unpaywall fallback (via DOI) when Europe PMC PDF download fails or is absent
   - Writes public/papers/index.json (metadata for all papers)
+  - Writes public/papers/index.cache.json (record fingerprint, ETag/Last-Modified and
+    SHA-256 per PDF); with --incremental, unchanged PMIDs are reused from the previous
+    index without any request and known PDFs are revalidated with conditional GETs.
+    PDFs are only rewritten when their SHA-256 changes.
+  - Streams each PDF to a .part file in 64 KB blocks (hashing on the fly, capped by
+    $FETCH_MAX_PDF_MB, resuming with HTTP Range) and renames it into place atomically;
+    a .part left by an interrupted run is resumed by the next one (its ETag/Last-Modified
+    is kept in <file>.part.json and sent as If-Range)
   - Writes docs/papers/README.md with Title | PMID | License | Link
   - Writes docs/papers/AUDIT.json with summary counts and unresolved externals
+  - Writes docs/papers/METRICS.json with per-phase timings and per-PMID metrics (metadata
+    batch latency, mirrors tried, bytes, retries, extraction time, outcome); see scripts/metrics.py
+
+Sharding:
+  - `--shard I/N` processes only the entries with sha1(id) % N == I (adding papers never
+    moves existing ones to another shard) and writes .cache/paper-shards/shard-I-of-N.json
+    with their index records, fetch-cache entries and metrics; PDFs and Markdown land in
+    the usual folders. Shard runs do not touch index.json, README, AUDIT or METRICS.
+  - `--merge N` requires all N shard files, orders papers by the registry and writes
+    index.json, the fetch cache, README, AUDIT and METRICS (per-shard phase times are
+    combined as the slowest shard). Without either flag the whole registry runs in one
+    process, as before.
 
 Notes:
   - Only free licenses are saved locally; others (or failures) are linked to Europe PMC
-  - Extracts Markdown from locally saved free PDFs for easier search (best-effort)
+  - Extracts Markdown from locally saved free PDFs for easier search (best-effort) via the
+    parallel, hash-cached stage in scripts/extract_markdown.py (--skip-markdown to defer it)
 """
 
 from __future__ import annotations
+import argparse
+import hashlib
 import json
 import os
 import re
+import threading
 import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from functools import partial
 from typing import List, Dict, Optional, Tuple
-from urllib.request import urlopen, Request
-from urllib.error import HTTPError, URLError
-
-
-PAPER_LIST = r'''
-🔬 Aptum CustomGPT Knowledge Base: Paper List with Identifiers
-Research Area: 1. Training Science
-1.1. Periodization Models: linear, undulating, block
-The Evaluation of the Modified Wave Periodization Model Efficiency on the Example of Young Soccer Players' Sprint Tests (PMID: 39563758)
-Coaches’ Perceptions of Common Planning Concepts Within Training Theory: An International Survey (PMID: 37989900)
-Reverse Periodization for Improving Sports Performance: A Systematic Review (PMID: 35445953)
-Addressing the Confusion within Periodization Research (PMID: 33467283)
-The Effect of Periodization on Training Program Adherence (PMID: 34948583)
-Benefits and Limitations of Block Periodized Training Approaches to Athletes' Preparation: A Review (PMID: 26573916)
-Block periodization of endurance training - a systematic review and meta-analysis (PMID: 31802956)
-Muscle Daily Undulating Periodization for Strength and Body Composition: The Proposal of a New Model (PMID: 36895841)
-The Effect of Block Versus Daily Undulating Periodization on Strength and Performance in Adolescent Football Players (PMID: 30569761)
-Effects of Periodization on Strength and Muscle Hypertrophy in Volume-Equated Resistance Training Programs: A Systematic Review and Meta-analysis (PMID: 35044672)
-1.2. Autoregulation using RPE and RIR
-Concurrent validity and reliability of the session rating of perceived exertion scale among high-trained rower during training sessions (PMID: 40646576)
-Gauging proximity to failure in the bench press: generalized velocity-based vs. %1RM-repetitions-to-failure approaches (PMID: 40133968)
-Feasibility and Usefulness of Repetitions-In-Reserve Scales for Selecting Exercise Intensity: A Scoping Review (PMID: 38563729)
-Modeling the repetitions-in-reserve-velocity relationship: a valid method for resistance training monitoring and prescription, and fatigue management (PMID: 38418370)
-Internal Training Load Perceived by Athletes and Planned by Coaches: A Systematic Review and Meta-Analysis (PMID: 35244801)
-1.3. Energy systems and metabolic adaptation
-The Bioenergetic Basis of Exercise Performance: A Comprehensive Review of ATP Production and Utilization (PMID: 40646577)
-Metabolic Adaptations to High-Intensity Interval Training (HIIT) vs. Moderate-Intensity Continuous Training (MICT) in Athletes (PMID: 40133969)
-The Role of Lactate in Exercise Metabolism and Performance: Beyond a Waste Product (PMID: 38563730)
-Metabolic Adaptations to Endurance Training: A Comprehensive Review (PMID: 39833538)
-The Role of Glycogen in Regulating Metabolic Adaptation to Exercise Training: A Critical Review (PMID: 39798840)
-Acute and Chronic Metabolic Responses to High-Intensity Interval Training (HIIT): A Systematic Review (PMID: 37989905)
-1.4. Skill acquisition and motor learning for mixed athletes
-Transfer of Training Effects in Multi-Sport Athletes: A Systematic Review (PMID: 40646578)
-Perceptual-Cognitive Skill Training for Enhancing Decision-Making in Complex Sports: A Systematic Review (PMID: 40133970)
-Neuromuscular Control and Adaptation in Response to Varied Training Stimuli in Athletes (PMID: 38563731)
-Motor Learning Strategies for Enhancing Skill Acquisition in Complex Sports: A Systematic Review (PMID: 39833539)
-Neuromuscular Adaptations to Concurrent Training: Implications for Skill Performance in Mixed-Sport Athletes (PMID: 39798841)
-The Role of Variability in Practice for Motor Skill Learning in Athletes: A Systematic Review (PMID: 37989906)
-Research Area: 2. Recovery Science
-2.1. HRV interpretation and autonomic balance
-Heart Rate Variability and Training Load in Elite Athletes: A Systematic Review (PMID: 39833534)
-Heart Rate Variability, Sleep, and Recovery: A Comprehensive Review (PMID: 39798836)
-The Utility of Heart Rate Variability in Monitoring Training Adaptation and Preventing Overtraining in Endurance Athletes: A Systematic Review (PMID: 37989901)
-2.2. Sleep architecture and circadian optimization
-Sleep Interventions for Enhancing Athletic Performance and Recovery: A Systematic Review and Meta-Analysis (PMID: 39833535)
-The Impact of Circadian Rhythm Disruption on Athletic Performance and Injury Risk: A Narrative Review (PMID: 39798837)
-Sleep Quality and Quantity in Elite Athletes: A Comprehensive Assessment (PMID: 37989902)
-2.3. Nervous-system regulation: vagus tone and stress adaptation
-Vagal Tone and Exercise Performance: A Systematic Review and Meta-Analysis (PMID: 39833536)
-Stress, Recovery, and Performance in Elite Athletes: The Role of the Autonomic Nervous System (PMID: 39798838)
-Heart Rate Variability Biofeedback for Enhancing Stress Resilience and Performance in Athletes: A Systematic Review (PMID: 37989903)
-2.4. Deload protocols and active recovery strategies
-The Efficacy of Deloading Strategies on Strength and Performance Adaptations in Resistance-Trained Individuals: A Systematic Review (PMID: 39833537)
-Active Recovery Strategies for Enhancing Post-Exercise Performance and Reducing Muscle Soreness: A Systematic Review and Meta-Analysis (PMID: 39798839)
-The Role of Rest and Recovery in Periodized Training Programs: A Narrative Review (PMID: 37989904)
-Research Area: 3. Nutrition and Longevity
-3.1. Macronutrient periodization and protein synthesis
-Changes in Body Composition and Nutritional Periodization during the Training Macrocycle in Football—A Narrative Review (PMID: 38732581)
-Athletes’ nutritional demands: a narrative review of nutritional requirements (PMID: 38328685)
-Advances in Understanding the Interplay between Dietary Practices, Body Composition, and Sports Performance in Athletes (PMID: 38398895)
-3.2. Intermittent fasting and caloric restriction
-Effects of Intermittent Fasting and Calorie Restriction on Exercise Performance: A Systematic Review and Meta-Analysis (PMID: 40573103)
-Intermittent Fasting: Does It Affect Sports Performance? A Systematic Review (PMID: 38201996)
-Effects of Ramadan intermittent fasting on performance, physiological responses, and bioenergetic pathway contributions during repeated sprint exercise (PMID: 38406182)
-The Effects of 24-h Fasting on Exercise Performance and Metabolic Parameters in a Pilot Study of Female CrossFit Athletes (PMID: 38004236)
-Intermittent Fasting Promotes Weight Loss without Decreasing Performance in Taekwondo (PMID: 37513549)
-3.3. Micronutrient sufficiency and neuroendocrine health
-The Importance of Vitamin D and Magnesium in Athletes (PMID: 40431395)
-Athletes’ nutritional demands: a narrative review of nutritional requirements (PMID: 38328685)
-Exploring the Relationship between Micronutrients and Athletic Performance: A Comprehensive Scientific Systematic Review of the Literature in Sports Medicine (PMID: 37368559)
-The importance of bone health for pediatric athletes: From juvenile osteochondritis dissecans to relative energy deficiency in sports (PMID: 40433287)
-Considerations for the Consumption of Vitamin and Mineral Supplements in Athlete Populations (PMID: 37358750)
-3.4. Anti-inflammatory and mitochondrial-supportive diets
-Sports nutrition knowledge, source of nutrition information and dietary consumption pattern of Ugandan endurance athletes: a cross-sectional study of the Sebei sub-region (PMID: 40317037)
-Athletes’ nutritional demands: a narrative review of nutritional requirements (PMID: 38328685)
-Diet Inflammatory Index among Regularly Physically Active Young Women and Men (PMID: 38201892)
-Popular Dietary Trends’ Impact on Athletic Performance: A Critical Analysis Review (PMID: 37630702)
-Use of the Dietary Inflammatory Index to Assess the Diet of Young Physically Active Men (PMID: 35682467)
-Research Area: 4. Contextual Aptum Data
-Utilizing Wearable Technology for Personalized Exercise Prescription and Monitoring: A Systematic Review (PMID: 40646579)
-Artificial Intelligence in Personalized Exercise and Sports: Current Applications and Future Directions (PMID: 40133971)
-The Role of Self-Reported Data and Wearable Sensors in Personalized Health Interventions: A Scoping Review (PMID: 38563732)
-Data Integration from Multiple Wearable Devices for Comprehensive Physiological Monitoring in Athletes (PMID: 37989907)
-'''
-
-
-def epmc_core(pmid: str) -> dict:
-    url = f"https://www.ebi.ac.uk/europepmc/webservices/rest/search?query=EXT_ID:{pmid}&resultType=core&format=json"
-    with urlopen(Request(url, headers={"User-Agent": "aptum-fetch/1.0"})) as r:
-        data = json.loads(r.read().decode())
-    results = data.get("resultList", {}).get("result", [])
-    return results[0] if results else {}
+from urllib.parse import urlsplit
+
+import extract_markdown
+from http_client import CircuitOpenError, HostRateLimiter, HttpClient, HTTPStatusError
+from metadata_store import DEFAULT_TTL, STORE_PATH, MetadataStore
+from metrics import RunMetrics, merge_reports
+
+
+REGISTRY_PATH = "docs/papers/registry.json"
+# Per-shard results (papers, fetch cache, metrics) waiting for `--merge`
+SHARD_DIR = ".cache/paper-shards"
+
+
+USER_AGENT = "aptum-fetch/1.0"
+
+
+RATE_LIMITER = HostRateLimiter()
+CLIENT = HttpClient(user_agent=USER_AGENT, timeout=30, rate_limiter=RATE_LIMITER)
+METRICS = RunMetrics()
+METRICS_PATH = "docs/papers/METRICS.json"
 
 
 FREE_LICENSES = {"cc by", "cc0", "cc by-sa"}
 
+# Sidecar to index.json with HTTP validators and SHA-256 per archived PDF
+CACHE_PATH = "public/papers/index.cache.json"
+
+# Downloads are streamed in fixed-size blocks and capped so memory stays flat
+CHUNK_SIZE = 64 * 1024
+MAX_PDF_BYTES = int(os.environ.get("FETCH_MAX_PDF_MB", "100")) * 1024 * 1024
+
+# Start the next PDF mirror when the current one is still running after this many seconds
+HEDGE_AFTER = float(os.environ.get("FETCH_HEDGE_AFTER", "2"))
+# Per-try timeout of raced mirror requests, so a cancelled loser gives up its connection soon
+HEDGE_TIMEOUT = float(os.environ.get("FETCH_HEDGE_TIMEOUT", "10"))
+
 
 def ensure_dir(p: str):
     os.makedirs(p, exist_ok=True)
 
 
-def http_fetch(url: str, retries: int = 3, sleep_s: float = 0.5) -> Tuple[Optional[bytes], str]:
-    """Fetch a URL with basic retry; returns (bytes or None, content_type)."""
+class DownloadError(RuntimeError):
+    """Permanent download failure (not a PDF, over the size cap); not worth retrying."""
+
+
+def looks_like_pdf(head: bytes, ct: str) -> bool:
+    return head.startswith(b"%PDF-") or "pdf" in ct
+
+
+def drop_partial(part: str) -> None:
+    """Remove a .part file and its validator sidecar (`<part>.json`), whichever exist."""
+    for path in (part, part + ".json"):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def load_partial(part: str, url: str) -> Optional[Dict]:
+    """The sidecar of a .part file left by an earlier run of `url`, if both exist and it has a validator."""
+    try:
+        with open(part + ".json", encoding="utf-8") as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if meta.get("url") != url or not meta.get("validator") or not os.path.exists(part):
+        return None
+    return meta
+
+
+def http_fetch(
+    url: str,
+    dest: str,
+    retries: int = 3,
+    headers: Optional[Dict[str, str]] = None,
+    max_bytes: int = MAX_PDF_BYTES,
+    cancel: Optional[threading.Event] = None,
+    timeout: Optional[float] = None,
+) -> Tuple[Optional[str], str, Dict]:
+    """Stream a PDF into `dest + ".part"`; returns (part path or None, content_type, info).
+
+    Connection errors, 429 and 5xx are retried by the shared client, and only by it: the
+    loop here only resumes transfers that broke after the response started. The body is read
+    in CHUNK_SIZE blocks: the %PDF- check runs on the first block, SHA-256 is computed
+    as bytes arrive and the transfer is aborted past `max_bytes`. A transfer dropped
+    mid-body is resumed with `Range` (guarded by `If-Range`) when the server sent a
+    validator. The validator is kept next to the partial file (`<part>.json`), so a transfer
+    that broke for good (dropped connection, server down, interrupted run) is left on disk
+    and the next call for the same URL resumes it the same way; it starts over when the
+    server answers 200 (the validator no longer matches). `info` carries status, etag,
+    last_modified, sha256 and bytes; a conditional request answered with 304 returns
+    (None, "", {"status": 304}). Setting `cancel` stops the transfer at the next block or
+    retry and discards the partial file; `timeout` overrides the client's per-try timeout.
+    """
+    part = dest + ".part"
+    resume = load_partial(part, url)
+    if resume is None:
+        drop_partial(part)
+    t0 = time.monotonic()
+    retried = [0]
+
+    def on_retry(*_):
+        if cancel is not None and cancel.is_set():
+            raise DownloadError("cancelled")
+        retried[0] += 1
+
+    def done(path: Optional[str], ct: str, result: Dict) -> Tuple[Optional[str], str, Dict]:
+        result.update({"retries": retried[0], "seconds": round(time.monotonic() - t0, 4)})
+        return path, ct, result
+
     last_ct = ""
+    info: Dict = {}
+    have = 0
+    digest = hashlib.sha256()
+    validator: Optional[str] = None
+    if resume is not None:
+        info = {k: resume.get(k) for k in ("status", "etag", "last_modified")}
+        validator = resume["validator"]
+        with open(part, "rb") as f:
+            for block in iter(lambda: f.read(CHUNK_SIZE), b""):
+                digest.update(block)
+                have += len(block)
+    keep = False
     for attempt in range(retries):
+        if cancel is not None and cancel.is_set():
+            info["error"] = "cancelled"
+            break
+        req_headers = dict(headers or {})
+        if have and validator:
+            req_headers["Range"] = f"bytes={have}-"
+            req_headers["If-Range"] = validator
+        responded = False
         try:
-            req = Request(url, headers={"User-Agent": "aptum-fetch/1.0"})
-            with urlopen(req, timeout=30) as r:
+            with CLIENT.request("GET", url, headers=req_headers, timeout=timeout, retries=retries, on_retry=on_retry) as r:
+                responded = True
+                if r.status == 304:
+                    return done(None, "", {"status": 304, "etag": r.headers.get("ETag"), "last_modified": r.headers.get("Last-Modified")})
                 last_ct = (r.headers.get("Content-Type") or "").lower()
-                data = r.read()
-            return data, last_ct
-        except (HTTPError, URLError) as e:
-            if attempt == retries - 1:
-                return None, last_ct
-            time.sleep(sleep_s * (attempt + 1))
-        except Exception:
-            if attempt == retries - 1:
-                return None, last_ct
-            time.sleep(sleep_s * (attempt + 1))
-    return None, last_ct
-
-
-def main():
-    pmids = re.findall(r"PMID:\s*(\d+)", PAPER_LIST)
-    pmids_unique = list(dict.fromkeys(pmids))
-    print(f"Found {len(pmids)} entries; {len(pmids_unique)} unique PMIDs")
+                if r.status != 206 or not have:
+                    # fresh body (or the server ignored our Range): start over
+                    have = 0
+                    digest = hashlib.sha256()
+                    info = {
+                        "status": r.status,
+                        "etag": r.headers.get("ETag"),
+                        "last_modified": r.headers.get("Last-Modified"),
+                    }
+                    validator = info["etag"] or info["last_modified"]
+                    if validator:
+                        with open(part + ".json", "w", encoding="utf-8") as f:
+                            json.dump({"url": url, "validator": validator, **info}, f)
+                    elif os.path.exists(part + ".json"):
+                        os.remove(part + ".json")
+                else:
+                    info["resumed_at"] = have
+                length = int(r.headers.get("Content-Length") or 0)
+                expected = have + length
+                if expected > max_bytes:
+                    raise DownloadError(f"too large ({expected} bytes > {max_bytes})")
+                with open(part, "ab" if have else "wb") as f:
+                    for block in r.iter_content(CHUNK_SIZE):
+                        if cancel is not None and cancel.is_set():
+                            raise DownloadError("cancelled")
+                        if not have and not looks_like_pdf(block, last_ct):
+                            raise DownloadError(f"not a pdf (ct={last_ct})")
+                        if have + len(block) > max_bytes:
+                            raise DownloadError(f"too large (> {max_bytes} bytes)")
+                        f.write(block)
+                        digest.update(block)
+                        have += len(block)
+                if length and have < expected:
+                    raise ConnectionError(f"truncated at {have} of {expected} bytes")
+            if not have:
+                raise DownloadError(f"empty body (ct={last_ct})")
+            info.update({"sha256": digest.hexdigest(), "bytes": have})
+            if os.path.exists(part + ".json"):
+                os.remove(part + ".json")
+            return done(part, last_ct, info)
+        except DownloadError as e:
+            info["error"] = str(e)
+            keep = False
+            break
+        except CircuitOpenError as e:
+            info["error"] = str(e)
+            keep = True
+            break
+        except HTTPStatusError as e:
+            info = dict(info, status=e.status, error=str(e))
+            keep = e.status == 429 or e.status >= 500
+            if e.status != 416:
+                break
+            have = 0
+        except Exception as e:
+            info["error"] = str(e)
+            keep = True
+            if not responded:
+                # the client has already spent its retries on this connection
+                break
+            # dropped mid-body: keep the partial file for a Range resume
+            if attempt < retries - 1:
+                retried[0] += 1
+                time.sleep(CLIENT.backoff_delay(attempt))
+    if not (keep and have and validator):
+        drop_partial(part)
+    return done(None, last_ct, info)
 
-    ensure_dir("public/papers")
-    ensure_dir("public/papers_md")
-    ensure_dir("docs/papers")
 
-    meta_all: List[Dict] = []
-    free_count = 0
-    for i, pmid in enumerate(pmids_unique, 1):
-        rec = epmc_core(pmid)
-        lic = (rec.get("license") or "").lower()
-        is_oa = (rec.get("isOpenAccess") or "").upper() == "Y"
-        title = rec.get("title") or ""
-        authors = rec.get("authorString") or ""
-        full_urls = rec.get("fullTextUrlList", {}).get("fullTextUrl", [])
-
-        # Prefer PMC mirror via PMCID if available (pmc.ncbi.nlm.nih.gov tends to be robust)
-        pdf_url = None
-        pmcid = None
-        ftids = rec.get("fullTextIdList", {}).get("fullTextId", [])
-        if ftids:
-            for fid in ftids:
-                if str(fid).upper().startswith("PMC"):
-                    pmcid = str(fid).upper()
-                    break
-        if pmcid:
-            # Try US PMC first, then Europe PMC variants
-            candidates = [
-                f"https://pmc.ncbi.nlm.nih.gov/articles/{pmcid}/pdf",
-                f"https://europepmc.org/articles/{pmcid}/pdf",
-                f"https://europepmc.org/articles/{pmcid}?pdf=render",
-            ]
-            # choose the first we can fetch successfully below
-        else:
-            for u in full_urls:
-                if u.get("documentStyle") == "pdf" and u.get("availabilityCode") in ("OA", "S", "FREE"):
-                    pdf_url = u.get("url")
-                    break
+def fetch_pdf(
+    pmid: str,
+    url: str,
+    dest: str,
+    via: str,
+    headers: Optional[Dict[str, str]] = None,
+    cancel: Optional[threading.Event] = None,
+    timeout: Optional[float] = None,
+) -> Tuple[Optional[str], str, Dict]:
+    """http_fetch plus one attempt record in the run metrics.
+
+    The winning mirror is recorded here unless the fetch is part of a race (`cancel` set),
+    where fetch_first_pdf records the winner itself.
+    """
+    part, ct, info = http_fetch(url, dest, headers=headers, cancel=cancel, timeout=timeout)
+    METRICS.attempt(
+        pmid,
+        url=url,
+        host=urlsplit(url).netloc,
+        via=via,
+        status=info.get("status"),
+        bytes=info.get("bytes", 0) if part else 0,
+        retries=info.get("retries", 0),
+        seconds=info.get("seconds", 0.0),
+        error=None if (part or info.get("status") == 304) else info.get("error"),
+    )
+    if part and cancel is None:
+        METRICS.set(pmid, "download", mirror=urlsplit(url).netloc)
+    return part, ct, info
+
+
+def fetch_first_pdf(
+    pmid: str,
+    candidates: List[str],
+    dest: str,
+    hedge_after: float = HEDGE_AFTER,
+) -> Tuple[Optional[str], str, Dict, Optional[str]]:
+    """Fetch the first valid PDF among mirror candidates; returns (part, ct, info, winning url).
+
+    Candidate k+1 starts as soon as candidate k fails, or when it is still running
+    after `hedge_after` seconds (a hedged request, recorded with via="hedge"). The
+    first complete %PDF- body wins and is returned at once; the others are cancelled
+    (raced requests use the short HEDGE_TIMEOUT per try) and their `<dest>.m<k>.part`
+    files are removed in the background when they return. With hedge_after <= 0 the
+    candidates are tried strictly one after another.
+    """
+    if hedge_after <= 0 or len(candidates) < 2:
+        part, ct, info = None, "", {}
+        for cand in candidates:
+            part, ct, info = fetch_pdf(pmid, cand, dest, "mirror")
+            if part:
+                return part, ct, info, cand
+        return None, ct, info, None
 
-        save_local = is_oa and lic in FREE_LICENSES and (pmcid or pdf_url)
-        local_path = None
-        download_error: Optional[str] = None
-        if save_local:
-            free_count += 1
-            local_path = f"public/papers/{pmid}.pdf"
+    cancel = threading.Event()
+    pool = ThreadPoolExecutor(max_workers=len(candidates))
+    running: Dict = {}
+    started = 0
+    last: Tuple[Optional[str], str, Dict, Optional[str]] = (None, "", {}, None)
+
+    def launch(via: str) -> None:
+        nonlocal started
+        url = candidates[started]
+        fut = pool.submit(fetch_pdf, pmid, url, f"{dest}.m{started}", via, None, cancel, HEDGE_TIMEOUT)
+        running[fut] = (url, f"{dest}.m{started}.part")
+        started += 1
+
+    try:
+        launch("mirror")
+        while running:
+            more = started < len(candidates)
+            done, _ = wait(running, timeout=hedge_after if more else None, return_when=FIRST_COMPLETED)
+            if not done:
+                launch("hedge")
+                continue
+            for fut in done:
+                url, _ = running.pop(fut)
+                part, ct, info = fut.result()
+                if part:
+                    METRICS.set(pmid, "download", mirror=urlsplit(url).netloc)
+                    return part, ct, info, url
+                last = (None, ct, info, None)
+            if started < len(candidates):
+                launch("mirror")
+    finally:
+        # don't wait for the losers: they stop at their next block or retry, and whatever
+        # partial file they leave (a late one may even finish) is dropped once they return
+        cancel.set()
+        for fut, (_, stale) in running.items():
+            fut.add_done_callback(lambda _, stale=stale: drop_partial(stale))
+        pool.shutdown(wait=False)
+    return last
+
+
+def record_outcome(cache: Optional[FetchCache], pmid: str, outcome: str) -> None:
+    if cache is not None:
+        cache.count(outcome)
+    METRICS.set(pmid, outcome=outcome)
+
+
+def file_sha256(path: str) -> Optional[str]:
+    if not os.path.exists(path):
+        return None
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(CHUNK_SIZE), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def commit_pdf(part: str, dest: str, sha: str) -> bool:
+    """Atomically move a finished download into place unless `dest` already has these bytes."""
+    if file_sha256(dest) == sha:
+        os.remove(part)
+        return False
+    os.replace(part, dest)
+    return True
+
+
+def record_fingerprint(rec: dict) -> str:
+    """Hash of the Europe PMC fields that decide whether/where a PDF is archived."""
+    keys = ("title", "authorString", "license", "isOpenAccess", "doi", "fullTextIdList", "fullTextUrlList")
+    blob = json.dumps({k: rec.get(k) for k in keys}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+def mirror_key(url: str, pmcid: str) -> str:
+    """Mirror identity independent of the paper, e.g. https://europepmc.org/articles/{pmcid}/pdf."""
+    return url.replace(pmcid, "{pmcid}")
+
+
+class FetchCache:
+    """Sidecar to index.json: per-PMID record fingerprint, PDF URL, HTTP validators and SHA-256,
+    plus how often each PMC mirror won a download (used to order mirror candidates).
+
+    Lets incremental runs skip unchanged PMIDs entirely and revalidate PDFs with
+    conditional requests instead of downloading them again.
+    """
+
+    OUTCOMES = ("hit", "revalidated", "downloaded", "unchanged", "failed", "linked")
+
+    def __init__(self, path: str = CACHE_PATH):
+        self.path = path
+        self.entries: Dict[str, Dict] = {}
+        # mirror URL template -> downloads it won (all runs / this run)
+        self.mirrors: Dict[str, int] = {}
+        self.run_wins: Dict[str, int] = {}
+        self.counts: Dict[str, int] = {k: 0 for k in self.OUTCOMES}
+        self.lock = threading.Lock()
+        if os.path.exists(path):
             try:
-                data = None
-                ct = ""
-                tried = []
-                if pmcid:
-                    for cand in candidates:
-                        tried.append(cand)
-                        data, ct = http_fetch(cand)
-                        if data and (data.startswith(b"%PDF-") or "pdf" in ct):
-                            pdf_url = cand
-                            break
-                        data = None
-                if data is None and pdf_url:
-                    tried.append(pdf_url)
-                    data, ct = http_fetch(pdf_url)
-                if not data or (not data.startswith(b"%PDF-") and "pdf" not in ct):
-                    raise RuntimeError(f"not a pdf (ct={ct}) from {pdf_url or 'pmcid candidates'}")
-                with open(local_path, "wb") as f:
-                    f.write(data)
-                print(f"[{i:02d}] saved {pmid}.pdf under free license {lic}")
+                with open(path, encoding="utf-8") as f:
+                    data = json.load(f)
+                self.entries = data.get("papers", {})
+                self.mirrors = data.get("mirrors", {})
             except Exception as e:
-                download_error = str(e)
-                print(f"[{i:02d}] failed to download PDF for {pmid}: {e}")
-                local_path = None
-
-        # Fallback via Unpaywall if needed (DOI-based)
-        fallback_url = None
-        fallback_via = None
-        if (local_path is None) and is_oa and (lic in FREE_LICENSES):
-            doi = (rec.get("doi") or "").strip()
-            email = os.environ.get("UNPAYWALL_EMAIL", "bot+ii-agent@users.noreply.github.com")
-            if doi:
-                try:
-                    up_url = f"https://api.unpaywall.org/v2/{doi}?email={email}"
-                    with urlopen(Request(up_url, headers={"User-Agent": "aptum-fetch/1.0"})) as r:
-                        up = json.loads(r.read().decode())
-                    locs = up.get("oa_locations") or []
-
-                    def norm_lic(s: Optional[str]) -> str:
-                        return (s or "").lower().replace("-", " ")
-
-                    chosen = None
-                    for pref_host in ("repository", "publisher"):
-                        for loc in locs:
-                            if loc.get("url_for_pdf") and loc.get("host_type") == pref_host and norm_lic(loc.get("license")) in FREE_LICENSES:
-                                chosen = loc
-                                break
-                        if chosen:
-                            break
-                    if not chosen:
-                        best = up.get("best_oa_location") or {}
-                        if best.get("url_for_pdf") and norm_lic(best.get("license")) in FREE_LICENSES:
-                            chosen = best
-                    if chosen:
-                        cand_url = chosen.get("url_for_pdf")
-                        try:
-                            req = Request(cand_url, headers={"User-Agent": "aptum-fetch/1.0"})
-                            with urlopen(req) as r:
-                                ct = (r.headers.get("Content-Type") or "").lower()
-                                data = r.read()
-                            if not data.startswith(b"%PDF-") and "pdf" not in ct:
-                                raise RuntimeError(f"not a pdf (ct={ct})")
-                            local_path = f"public/papers/{pmid}.pdf"
-                            with open(local_path, "wb") as f:
-                                f.write(data)
-                            print(f"[{i:02d}] saved via Unpaywall fallback {pmid}.pdf")
-                            fallback_url = cand_url
-                            fallback_via = "unpaywall"
-                        except Exception as e:
-                            print(f"[{i:02d}] Unpaywall fallback failed for {pmid}: {e}")
-                            local_path = None
-                except Exception as e:
-                    print(f"[{i:02d}] Unpaywall query failed for {pmid}: {e}")
-
-        meta = {
-            "pmid": pmid,
-            "title": title,
-            "authors": authors,
-            "license": lic,
-            "isOpenAccess": is_oa,
-            "pdf_url": pdf_url,
-            "local_path": local_path,
-            "source": f"https://europepmc.org/abstract/MED/{pmid}",
-            "download_error": download_error,
-            "fallback_pdf_url": fallback_url,
-            "fallback_via": fallback_via,
-        }
-        meta_all.append(meta)
-        time.sleep(0.08)
+                print("ignoring unreadable fetch cache:", e)
+
+    def get(self, pmid: str) -> Dict:
+        with self.lock:
+            return dict(self.entries.get(pmid) or {})
+
+    def put(self, pmid: str, entry: Dict) -> None:
+        with self.lock:
+            self.entries[pmid] = entry
+
+    def add_wins(self, wins: Dict[str, int]) -> None:
+        with self.lock:
+            for key, n in wins.items():
+                self.mirrors[key] = self.mirrors.get(key, 0) + n
+                self.run_wins[key] = self.run_wins.get(key, 0) + n
+
+    def record_win(self, key: str) -> None:
+        self.add_wins({key: 1})
+
+    def rank_mirrors(self, candidates: List[str], pmcid: str, preferred: Optional[str] = None) -> List[str]:
+        """The URL that served this paper before first, then mirrors by past wins (stable)."""
+        with self.lock:
+            wins = dict(self.mirrors)
+        return sorted(candidates, key=lambda u: (u != preferred, -wins.get(mirror_key(u, pmcid), 0)))
+
+    def count(self, outcome: str) -> None:
+        with self.lock:
+            self.counts[outcome] = self.counts.get(outcome, 0) + 1
+
+    def summary(self) -> str:
+        c = self.counts
+        return (f"{c['hit']} hits, {c['revalidated']} revalidated, {c['downloaded']} downloaded, "
+                f"{c['unchanged']} re-fetched but unchanged, {c['failed']} failed, {c['linked']} linked only")
+
+    def save(self) -> None:
+        with self.lock:
+            data = {
+                "version": 1,
+                "mirrors": dict(sorted(self.mirrors.items())),
+                "papers": {k: self.entries[k] for k in sorted(self.entries)},
+            }
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp, self.path)
+
+
+def entry_id(entry: Dict) -> str:
+    """Stable registry id: the PMID itself, else `arxiv:<id>` or `doi:<doi>`."""
+    if entry.get("pmid"):
+        return str(entry["pmid"])
+    for kind in ("arxiv", "doi"):
+        if entry.get(kind):
+            return f"{kind}:{entry[kind]}"
+    raise ValueError(f"registry entry has no pmid, arxiv or doi: {entry}")
+
+
+def paper_id(m: Dict) -> str:
+    """Registry id of an index.json entry (external papers carry an explicit `id`)."""
+    return m.get("id") or m.get("pmid") or ""
 
-    # Write index.json
-    with open("public/papers/index.json", "w", encoding="utf-8") as f:
-        json.dump({"generatedAt": time.time(), "freeCount": sum(1 for m in meta_all if m.get("isOpenAccess") and m.get("license") in FREE_LICENSES), "papers": meta_all}, f, ensure_ascii=False, indent=2)
 
-    # Markdown extraction for locally saved free PDFs
+def pdf_path(pid: str) -> str:
+    return f"public/papers/{re.sub(r'[^A-Za-z0-9.-]', '_', pid)}.pdf"
+
+
+def load_registry(path: str = REGISTRY_PATH) -> List[Dict]:
+    """Read docs/papers/registry.json; returns entries (first occurrence wins) with an `id` field."""
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    entries: List[Dict] = []
+    seen = set()
+    for entry in data.get("papers", []):
+        pid = entry_id(entry)
+        if pid not in seen:
+            seen.add(pid)
+            entries.append(dict(entry, id=pid))
+    return entries
+
+
+def parse_shard(spec: str) -> Tuple[int, int]:
+    """`i/n` with 0 <= i < n, e.g. `0/4` .. `3/4`."""
     try:
-        import subprocess
-        try:
-            import pdfminer  # type: ignore
-        except Exception:
-            subprocess.run(["python", "-m", "pip", "-q", "install", "pdfminer.six"], check=False)
-        from pdfminer.high_level import extract_text  # type: ignore
-        for m in meta_all:
-            if m.get("local_path") and (m.get("license") in FREE_LICENSES):
-                pdf_fp = m["local_path"]
-                md_fp = f"public/papers_md/{m['pmid']}.md"
-                try:
-                    text = extract_text(pdf_fp)
-                    with open(md_fp, "w", encoding="utf-8") as outf:
-                        outf.write(f"---\npmid: {m['pmid']}\nlicense: {m.get('license','')}\nsource: {m.get('source','')}\ntitle: {m.get('title','').replace(':',' -')}\n---\n\n")
-                        outf.write((text or "").strip() + "\n")
-                except Exception as e:
-                    print("markdown-extract failed", m['pmid'], e)
+        i, n = (int(x) for x in spec.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected i/n, got {spec!r}")
+    if n < 1 or not 0 <= i < n:
+        raise argparse.ArgumentTypeError(f"shard index must satisfy 0 <= i < n, got {spec!r}")
+    return i, n
+
+
+def shard_of(pid: str, n: int) -> int:
+    """Stable shard assignment: adding papers to the registry never moves existing ones."""
+    return int(hashlib.sha1(pid.encode("utf-8")).hexdigest(), 16) % n
+
+
+def shard_path(i: int, n: int, shard_dir: str = SHARD_DIR) -> str:
+    return os.path.join(shard_dir, f"shard-{i}-of-{n}.json")
+
+
+def load_previous_index(path: str = "public/papers/index.json") -> Dict[str, Dict]:
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, encoding="utf-8") as f:
+            return {paper_id(m): m for m in json.load(f).get("papers", []) if paper_id(m)}
     except Exception as e:
-        print("skip markdown conversion:", e)
+        print("ignoring unreadable previous index:", e)
+        return {}
+
+
+def conditional_headers(entry: Dict) -> Dict[str, str]:
+    headers = {}
+    if entry.get("etag"):
+        headers["If-None-Match"] = entry["etag"]
+    if entry.get("last_modified"):
+        headers["If-Modified-Since"] = entry["last_modified"]
+    return headers
+
+
+def is_cache_hit(pmid: str, fingerprint: str, entry: Dict, prev: Optional[Dict]) -> bool:
+    """Unchanged metadata and, if the PDF was archived, the same bytes still on disk."""
+    if not prev or entry.get("fingerprint") != fingerprint:
+        return False
+    is_free = prev.get("isOpenAccess") and prev.get("license") in FREE_LICENSES
+    if not prev.get("local_path"):
+        # previously failed free downloads are always retried
+        return not is_free
+    return bool(entry.get("sha256")) and file_sha256(prev["local_path"]) == entry["sha256"]
+
+
+def unpaywall_fallback(i: int, pmid: str, rec: dict, cache: Optional[FetchCache] = None) -> Tuple[Optional[str], Optional[str], Optional[str]]:
+    """Try to save a free-licensed PDF located via Unpaywall; returns (local_path, url, via)."""
+    doi = (rec.get("doi") or "").strip()
+    email = os.environ.get("UNPAYWALL_EMAIL", "bot+ii-agent@users.noreply.github.com")
+    if not doi:
+        return None, None, None
+    try:
+        up_url = f"https://api.unpaywall.org/v2/{doi}?email={email}"
+        t0 = time.monotonic()
+        up = CLIENT.get_json(up_url)
+        METRICS.set(pmid, "fallback", lookup_seconds=round(time.monotonic() - t0, 4))
+        locs = up.get("oa_locations") or []
+
+        def norm_lic(s: Optional[str]) -> str:
+            return (s or "").lower().replace("-", " ")
+
+        chosen = None
+        for pref_host in ("repository", "publisher"):
+            for loc in locs:
+                if loc.get("url_for_pdf") and loc.get("host_type") == pref_host and norm_lic(loc.get("license")) in FREE_LICENSES:
+                    chosen = loc
+                    break
+            if chosen:
+                break
+        if not chosen:
+            best = up.get("best_oa_location") or {}
+            if best.get("url_for_pdf") and norm_lic(best.get("license")) in FREE_LICENSES:
+                chosen = best
+        if chosen:
+            cand_url = chosen.get("url_for_pdf")
+            try:
+                local_path = pdf_path(pmid)
+                part, ct, info = fetch_pdf(pmid, cand_url, local_path, "unpaywall")
+                if not part:
+                    raise RuntimeError(info.get("error") or f"download failed (status={info.get('status')}, ct={ct})")
+                written = commit_pdf(part, local_path, info["sha256"])
+                if cache is not None:
+                    cache.put(pmid, {"fingerprint": record_fingerprint(rec), "url": cand_url, "sha256": info["sha256"], "bytes": info["bytes"]})
+                record_outcome(cache, pmid, "downloaded" if written else "unchanged")
+                print(f"[{i:02d}] saved via Unpaywall fallback {os.path.basename(local_path)}")
+                return local_path, cand_url, "unpaywall"
+            except Exception as e:
+                print(f"[{i:02d}] Unpaywall fallback failed for {pmid}: {e}")
+    except Exception as e:
+        print(f"[{i:02d}] Unpaywall query failed for {pmid}: {e}")
+    return None, None, None
+
+
+def process_paper(
+    i: int,
+    pmid: str,
+    rec: dict,
+    prev: Optional[Dict] = None,
+    cache: Optional[FetchCache] = None,
+    incremental: bool = False,
+    hedge_after: float = HEDGE_AFTER,
+) -> Dict:
+    """Download and describe one PMID from its Europe PMC core record; safe to run concurrently.
+
+    With `incremental`, a PMID whose record fingerprint and archived PDF are
+    unchanged since the previous run is returned from `prev` without any request,
+    and a known PDF URL is revalidated with If-None-Match / If-Modified-Since.
+    PMC mirror candidates are raced with fetch_first_pdf (see `hedge_after`).
+    """
+    fingerprint = record_fingerprint(rec)
+    entry = cache.get(pmid) if cache is not None else {}
+    incremental = incremental and cache is not None
+    if incremental and is_cache_hit(pmid, fingerprint, entry, prev):
+        record_outcome(cache, pmid, "hit")
+        return prev
+
+    lic = (rec.get("license") or "").lower()
+    is_oa = (rec.get("isOpenAccess") or "").upper() == "Y"
+    title = rec.get("title") or ""
+    authors = rec.get("authorString") or ""
+    full_urls = rec.get("fullTextUrlList", {}).get("fullTextUrl", [])
+
+    # Prefer PMC mirror via PMCID if available (pmc.ncbi.nlm.nih.gov tends to be robust)
+    pdf_url = None
+    pmcid = None
+    candidates: List[str] = []
+    ftids = rec.get("fullTextIdList", {}).get("fullTextId", [])
+    if ftids:
+        for fid in ftids:
+            if str(fid).upper().startswith("PMC"):
+                pmcid = str(fid).upper()
+                break
+    if pmcid:
+        # Try US PMC first, then Europe PMC variants
+        candidates = [
+            f"https://pmc.ncbi.nlm.nih.gov/articles/{pmcid}/pdf",
+            f"https://europepmc.org/articles/{pmcid}/pdf",
+            f"https://europepmc.org/articles/{pmcid}?pdf=render",
+        ]
+        # choose the first we can fetch successfully below
+    else:
+        for u in full_urls:
+            if u.get("documentStyle") == "pdf" and u.get("availabilityCode") in ("OA", "S", "FREE"):
+                pdf_url = u.get("url")
+                break
+
+    save_local = is_oa and lic in FREE_LICENSES and (pmcid or pdf_url)
+    local_path = None
+    download_error: Optional[str] = None
+    if save_local:
+        local_path = pdf_path(pmid)
+        try:
+            part = None
+            ct = ""
+            info: Dict = {}
+            tried = []
+            cached_url = entry.get("url")
+            if incremental and cached_url and entry.get("sha256") and file_sha256(local_path) == entry["sha256"]:
+                # Known PDF still on disk: ask the server whether it changed
+                tried.append(cached_url)
+                part, ct, info = fetch_pdf(pmid, cached_url, local_path, "revalidate", headers=conditional_headers(entry))
+                if info.get("status") == 304 or part:
+                    pdf_url = cached_url
+            if info.get("status") == 304:
+                entry.update({"fingerprint": fingerprint, "checked_at": time.time()})
+                cache.put(pmid, entry)
+                record_outcome(cache, pmid, "revalidated")
+                print(f"[{i:02d}] {pmid}.pdf not modified (revalidated)")
+            else:
+                if part is None and pmcid:
+                    # Mirrors that won before go first; slow ones get hedged after hedge_after seconds
+                    ranked = cache.rank_mirrors(candidates, pmcid, entry.get("url")) if cache is not None else candidates
+                    tried.extend(ranked)
+                    part, ct, info, won = fetch_first_pdf(pmid, ranked, local_path, hedge_after)
+                    if part:
+                        pdf_url = won
+                        if cache is not None:
+                            cache.record_win(mirror_key(won, pmcid))
+                if part is None and pdf_url:
+                    tried.append(pdf_url)
+                    part, ct, info = fetch_pdf(pmid, pdf_url, local_path, "fulltext")
+                if not part:
+                    raise RuntimeError(f"{info.get('error') or f'not a pdf (ct={ct})'} from {pdf_url or 'pmcid candidates'}")
+                sha = info["sha256"]
+                written = commit_pdf(part, local_path, sha)
+                if cache is not None:
+                    cache.put(pmid, {
+                        "fingerprint": fingerprint,
+                        "url": pdf_url,
+                        "etag": info.get("etag"),
+                        "last_modified": info.get("last_modified"),
+                        "sha256": sha,
+                        "bytes": info["bytes"],
+                        "checked_at": time.time(),
+                    })
+                record_outcome(cache, pmid, "downloaded" if written else "unchanged")
+                if written:
+                    print(f"[{i:02d}] saved {pmid}.pdf under free license {lic}")
+                else:
+                    print(f"[{i:02d}] {pmid}.pdf unchanged (sha256 {sha[:12]})")
+        except Exception as e:
+            download_error = str(e)
+            print(f"[{i:02d}] failed to download PDF for {pmid}: {e}")
+            local_path = None
+
+    # Fallback via Unpaywall if needed (DOI-based)
+    fallback_url = None
+    fallback_via = None
+    if (local_path is None) and is_oa and (lic in FREE_LICENSES):
+        local_path, fallback_url, fallback_via = unpaywall_fallback(i, pmid, rec, cache)
+
+    if local_path is None:
+        # remember the fingerprint so unchanged restricted/linked-only PMIDs become hits
+        if cache is not None:
+            cache.put(pmid, {"fingerprint": fingerprint, "checked_at": time.time()})
+        record_outcome(cache, pmid, "failed" if (is_oa and lic in FREE_LICENSES) else "linked")
+
+    return {
+        "pmid": pmid,
+        "title": title,
+        "authors": authors,
+        "license": lic,
+        "isOpenAccess": is_oa,
+        "pdf_url": pdf_url,
+        "local_path": local_path,
+        "source": f"https://europepmc.org/abstract/MED/{pmid}",
+        "download_error": download_error,
+        "fallback_pdf_url": fallback_url,
+        "fallback_via": fallback_via,
+    }
+
+
+def process_external(
+    i: int,
+    entry: Dict,
+    prev: Optional[Dict] = None,
+    cache: Optional[FetchCache] = None,
+    incremental: bool = False,
+) -> Dict:
+    """Archive a registry entry without a PMID (arXiv preprint or bare DOI).
+
+    Title and license come from the registry. arXiv PDFs are fetched from arxiv.org
+    when the registry declares a free license; DOIs go through Unpaywall, which only
+    picks free-licensed locations. Everything else is linked.
+    """
+    pid = entry["id"]
+    lic = (entry.get("license") or "").lower()
+    fingerprint = record_fingerprint(entry)
+    cache_entry = cache.get(pid) if cache is not None else {}
+    incremental = incremental and cache is not None
+    if incremental and is_cache_hit(pid, fingerprint, cache_entry, prev):
+        record_outcome(cache, pid, "hit")
+        return prev
+
+    local_path = None
+    pdf_url = None
+    download_error: Optional[str] = None
+    fallback_url = None
+    fallback_via = None
+    if entry.get("arxiv"):
+        source = f"https://arxiv.org/abs/{entry['arxiv']}"
+        pdf_url = f"https://arxiv.org/pdf/{entry['arxiv']}"
+        is_oa = True
+        if lic in FREE_LICENSES:
+            dest = pdf_path(pid)
+            part, ct, info = fetch_pdf(pid, pdf_url, dest, "arxiv")
+            if part:
+                written = commit_pdf(part, dest, info["sha256"])
+                local_path = dest
+                if cache is not None:
+                    cache.put(pid, {"fingerprint": fingerprint, "url": pdf_url, "etag": info.get("etag"),
+                                    "last_modified": info.get("last_modified"), "sha256": info["sha256"],
+                                    "bytes": info["bytes"], "checked_at": time.time()})
+                record_outcome(cache, pid, "downloaded" if written else "unchanged")
+                print(f"[{i:02d}] saved {os.path.basename(dest)} under free license {lic}")
+            else:
+                download_error = info.get("error") or f"not a pdf (ct={ct})"
+                print(f"[{i:02d}] failed to download PDF for {pid}: {download_error}")
+    else:
+        source = f"https://doi.org/{entry['doi']}"
+        is_oa = lic in FREE_LICENSES
+        local_path, fallback_url, fallback_via = unpaywall_fallback(i, pid, entry, cache)
+
+    if local_path is None:
+        if cache is not None:
+            cache.put(pid, {"fingerprint": fingerprint, "checked_at": time.time()})
+        record_outcome(cache, pid, "failed" if (is_oa and lic in FREE_LICENSES) else "linked")
+
+    meta = {
+        "id": pid,
+        "pmid": None,
+        "title": entry.get("title") or "",
+        "authors": entry.get("authors") or "",
+        "license": lic,
+        "isOpenAccess": is_oa,
+        "pdf_url": pdf_url,
+        "local_path": local_path,
+        "source": source,
+        "download_error": download_error,
+        "fallback_pdf_url": fallback_url,
+        "fallback_via": fallback_via,
+    }
+    for kind in ("arxiv", "doi"):
+        if entry.get(kind):
+            meta[kind] = entry[kind]
+    return meta
+
+
+def process_entry(
+    i: int,
+    entry: Dict,
+    rec: Optional[dict],
+    prev: Optional[Dict] = None,
+    cache: Optional[FetchCache] = None,
+    incremental: bool = False,
+    hedge_after: float = HEDGE_AFTER,
+) -> Dict:
+    if entry.get("pmid"):
+        return process_paper(i, entry["id"], rec or {}, prev, cache, incremental, hedge_after)
+    return process_external(i, entry, prev, cache, incremental)
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    ap = argparse.ArgumentParser(description="Fetch free-licensed papers from Europe PMC.")
+    ap.add_argument("--registry", default=REGISTRY_PATH,
+                    help=f"paper registry JSON (default: {REGISTRY_PATH})")
+    ap.add_argument("--workers", type=int, default=int(os.environ.get("FETCH_WORKERS", "8")),
+                    help="number of PMIDs processed concurrently (default: 8 or $FETCH_WORKERS)")
+    ap.add_argument("--rate", type=float, default=float(os.environ.get("FETCH_RATE", "5")),
+                    help="requests per second allowed per host (default: 5 or $FETCH_RATE)")
+    ap.add_argument("--burst", type=int, default=int(os.environ.get("FETCH_BURST", "5")),
+                    help="token-bucket burst size per host (default: 5 or $FETCH_BURST)")
+    ap.add_argument("--hedge-after", type=float, default=HEDGE_AFTER,
+                    help="start the next PDF mirror when the current one has not finished after this many "
+                         "seconds; 0 tries mirrors one at a time (default: 2 or $FETCH_HEDGE_AFTER)")
+    ap.add_argument("--incremental", action="store_true",
+                    help="reuse the previous index.json and fetch cache: skip unchanged PMIDs, "
+                         "revalidate known PDFs with ETag/Last-Modified")
+    ap.add_argument("--metadata-db", default=STORE_PATH, help=f"Europe PMC metadata store (default: {STORE_PATH})")
+    ap.add_argument("--metadata-ttl", type=float, default=DEFAULT_TTL / 86400,
+                    help="days a stored Europe PMC record stays fresh (default: 7 or $METADATA_TTL_DAYS)")
+    ap.add_argument("--offline", action="store_true",
+                    help="use only the metadata store for Europe PMC records (PDF downloads still need the network)")
+    ap.add_argument("--skip-markdown", action="store_true",
+                    help="do not run the PDF -> Markdown stage (run scripts/extract_markdown.py separately)")
+    mode = ap.add_mutually_exclusive_group()
+    mode.add_argument("--shard", type=parse_shard, metavar="I/N",
+                      help=f"process only registry entries with hash(id) %% N == I and write {SHARD_DIR}/shard-I-of-N.json "
+                           "instead of the index, README and audit")
+    mode.add_argument("--merge", type=int, metavar="N",
+                      help="combine the N shard results into index.json, README, AUDIT, METRICS and the fetch cache")
+    ap.add_argument("--shard-dir", default=SHARD_DIR, help=f"where shard results are written/read (default: {SHARD_DIR})")
+    return ap.parse_args(argv)
+
+
+def fetch_entries(entries: List[Dict], cache: FetchCache, previous: Dict[str, Dict], args: argparse.Namespace) -> List[Dict]:
+    """Resolve metadata and archive every entry; returns index.json records in entry order."""
+    pmids = [e["id"] for e in entries if e.get("pmid")]
+
+    # Stored records younger than the TTL are reused; the rest go out as one batched
+    # OR-query per ~100 PMIDs instead of one search call per paper
+    batch_stats: List[Dict] = []
+    store = MetadataStore(args.metadata_db, ttl=args.metadata_ttl * 86400)
+    with METRICS.phase("metadata"):
+        records = store.resolve(pmids, client=CLIENT, offline=args.offline, stats=batch_stats) if pmids else {}
+    print(f"Resolved {len(records)} of {len(pmids)} PMIDs (metadata store: {store.summary()})")
+    fetched = {pmid for st in batch_stats for pmid in st["pmids"]}
+    for pmid in pmids:
+        if pmid not in fetched:
+            METRICS.set(pmid, "metadata", cached=True, found=pmid in records)
+    store.close()
+    for b, st in enumerate(batch_stats):
+        for pmid in st["pmids"]:
+            METRICS.set(pmid, "metadata", batch=b, batch_size=len(st["pmids"]), batch_pages=st["pages"],
+                        batch_seconds=st["seconds"], found=pmid in records)
+    recs = [records.get(e["id"]) for e in entries]
+    prevs = [previous.get(e["id"]) for e in entries]
+
+    # Workers share the per-host rate limiter; map() keeps results in registry order.
+    workers = max(1, args.workers)
+    work = partial(process_entry, cache=cache, incremental=args.incremental, hedge_after=args.hedge_after)
+    with METRICS.phase("download"), ThreadPoolExecutor(max_workers=workers) as pool:
+        meta_all: List[Dict] = list(pool.map(work, range(1, len(entries) + 1), entries, recs, prevs))
+    print(f"Fetch summary: {cache.summary()}")
+
+    # Markdown extraction for locally saved free PDFs (parallel, skips unchanged PDFs)
+    if not args.skip_markdown:
+        with METRICS.phase("markdown"):
+            extracted = extract_markdown.run(meta_all)
+        for r in extracted.get("results", []):
+            METRICS.set(r["pmid"], "extract", outcome=r["outcome"], pages=r.get("pages"),
+                        seconds=round(r.get("seconds", 0.0), 4), error=r.get("error"))
+    return meta_all
+
+
+def write_shard(path: str, i: int, n: int, meta_all: List[Dict], cache: FetchCache) -> None:
+    ids = [paper_id(m) for m in meta_all]
+    data = {
+        "shard": i,
+        "of": n,
+        "generatedAt": time.time(),
+        "papers": meta_all,
+        "cache": {pid: cache.get(pid) for pid in ids if cache.get(pid)},
+        "mirror_wins": cache.run_wins,
+        "metrics": METRICS.report(ids),
+    }
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+
+def merge_shards(n: int, registry: List[Dict], cache: FetchCache, shard_dir: str = SHARD_DIR) -> Tuple[List[Dict], List[Dict]]:
+    """Read all N shard files; returns (papers in registry order, shard metrics reports).
+
+    Shard cache entries are merged into `cache`. Missing shards, or registry entries
+    no shard covered, abort the merge rather than publish a partial index.
+    """
+    papers: Dict[str, Dict] = {}
+    reports: List[Dict] = []
+    for i in range(n):
+        fp = shard_path(i, n, shard_dir)
+        if not os.path.exists(fp):
+            raise SystemExit(f"missing shard {i}/{n}: {fp}")
+        with open(fp, encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("shard") != i or data.get("of") != n:
+            raise SystemExit(f"{fp} is shard {data.get('shard')}/{data.get('of')}, expected {i}/{n}")
+        for m in data.get("papers", []):
+            papers[paper_id(m)] = m
+        for pid, entry in (data.get("cache") or {}).items():
+            cache.put(pid, entry)
+        cache.add_wins(data.get("mirror_wins") or {})
+        reports.append(data.get("metrics") or {})
+    missing = [e["id"] for e in registry if e["id"] not in papers]
+    if missing:
+        raise SystemExit(f"{len(missing)} registry entries not covered by any shard (e.g. {missing[:5]}); re-run the shards")
+    return [papers[e["id"]] for e in registry], reports
+
+
+def write_outputs(meta_all: List[Dict]) -> None:
+    """index.json, docs/papers/README.md and docs/papers/AUDIT.json for the full registry."""
+    # Write index.json
+    with open("public/papers/index.json", "w", encoding="utf-8") as f:
+        json.dump({"generatedAt": time.time(), "freeCount": sum(1 for m in meta_all if m.get("isOpenAccess") and m.get("license") in FREE_LICENSES), "papers": meta_all}, f, ensure_ascii=False, indent=2)
 
     # README with table
     lines = []
@@ -321,10 +969,10 @@ def main():
     lines.append("|--:|---|---:|---|---|")
     for idx, m in enumerate(meta_all, 1):
         title = (m.get("title") or "").replace("|", "-")
-        pmid = m["pmid"]
+        pmid = paper_id(m)
         lic = m.get("license") or ""
         if m.get("local_path"):
-            link = f"/public/papers/{pmid}.pdf"
+            link = "/" + m["local_path"]
         else:
             link = m.get("pdf_url") or m.get("source")
         lines.append(f"| {idx} | {title} | {pmid} | {lic} | {link} |")
@@ -336,7 +984,7 @@ def main():
     try:
         free_total = sum(1 for m in meta_all if m.get("isOpenAccess") and m.get("license") in FREE_LICENSES)
         local_saved = sum(1 for m in meta_all if m.get("local_path"))
-        external_free_pmids = sorted([m["pmid"] for m in meta_all if m.get("isOpenAccess") and m.get("license") in FREE_LICENSES and not m.get("local_path")])
+        external_free_pmids = sorted([paper_id(m) for m in meta_all if m.get("isOpenAccess") and m.get("license") in FREE_LICENSES and not m.get("local_path")])
         audit = {
             "free_total": free_total,
             "local_saved": local_saved,
@@ -347,7 +995,56 @@ def main():
     except Exception as e:
         print("failed to write audit:", e)
 
-    print("\nSaved index, README, and audit.")
+
+def main(argv: Optional[List[str]] = None):
+    args = parse_args(argv)
+    RATE_LIMITER.configure(args.rate, args.burst)
+    CLIENT.pool_size = max(CLIENT.pool_size, args.workers)
+
+    registry = load_registry(args.registry)
+    print(f"Registry {args.registry}: {len(registry)} papers "
+          f"({sum(1 for e in registry if e.get('pmid'))} PMIDs, {sum(1 for e in registry if not e.get('pmid'))} external)")
+
+    ensure_dir("public/papers")
+    ensure_dir("public/papers_md")
+    ensure_dir("docs/papers")
+
+    cache = FetchCache()
+    order = [e["id"] for e in registry]
+    if args.merge:
+        meta_all, reports = merge_shards(args.merge, registry, cache, args.shard_dir)
+        print(f"Merged {args.merge} shards: {len(meta_all)} papers")
+        outputs_t0 = time.monotonic()
+        cache.save()
+        write_outputs(meta_all)
+        report = merge_reports(reports, order)
+        report["phases"]["outputs"] = round(time.monotonic() - outputs_t0, 4)
+        with open(METRICS_PATH, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    else:
+        if args.shard:
+            i, n = args.shard
+            registry = [e for e in registry if shard_of(e["id"], n) == i]
+            order = [e["id"] for e in registry]
+            print(f"Shard {i}/{n}: {len(registry)} papers")
+        previous = load_previous_index() if args.incremental else {}
+        meta_all = fetch_entries(registry, cache, previous, args)
+        if args.shard:
+            # The merge step owns the shared outputs; a shard only leaves its slice behind
+            ensure_dir(args.shard_dir)
+            fp = shard_path(i, n, args.shard_dir)
+            write_shard(fp, i, n, meta_all, cache)
+            print(f"\nSaved shard results to {fp}")
+            return
+        outputs_t0 = time.monotonic()
+        cache.save()
+        write_outputs(meta_all)
+        # Per-PMID / per-phase metrics next to AUDIT.json
+        METRICS.phases["outputs"] = round(time.monotonic() - outputs_t0, 4)
+        report = METRICS.write(METRICS_PATH, order)
+    print(f"Metrics: {report['summary']['outcomes']} phases={report['phases']} -> {METRICS_PATH}")
+
+    print("\nSaved index, README, audit and metrics.")
 
 
 if __name__ == "__main__":
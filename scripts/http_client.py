@@ -0,0 +1,469 @@
+"""
+Shared pooled HTTP client for the paper, notes and KB index scripts.
+
+Behavior:
+  - Keeps idle keep-alive connections per (scheme, host, port) and reuses them across
+    requests and threads instead of opening a new TCP+TLS connection every time
+  - Applies one default timeout and User-Agent per client
+  - Retries connection errors and 429/5xx responses with exponential backoff and full
+    jitter, honouring Retry-After when the server sends it
+  - Per-host circuit breaker: after `breaker_threshold` consecutive failures a host is
+    not contacted for `breaker_cooldown` seconds (CircuitOpenError), then one trial
+    request decides whether it closes again
+  - Optional per-host token-bucket rate limit, applied before every attempt
+  - AdaptiveLimiter: caller-side concurrency limit that shrinks on 429 / low
+    x-ratelimit-remaining-* headers and grows back while requests succeed
+  - Follows redirects (http.client does not)
+  - APTUM_HTTP_OVERRIDE=http://127.0.0.1:8123 sends every request to that server instead,
+    with the original host in X-Forwarded-Host (used by the offline benchmarks and tests)
+
+Usage:
+  client = HttpClient(user_agent="aptum-fetch/1.0")
+  data = client.get_json(url)
+  with client.request("GET", pdf_url, headers={"Range": "bytes=100-"}) as resp:
+      for block in resp.iter_content(): ...
+"""
+
+from __future__ import annotations
+import email.utils
+import http.client
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import urljoin, urlsplit
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+REDIRECT_STATUSES = {301, 302, 303, 307, 308}
+# Request headers that are not forwarded when a redirect points at another host
+SENSITIVE_HEADERS = {"authorization", "cookie"}
+# Errors raised when a pooled keep-alive connection was closed by the server meanwhile
+STALE_ERRORS = (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError, http.client.BadStatusLine)
+
+
+class HTTPStatusError(Exception):
+    """Non-success final status (>= 400 after retries)."""
+
+    def __init__(self, status: int, url: str, headers=None, body: bytes = b""):
+        super().__init__(f"HTTP {status} for {url}")
+        self.status = status
+        self.code = status
+        self.url = url
+        self.headers = headers
+        self.body = body
+
+
+class CircuitOpenError(Exception):
+    """The host's circuit breaker is open; the request was not sent."""
+
+
+class TokenBucket:
+    """Thread-safe token bucket: `rate` tokens per second, holding at most `burst`."""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = max(rate, 0.001)
+        self.capacity = max(burst, 1)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_s = (1 - self.tokens) / self.rate
+            time.sleep(wait_s)
+
+
+class HostRateLimiter:
+    """One token bucket per host, created lazily on first request to that host."""
+
+    def __init__(self, rate: float = 5.0, burst: int = 5):
+        self.rate = rate
+        self.burst = burst
+        self.buckets: Dict[str, TokenBucket] = {}
+        self.lock = threading.Lock()
+
+    def configure(self, rate: float, burst: int) -> None:
+        with self.lock:
+            self.rate = rate
+            self.burst = burst
+            self.buckets.clear()
+
+    def wait(self, url: str) -> None:
+        host = urlsplit(url).netloc.lower()
+        with self.lock:
+            bucket = self.buckets.get(host)
+            if bucket is None:
+                bucket = self.buckets[host] = TokenBucket(self.rate, self.burst)
+        bucket.acquire()
+
+
+class CircuitBreaker:
+    """Consecutive-failure breaker for one host (closed -> open -> half-open)."""
+
+    def __init__(self, threshold: int, cooldown: float):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial_in_flight = False
+        self.lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at < self.cooldown or self.trial_in_flight:
+                return False
+            self.trial_in_flight = True  # half-open: let exactly one request through
+            return True
+
+    def record(self, ok: bool) -> None:
+        with self.lock:
+            self.trial_in_flight = False
+            if ok:
+                self.failures = 0
+                self.opened_at = None
+                return
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+
+
+def header_int(headers, name: str) -> Optional[int]:
+    try:
+        value = headers.get(name) if headers is not None else None
+        return int(value) if value not in (None, "") else None
+    except (TypeError, ValueError):
+        return None
+
+
+class AdaptiveLimiter:
+    """Concurrency limit that adapts to the server's rate-limit feedback (AIMD).
+
+    Callers hold a slot for each logical request (`with limiter.slot(): ...`) and
+    pass `limiter.observe` as the client's `on_response` hook. A 429, or
+    `x-ratelimit-remaining-requests` / `-tokens` running low, halves the limit (at
+    most once per `cooldown` seconds, so one burst of 429s counts once); every
+    `limit` successes without such a signal raise it by one, up to `maximum`.
+    """
+
+    REMAINING_HEADERS = (
+        ("x-ratelimit-remaining-requests", "x-ratelimit-limit-requests"),
+        ("x-ratelimit-remaining-tokens", "x-ratelimit-limit-tokens"),
+    )
+
+    def __init__(self, initial: int = 4, minimum: int = 1, maximum: int = 32, low_water: float = 0.1, cooldown: float = 1.0):
+        self.maximum = max(1, maximum)
+        self.minimum = max(1, min(minimum, self.maximum))
+        self.limit = max(self.minimum, min(initial, self.maximum))
+        self.low_water = low_water
+        self.cooldown = cooldown
+        self.active = 0
+        self.peak = self.limit
+        self.throttled = 0
+        self._successes = 0
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    @contextmanager
+    def slot(self) -> Iterator[None]:
+        with self._cond:
+            while self.active >= self.limit:
+                self._cond.wait()
+            self.active += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self.active -= 1
+                self._cond.notify_all()
+
+    def _running_low(self, headers) -> bool:
+        for remaining_h, limit_h in self.REMAINING_HEADERS:
+            remaining = header_int(headers, remaining_h)
+            total = header_int(headers, limit_h)
+            if remaining is not None and total and remaining < max(1, total * self.low_water):
+                return True
+        return False
+
+    def observe(self, status: int, headers=None) -> None:
+        with self._cond:
+            now = time.monotonic()
+            if status == 429 or self._running_low(headers):
+                if status == 429:
+                    self.throttled += 1
+                self._successes = 0
+                if now - self._last_decrease >= self.cooldown:
+                    self._last_decrease = now
+                    self.limit = max(self.minimum, self.limit // 2)
+            elif status < 400:
+                self._successes += 1
+                if self._successes >= self.limit and self.limit < self.maximum:
+                    self._successes = 0
+                    self.limit += 1
+                    self.peak = max(self.peak, self.limit)
+                    self._cond.notify_all()
+
+    def stats(self) -> Dict[str, int]:
+        with self._cond:
+            return {"limit": self.limit, "peak": self.peak, "throttled": self.throttled}
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+        return max(0.0, when.timestamp() - time.time())
+    except Exception:
+        return None
+
+
+class Response:
+    """A streamed response; use as a context manager so the connection goes back to the pool."""
+
+    def __init__(self, client: "HttpClient", key: Tuple[str, str, int], conn, resp: http.client.HTTPResponse, url: str, attempts: int):
+        self._client = client
+        self._key = key
+        self._conn = conn
+        self._resp = resp
+        self.url = url
+        self.status = resp.status
+        self.reason = resp.reason
+        self.headers = resp.headers
+        self.attempts = attempts
+
+    def read(self, amt: Optional[int] = None) -> bytes:
+        data = self._resp.read() if amt is None else self._resp.read(amt)
+        if amt is None or not data:
+            self.close()
+        return data
+
+    def iter_content(self, chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+        while True:
+            block = self.read(chunk_size)
+            if not block:
+                return
+            yield block
+
+    def json(self):
+        return json.loads(self.read().decode("utf-8"))
+
+    def close(self) -> None:
+        if self._conn is None:
+            return
+        conn, self._conn = self._conn, None
+        # fully consumed and not marked Connection: close -> safe to reuse
+        if self._resp.isclosed() and not self._resp.will_close:
+            self._client._release(self._key, conn)
+        else:
+            conn.close()
+
+    def __enter__(self) -> "Response":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+class HttpClient:
+    def __init__(
+        self,
+        user_agent: str = "aptum-scripts/1.0",
+        timeout: float = 30,
+        retries: int = 3,
+        backoff: float = 0.5,
+        max_backoff: float = 30,
+        max_retry_after: float = 120,
+        breaker_threshold: int = 5,
+        breaker_cooldown: float = 60,
+        rate_limiter: Optional[HostRateLimiter] = None,
+        pool_size: int = 8,
+        max_redirects: int = 5,
+        host_override: Optional[str] = None,
+    ):
+        self.user_agent = user_agent
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_retry_after = max_retry_after
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown = breaker_cooldown
+        self.rate_limiter = rate_limiter
+        self.pool_size = pool_size
+        self.max_redirects = max_redirects
+        self.host_override = host_override or os.environ.get("APTUM_HTTP_OVERRIDE") or None
+        self._idle: Dict[Tuple[str, str, int], List] = {}
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    # -- connection pool -------------------------------------------------
+
+    def _acquire(self, key: Tuple[str, str, int], timeout: float):
+        with self._lock:
+            idle = self._idle.get(key)
+            conn = idle.pop() if idle else None
+        if conn is None:
+            scheme, host, port = key
+            cls = http.client.HTTPSConnection if scheme == "https" else http.client.HTTPConnection
+            return cls(host, port, timeout=timeout), False
+        conn.timeout = timeout
+        if conn.sock is not None:
+            conn.sock.settimeout(timeout)
+        return conn, True
+
+    def _release(self, key: Tuple[str, str, int], conn) -> None:
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.pool_size:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def close(self) -> None:
+        with self._lock:
+            conns = [c for idle in self._idle.values() for c in idle]
+            self._idle.clear()
+        for c in conns:
+            c.close()
+
+    def breaker(self, host: str) -> CircuitBreaker:
+        with self._lock:
+            b = self._breakers.get(host)
+            if b is None:
+                b = self._breakers[host] = CircuitBreaker(self.breaker_threshold, self.breaker_cooldown)
+            return b
+
+    def backoff_delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """Full-jitter exponential backoff; a server-provided Retry-After wins when present."""
+        if retry_after is not None:
+            return min(retry_after, self.max_retry_after)
+        return random.uniform(0, min(self.max_backoff, self.backoff * (2 ** attempt)))
+
+    # -- requests --------------------------------------------------------
+
+    def _send_once(self, method: str, url: str, headers: Dict[str, str], body: Optional[bytes], timeout: float) -> Tuple[Tuple[str, str, int], object, http.client.HTTPResponse]:
+        parts = urlsplit(url)
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+        if self.host_override:
+            headers = {**headers, "X-Forwarded-Host": parts.netloc, "X-Forwarded-Proto": parts.scheme}
+            parts = urlsplit(self.host_override)
+        scheme = parts.scheme.lower()
+        port = parts.port or (443 if scheme == "https" else 80)
+        key = (scheme, parts.hostname or "", port)
+        # a pooled connection may have been closed by the server; retry once on a fresh one
+        for _ in range(2):
+            conn, reused = self._acquire(key, timeout)
+            try:
+                conn.request(method, path, body=body, headers=headers)
+                return key, conn, conn.getresponse()
+            except STALE_ERRORS:
+                conn.close()
+                if not reused:
+                    raise
+            except Exception:
+                conn.close()
+                raise
+        raise http.client.RemoteDisconnected("connection closed")
+
+    def request(
+        self,
+        method: str,
+        url: str,
+        headers: Optional[Dict[str, str]] = None,
+        body: Optional[bytes] = None,
+        timeout: Optional[float] = None,
+        retries: Optional[int] = None,
+        on_retry: Optional[Callable[[int, Optional[int], Optional[BaseException]], None]] = None,
+        on_response: Optional[Callable[[int, object], None]] = None,
+    ) -> Response:
+        """Send a request, retrying and following redirects; returns a streamed Response.
+
+        Statuses >= 400 raise HTTPStatusError once retries are exhausted; 2xx/304
+        are returned. `on_retry(attempt, status, exc)` is called before each backoff;
+        `on_response(status, headers)` sees every response, retried ones included
+        (e.g. AdaptiveLimiter.observe). Authorization and Cookie are dropped when a
+        redirect leaves the original host.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        retries = self.retries if retries is None else max(1, retries)
+        req_headers = {"User-Agent": self.user_agent, "Accept-Encoding": "identity", **(headers or {})}
+        redirects = 0
+        attempt = 0
+        while True:
+            host = urlsplit(url).netloc.lower()
+            breaker = self.breaker(host)
+            if not breaker.allow():
+                raise CircuitOpenError(f"circuit open for {host}")
+            if self.rate_limiter is not None:
+                self.rate_limiter.wait(url)
+            try:
+                key, conn, resp = self._send_once(method, url, req_headers, body, timeout)
+            except Exception as e:
+                breaker.record(False)
+                attempt += 1
+                if attempt >= retries:
+                    raise
+                if on_retry:
+                    on_retry(attempt, None, e)
+                time.sleep(self.backoff_delay(attempt - 1))
+                continue
+
+            r = Response(self, key, conn, resp, url, attempt + 1)
+            status = resp.status
+            if on_response:
+                on_response(status, resp.headers)
+            if status in REDIRECT_STATUSES and resp.getheader("Location") and redirects < self.max_redirects:
+                breaker.record(True)
+                r.read()
+                redirects += 1
+                target = urljoin(url, resp.getheader("Location"))
+                if urlsplit(target).netloc.lower() != host:
+                    # credentials are for the original host only (as requests does)
+                    req_headers = {k: v for k, v in req_headers.items() if k.lower() not in SENSITIVE_HEADERS}
+                url = target
+                if status == 303 or (status in (301, 302) and method == "POST"):
+                    method, body = "GET", None
+                continue
+            if status in RETRY_STATUSES:
+                # 429 means "slow down", not "host is down": it does not trip the breaker
+                breaker.record(status == 429)
+                retry_after = parse_retry_after(resp.getheader("Retry-After"))
+                err_body = r.read()
+                attempt += 1
+                if attempt >= retries:
+                    raise HTTPStatusError(status, url, resp.headers, err_body)
+                if on_retry:
+                    on_retry(attempt, status, None)
+                time.sleep(self.backoff_delay(attempt - 1, retry_after))
+                continue
+            breaker.record(True)
+            if status >= 400:
+                raise HTTPStatusError(status, url, resp.headers, r.read())
+            return r
+
+    def get_json(self, url: str, headers: Optional[Dict[str, str]] = None, **kw):
+        with self.request("GET", url, headers={"Accept": "application/json", **(headers or {})}, **kw) as r:
+            return r.json()
+
+    def post_json(self, url: str, payload, headers: Optional[Dict[str, str]] = None, **kw):
+        body = json.dumps(payload).encode()
+        hdrs = {"Content-Type": "application/json", "Accept": "application/json", **(headers or {})}
+        with self.request("POST", url, headers=hdrs, body=body, **kw) as r:
+            return r.json()
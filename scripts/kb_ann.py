@@ -0,0 +1,154 @@
+"""
+IVF (inverted file) approximate nearest-neighbour index for the KB shards.
+
+Behavior:
+  - build_ivf() runs spherical k-means (NumPy, fixed seed) over a shard's unit-normalized
+    rows with nlist ~ sqrt(rows) centroids, then stores the rows of each cluster as one
+    contiguous posting list
+  - tune_nprobe() picks the smallest number of probed lists whose recall@k against an
+    exact scan reaches the target on a sample of the shard's own rows
+  - write_ivf() serializes centroids (float32), list offsets (int32, nlist + 1) and row ids
+    (int32) as little-endian sections of ivf-<shard>.bin and returns the manifest descriptor;
+    src/services/retrieve.ts scores the centroids, probes the best `nprobe` lists and only
+    scores the rows in them
+  - Shards below min_rows get no IVF; scanning them is already cheap
+  - probed_recall() measures the whole index (every shard probed, results merged) against an
+    exact scan while visiting the shards once, so the build can load them one at a time
+
+Requires numpy.
+"""
+
+from __future__ import annotations
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from kb_vectors import merge_top_k, unit
+
+MIN_ROWS = 256
+TARGET_RECALL = 0.95
+
+
+def kmeans(x: np.ndarray, k: int, iters: int = 20, seed: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+    """Spherical k-means on unit rows; returns (unit centroids, assignment per row)."""
+    rng = np.random.default_rng(seed)
+    centroids = x[rng.choice(len(x), size=k, replace=False)].copy()
+    assign = np.zeros(len(x), dtype=np.int64)
+    for it in range(iters):
+        new = np.argmax(x @ centroids.T, axis=1)
+        if it and np.array_equal(new, assign):
+            break
+        assign = new
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, x)
+        counts = np.bincount(assign, minlength=k)
+        empty = counts == 0
+        # reseed empty clusters on random rows so every list stays in use
+        sums[empty] = x[rng.choice(len(x), size=int(empty.sum()), replace=False)]
+        centroids = unit(sums)
+    return centroids.astype(np.float32), np.argmax(x @ centroids.T, axis=1)
+
+
+def build_ivf(x: np.ndarray, nlist: Optional[int] = None, seed: int = 0) -> Dict[str, np.ndarray]:
+    x = unit(np.asarray(x, dtype=np.float32))
+    nlist = nlist or max(1, int(round(np.sqrt(len(x)))))
+    centroids, assign = kmeans(x, min(nlist, len(x)), seed=seed)
+    ids = np.argsort(assign, kind="stable").astype(np.int32)
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(assign, minlength=len(centroids)))]).astype(np.int32)
+    return {"centroids": centroids, "offsets": offsets, "ids": ids}
+
+
+def probe(q: np.ndarray, ivf: Dict[str, np.ndarray], nprobe: int) -> np.ndarray:
+    """Row ids in the `nprobe` lists whose centroids are closest to unit query `q`."""
+    lists = np.argsort(-(ivf["centroids"] @ q))[:nprobe]
+    offsets, ids = ivf["offsets"], ivf["ids"]
+    return np.concatenate([ids[offsets[j] : offsets[j + 1]] for j in lists])
+
+
+def search(q: np.ndarray, x: np.ndarray, ivf: Dict[str, np.ndarray], nprobe: int, k: int) -> List[int]:
+    """Top-k rows of unit matrix `x` by cosine, scoring only the probed lists."""
+    rows = probe(q, ivf, nprobe)
+    scores = x[rows] @ q
+    top = np.argsort(-scores)[:k]
+    return rows[top].tolist()
+
+
+def sample_queries(n: int, queries: int = 200, seed: int = 0) -> np.ndarray:
+    return np.random.default_rng(seed).choice(n, size=min(queries, n), replace=False)
+
+
+def ivf_recall(x: np.ndarray, ivf: Dict[str, np.ndarray], nprobe: int, k: int = 10, picks: Optional[Sequence[int]] = None) -> Tuple[float, float]:
+    """(mean recall@k vs exact scan, mean fraction of rows scored) using rows of `x` as queries."""
+    x = unit(np.asarray(x, dtype=np.float32))
+    picks = sample_queries(len(x)) if picks is None else picks
+    hits, scanned = [], []
+    for row in picks:
+        q = x[row]
+        exact = np.argsort(-(x @ q))[: k + 1]
+        exact = [int(i) for i in exact if i != row][:k]
+        approx = [i for i in search(q, x, ivf, nprobe, k + 1) if i != row][:k]
+        hits.append(len(set(exact) & set(approx)) / max(1, len(exact)))
+        scanned.append(len(probe(q, ivf, nprobe)) / len(x))
+    return float(np.mean(hits)), float(np.mean(scanned))
+
+
+def tune_nprobe(x: np.ndarray, ivf: Dict[str, np.ndarray], target: float = TARGET_RECALL, k: int = 10) -> Dict:
+    """Smallest nprobe (1, 2, 4, ...) reaching `target` recall@k; {"nprobe", "recall_at_10", "scanned"}."""
+    nlist = len(ivf["centroids"])
+    picks = sample_queries(len(x))
+    nprobe = 1
+    while True:
+        recall, scanned = ivf_recall(x, ivf, nprobe, k, picks)
+        if recall >= target or nprobe >= nlist:
+            return {"nprobe": nprobe, "recall_at_10": round(recall, 4), "scanned": round(scanned, 4)}
+        nprobe = min(nlist, nprobe * 2)
+
+
+def probed_recall(
+    queries: np.ndarray, picks: Sequence[int], parts: Iterable[Tuple[np.ndarray, Optional[Dict[str, np.ndarray]], int]], k: int = 10
+) -> Tuple[float, float]:
+    """recall@k and scanned fraction of probing every part (exact scan where it has no IVF)
+    and merging, against an exact scan of all rows. parts are (unit rows, ivf or None, nprobe)
+    and are visited once, in order; picks are the global row ids of the queries, excluded
+    from their own results."""
+    q = len(queries)
+    exact = (np.empty((q, 0)), np.empty((q, 0), dtype=np.int64))
+    approx = [(np.empty((1, 0)), np.empty((1, 0), dtype=np.int64)) for _ in range(q)]
+    scanned = np.zeros(q)
+    start = 0
+    for x, ivf, nprobe in parts:
+        scores = queries @ x.T
+        for j, row in enumerate(picks):
+            if start <= row < start + len(x):
+                scores[j, row - start] = -np.inf
+        exact = merge_top_k(exact, scores, np.arange(start, start + len(x)), k)
+        for j in range(q):
+            rows = probe(queries[j], ivf, nprobe) if ivf is not None else np.arange(len(x))
+            scanned[j] += len(rows)
+            approx[j] = merge_top_k(approx[j], scores[j : j + 1, rows], rows[None, :] + start, k)
+        start += len(x)
+    hits = [len(set(e.tolist()) & set(a[1][0].tolist())) / k for e, a in zip(exact[1], approx)]
+    return float(np.mean(hits)), float(np.mean(scanned / max(1, start)))
+
+
+def write_ivf(path: Path, ivf: Dict[str, np.ndarray]) -> Dict:
+    sections: Dict[str, Dict[str, int]] = {}
+    pos = 0
+    with path.open("wb") as f:
+        for name, kind in (("centroids", "<f4"), ("offsets", "<i4"), ("ids", "<i4")):
+            data = np.ascontiguousarray(ivf[name], dtype=kind).tobytes()
+            f.write(data)
+            sections[name] = {"offset": pos, "bytes": len(data)}
+            pos += len(data)
+    return {"file": path.name, "nlist": int(len(ivf["centroids"])), "sections": sections, "bytes": pos}
+
+
+def read_ivf(out_dir: Path, desc: Dict) -> Dict[str, np.ndarray]:
+    raw = (Path(out_dir) / desc["file"]).read_bytes()
+    out = {}
+    for name, kind in (("centroids", "<f4"), ("offsets", "<i4"), ("ids", "<i4")):
+        sec = desc["sections"][name]
+        out[name] = np.frombuffer(raw, dtype=kind, count=sec["bytes"] // 4, offset=sec["offset"])
+    out["centroids"] = out["centroids"].reshape(desc["nlist"], -1)
+    return out
@@ -0,0 +1,217 @@
+"""
+Near-duplicate chunk elimination for the KB build (run by build_kb_index.py before embedding).
+
+Behavior:
+  - strip_boilerplate() removes lines that repeat across many chunks of one paper - PDF running
+    headers, footers, licence lines: a line (digits ignored, so "Page 3 of 12" matches every
+    page) found in at least BOILERPLATE_CHUNKS chunks and BOILERPLATE_SHARE of all chunks of
+    the same paper is cut from all of them; chunks left empty are dropped. The share keeps
+    short content lines that recur in a long paper ("crossover design", table captions) out
+    of it. Notes and video text are written by hand and left as is
+  - Deduper compares each chunk by word 5-gram shingles against the chunks kept before it:
+    128-permutation MinHash signatures, LSH with 16 bands of 8 rows to find candidates, and
+    the share of equal signature values (the MinHash estimate of the Jaccard similarity of the
+    shingle sets, +-0.03 around THRESHOLD) to confirm them (>= THRESHOLD). A match is dropped
+    in favour of the earliest kept chunk it matches, in build order (papers, then notes, then
+    videos). Only the fixed-size signature of each kept chunk is remembered, never its text
+  - dedup_stream() runs both over a stream of sources (the chunk lists of one file each), so
+    boilerplate is counted per paper and nothing else is buffered. Dropped chunks are recorded
+    under the kept chunk's id in `merged` (id, kind, title, sourceUrl and pmid / videoId /
+    page range when present); the writer stores them as that chunk's "alsoIn", so their
+    attributions survive. dedup() is the same over an in-memory list
+  - The report ({"input_chunks", "kept_chunks", "dropped", "boilerplate_lines",
+    "chars_before", "chars_after", ...}) is printed by the build and stored in the manifest
+  - The 200-character overlap chunk_text() carries between neighbouring chunks is intentional
+    and far below THRESHOLD, so it is left alone
+
+Requires numpy.
+"""
+
+from __future__ import annotations
+import hashlib
+import re
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+import numpy as np
+
+SHINGLE = 5
+PERMS = 128
+BANDS = 16
+THRESHOLD = 0.85
+BOILERPLATE_CHUNKS = 4
+BOILERPLATE_SHARE = 0.25
+BOILERPLATE_MIN_CHARS = 15
+BOILERPLATE_KINDS = ("paper",)
+# chunk fields copied into "alsoIn" for every dropped duplicate
+ATTRIBUTION = ("id", "kind", "title", "sourceUrl", "pmid", "videoId", "pageStart", "pageEnd")
+
+WORD = re.compile(r"[a-z0-9]+")
+
+
+def source_key(entry: Dict) -> str:
+    return f"{entry['kind']}:{entry.get('pmid') or entry.get('videoId') or entry.get('sourceUrl', '')}"
+
+
+def _line_key(line: str) -> str:
+    return re.sub(r"\d+", "#", " ".join(line.split()).lower())
+
+
+def strip_boilerplate(entries: List[Dict], min_chunks: int = BOILERPLATE_CHUNKS) -> Tuple[List[Dict], int]:
+    """(entries with repeated lines removed, number of distinct lines removed)."""
+    seen: Dict[str, Dict[str, int]] = {}
+    total: Dict[str, int] = {}
+    for e in entries:
+        if e["kind"] not in BOILERPLATE_KINDS:
+            continue
+        src = source_key(e)
+        total[src] = total.get(src, 0) + 1
+        counts = seen.setdefault(src, {})
+        for key in {_line_key(line) for line in e["text"].splitlines() if len(line.strip()) >= BOILERPLATE_MIN_CHARS}:
+            counts[key] = counts.get(key, 0) + 1
+    boiler = {
+        src: {k for k, n in counts.items() if n >= max(min_chunks, BOILERPLATE_SHARE * total[src])}
+        for src, counts in seen.items()
+    }
+    out: List[Dict] = []
+    for e in entries:
+        drop = boiler.get(source_key(e))
+        if drop:
+            lines = [line for line in e["text"].splitlines() if _line_key(line) not in drop]
+            text = re.sub(r"\n{3,}", "\n\n", "\n".join(lines)).strip()
+            if not text:
+                continue
+            e = dict(e, text=text)
+        out.append(e)
+    return out, sum(len(b) for b in boiler.values())
+
+
+def shingles(text: str, k: int = SHINGLE) -> Set[int]:
+    """64-bit hashes of the word k-grams of `text` (the whole text when it is shorter)."""
+    words = WORD.findall(text.lower())
+    grams = [" ".join(words[i : i + k]) for i in range(max(1, len(words) - k + 1))] if words else []
+    return {int.from_bytes(hashlib.blake2b(g.encode(), digest_size=8).digest(), "little") for g in grams}
+
+
+def _permutations(perms: int, seed: int) -> Tuple[np.ndarray, np.ndarray]:
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, 1 << 63, size=perms, dtype=np.uint64) | np.uint64(1)
+    b = rng.integers(0, 1 << 63, size=perms, dtype=np.uint64)
+    return a, b
+
+
+def minhash(hashes: Set[int], a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """MinHash signature: per permutation (odd multiply-add mod 2^64, then xorshift mixing) the minimum."""
+    x = np.fromiter(hashes, dtype=np.uint64, count=len(hashes))
+    with np.errstate(over="ignore"):
+        h = x[:, None] * a[None, :] + b[None, :]
+        h ^= h >> np.uint64(29)
+        h *= np.uint64(0xBF58476D1CE4E5B9)
+        h ^= h >> np.uint64(32)
+    return h.min(axis=0)
+
+
+def jaccard(x: Set[int], y: Set[int]) -> float:
+    return len(x & y) / len(x | y) if x or y else 1.0
+
+
+class Deduper:
+    """Streaming near-duplicate filter; see the module docstring."""
+
+    def __init__(self, threshold: float = THRESHOLD, perms: int = PERMS, bands: int = BANDS, seed: int = 0):
+        self.threshold = threshold
+        self.rows = perms // bands
+        self.bands = bands
+        self.a, self.b = _permutations(perms, seed)
+        self.buckets: Dict[Tuple[int, bytes], List[int]] = {}
+        self.signatures: Dict[int, np.ndarray] = {}
+        self.count = 0
+
+    def add(self, text: str) -> Optional[int]:
+        """Number of the earlier kept text this one duplicates (counting every text added), or None
+        when it is kept."""
+        n = self.count
+        self.count += 1
+        s = shingles(text)
+        if not s:
+            return None
+        sig = minhash(s, self.a, self.b)
+        keys = [(band, sig[band * self.rows : (band + 1) * self.rows].tobytes()) for band in range(self.bands)]
+        candidates = sorted({m for key in keys for m in self.buckets.get(key, ())})
+        for m in candidates:
+            if np.mean(self.signatures[m] == sig) >= self.threshold:
+                return m
+        self.signatures[n] = sig
+        for key in keys:
+            self.buckets.setdefault(key, []).append(n)
+        return None
+
+
+def near_duplicates(texts: Iterable[str], threshold: float = THRESHOLD, perms: int = PERMS, bands: int = BANDS, seed: int = 0) -> List[int]:
+    """Representative (the earliest kept text it duplicates, else itself) for every text."""
+    d = Deduper(threshold, perms, bands, seed)
+    out: List[int] = []
+    for i, t in enumerate(texts):
+        rep = d.add(t)
+        out.append(i if rep is None else rep)
+    return out
+
+
+def attribution(entry: Dict) -> Dict:
+    return {f: entry[f] for f in ATTRIBUTION if entry.get(f) is not None}
+
+
+def dedup_stream(
+    sources: Iterable[List[Dict]],
+    merged: Dict[str, List[Dict]],
+    report: Dict,
+    threshold: float = THRESHOLD,
+    boilerplate: Optional[int] = BOILERPLATE_CHUNKS,
+) -> Iterator[Dict]:
+    """Kept chunks of every source in order; `merged` and `report` are filled as the stream is
+    consumed (see the module docstring)."""
+    d = Deduper(threshold)
+    ids: Dict[int, str] = {}
+    report.update({
+        "method": "minhash",
+        "shingle_words": SHINGLE,
+        "perms": PERMS,
+        "bands": BANDS,
+        "threshold": threshold,
+        "input_chunks": 0,
+        "kept_chunks": 0,
+        "dropped": 0,
+        "empty_after_boilerplate": 0,
+        "boilerplate_lines": 0,
+        "chars_before": 0,
+        "chars_after": 0,
+    })
+    for entries in sources:
+        report["input_chunks"] += len(entries)
+        report["chars_before"] += sum(len(e["text"]) for e in entries)
+        if boilerplate:
+            stripped, lines = strip_boilerplate(entries, boilerplate)
+            report["empty_after_boilerplate"] += len(entries) - len(stripped)
+            report["boilerplate_lines"] += lines
+        else:
+            stripped = entries
+        for e in stripped:
+            rep = d.add(e["text"])
+            if rep is not None:
+                merged.setdefault(ids[rep], []).append(attribution(e))
+                report["dropped"] += 1
+                continue
+            ids[d.count - 1] = e["id"]
+            report["kept_chunks"] += 1
+            report["chars_after"] += len(e["text"])
+            yield e
+
+
+def dedup(entries: List[Dict], threshold: float = THRESHOLD, boilerplate: Optional[int] = BOILERPLATE_CHUNKS) -> Tuple[List[Dict], Dict]:
+    """(kept entries in build order, with "alsoIn" where chunks were merged into them, report)."""
+    merged: Dict[str, List[Dict]] = {}
+    report: Dict = {}
+    kept = [dict(e) for e in dedup_stream([entries], merged, report, threshold, boilerplate)]
+    for e in kept:
+        if e["id"] in merged:
+            e["alsoIn"] = merged[e["id"]]
+    return kept, report
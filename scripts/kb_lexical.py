@@ -0,0 +1,170 @@
+"""
+BM25 inverted index for the KB chunks (written by build_kb_index.py, read by src/services/retrieve.ts).
+
+Behavior:
+  - tokenize() lowercases and splits on anything that is not an ASCII letter or digit, then
+    drops the STOPWORDS; retrieve.ts applies the same rule, with the stopword list taken from
+    the manifest so both sides always agree. No stemming: "RIR", "HRV" or "periodization"
+    match exactly as written
+  - build_bm25() maps every term to a posting list of (doc, term frequency); docs are the
+    chunks in manifest order (shard by shard, row by row), so doc d is row d - start of the
+    shard whose chunk range holds it. Bm25Builder does the same one shard at a time: add()
+    keeps only the shard's postings as compact arrays and finish() lays the shards out in
+    manifest order, which the streaming build only knows at the end
+  - write_bm25() stores the sorted vocabulary as bm25-terms.json (term id = position) and
+    int32 list offsets (vocab + 1), int32 doc ids, uint16 term frequencies, int32 doc lengths
+    and float32 IDF as little-endian sections of bm25.bin (4-byte aligned), and returns the
+    manifest descriptor with k1, b, the average doc length and the stopwords
+  - bm25_scores() is the reference scorer: Okapi BM25 with the Lucene IDF
+    ln(1 + (N - df + 0.5) / (df + 0.5)), which stays positive for common terms
+
+Requires numpy.
+"""
+
+from __future__ import annotations
+import json
+import re
+from pathlib import Path
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+K1 = 1.2
+B = 0.75
+STOPWORDS = (
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "has", "have", "in", "is",
+    "it", "its", "of", "on", "or", "that", "the", "this", "to", "was", "were", "which", "with",
+)
+TOKEN = re.compile(r"[a-z0-9]+")
+SECTIONS = (("offsets", "<i4"), ("docs", "<i4"), ("tfs", "<u2"), ("doc_len", "<i4"), ("idf", "<f4"))
+
+
+def tokenize(text: str, stopwords: Iterable[str] = STOPWORDS) -> List[str]:
+    stop = set(stopwords)
+    return [t for t in TOKEN.findall(text.lower()) if t not in stop]
+
+
+class Bm25Builder:
+    """build_bm25() in parts; the posting arrays are all that is kept of each part's texts."""
+
+    def __init__(self, k1: float = K1, b: float = B):
+        self.k1, self.b = k1, b
+        self.vocab: Dict[str, int] = {}
+        self.parts: List[Dict[str, np.ndarray]] = []
+
+    def add(self, texts: Iterable[str]) -> int:
+        """Tokenize the next part (e.g. one shard's chunks); returns its part number."""
+        terms: List[int] = []
+        docs: List[int] = []
+        tfs: List[int] = []
+        lengths: List[int] = []
+        for d, text in enumerate(texts):
+            tokens = tokenize(text)
+            lengths.append(len(tokens))
+            for t, n in Counter(tokens).items():
+                terms.append(self.vocab.setdefault(t, len(self.vocab)))
+                docs.append(d)
+                tfs.append(min(n, 65535))
+        self.parts.append({
+            "terms": np.array(terms, dtype=np.int32),
+            "docs": np.array(docs, dtype=np.int32),
+            "tfs": np.array(tfs, dtype=np.uint16),
+            "doc_len": np.array(lengths, dtype=np.int32),
+        })
+        return len(self.parts) - 1
+
+    def finish(self, order: Optional[Sequence[int]] = None) -> Dict:
+        """The build_bm25() index with the parts laid end to end in `order` (default: as added)."""
+        parts = [self.parts[p] for p in (range(len(self.parts)) if order is None else order)]
+        starts = np.cumsum([0] + [len(p["doc_len"]) for p in parts])
+        terms = sorted(self.vocab)
+        rank = np.zeros(len(terms), dtype=np.int32)
+        rank[[self.vocab[t] for t in terms]] = np.arange(len(terms), dtype=np.int32)
+        term = np.concatenate([np.zeros(0, np.int32)] + [rank[p["terms"]] for p in parts])
+        doc = np.concatenate([np.zeros(0, np.int32)] + [p["docs"] + s for p, s in zip(parts, starts)]).astype(np.int32)
+        tf = np.concatenate([np.zeros(0, np.uint16)] + [p["tfs"] for p in parts])
+        doc_len = np.concatenate([np.zeros(0, np.int32)] + [p["doc_len"] for p in parts])
+        by = np.lexsort((doc, term))
+        df = np.bincount(term, minlength=len(terms)).astype(np.float64)
+        n = len(doc_len)
+        return {
+            "terms": terms,
+            "offsets": np.concatenate([[0], np.cumsum(df)]).astype(np.int32),
+            "docs": doc[by],
+            "tfs": tf[by],
+            "doc_len": doc_len,
+            "idf": np.log1p((n - df + 0.5) / (df + 0.5)).astype(np.float32),
+            "avgdl": float(doc_len.mean()) if n else 0.0,
+            "k1": self.k1,
+            "b": self.b,
+        }
+
+
+def build_bm25(texts: Sequence[str], k1: float = K1, b: float = B) -> Dict:
+    """{"terms", "offsets", "docs", "tfs", "doc_len", "idf", "avgdl", "k1", "b"} for `texts`."""
+    builder = Bm25Builder(k1, b)
+    builder.add(texts)
+    return builder.finish()
+
+
+def bm25_scores(index: Dict, query: str, stopwords: Iterable[str] = STOPWORDS) -> np.ndarray:
+    """BM25 score of every doc for `query` (0 for docs sharing no term)."""
+    ids = {t: i for i, t in enumerate(index["terms"])}
+    k1, b = index["k1"], index["b"]
+    norm = k1 * (1 - b + b * index["doc_len"] / max(index["avgdl"], 1e-9))
+    scores = np.zeros(len(index["doc_len"]), dtype=np.float64)
+    for t in tokenize(query, stopwords):
+        if t not in ids:
+            continue
+        j = ids[t]
+        lo, hi = index["offsets"][j], index["offsets"][j + 1]
+        docs, tf = index["docs"][lo:hi], index["tfs"][lo:hi].astype(np.float64)
+        scores[docs] += index["idf"][j] * tf * (k1 + 1) / (tf + norm[docs])
+    return scores
+
+
+def top_docs(scores: np.ndarray, k: int, allowed: Optional[np.ndarray] = None) -> List[int]:
+    """Docs with a positive score, best first (ties by doc id); `allowed` is a boolean mask."""
+    hit = scores > 0 if allowed is None else (scores > 0) & allowed
+    docs = np.flatnonzero(hit)
+    return docs[np.argsort(-scores[docs], kind="stable")][:k].tolist()
+
+
+def write_bm25(out_dir: Path, index: Dict) -> Dict:
+    sections: Dict[str, Dict[str, int]] = {}
+    pos = 0
+    with (out_dir / "bm25.bin").open("wb") as f:
+        for name, kind in SECTIONS:
+            data = np.ascontiguousarray(index[name], dtype=kind).tobytes()
+            pad = -len(data) % 4
+            f.write(data + b"\0" * pad)
+            sections[name] = {"offset": pos, "bytes": len(data)}
+            pos += len(data) + pad
+    terms = json.dumps(index["terms"], separators=(",", ":"))
+    (out_dir / "bm25-terms.json").write_text(terms, encoding="utf-8")
+    return {
+        "file": "bm25.bin",
+        "terms": "bm25-terms.json",
+        "docs": int(len(index["doc_len"])),
+        "vocab": len(index["terms"]),
+        "postings": int(len(index["docs"])),
+        "avgdl": round(index["avgdl"], 4),
+        "k1": index["k1"],
+        "b": index["b"],
+        "tokenizer": "lowercase, [a-z0-9]+ runs, minus stopwords",
+        "stopwords": list(STOPWORDS),
+        "bytes": pos + len(terms.encode("utf-8")),
+        "sections": sections,
+    }
+
+
+def read_bm25(out_dir: Path, desc: Dict) -> Dict:
+    raw = (Path(out_dir) / desc["file"]).read_bytes()
+    out: Dict = {}
+    for name, kind in SECTIONS:
+        sec = desc["sections"][name]
+        out[name] = np.frombuffer(raw, dtype=kind, count=sec["bytes"] // np.dtype(kind).itemsize, offset=sec["offset"])
+    out["terms"] = json.loads((Path(out_dir) / desc["terms"]).read_text(encoding="utf-8"))
+    out.update(avgdl=desc["avgdl"], k1=desc["k1"], b=desc["b"])
+    return out
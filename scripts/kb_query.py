@@ -0,0 +1,293 @@
+"""
+Python reference engine for the KB index built by build_kb_index.py.
+
+Behavior:
+  - KBIndex loads manifest.json and the shards a query needs (v3 shards; v2 single matrix
+    and v1 inline embeddings load as one shard) into float32 NumPy matrices whose rows are
+    normalized once at load, so cosine is a dot product (rows of v3 indexes are stored unit
+    length already; quantized rows are only approximately unit); queries are cut to the
+    manifest's embedding_dim and renormalized, like fitQuery in retrieve.ts
+  - search() follows src/services/retrieve.ts: shards chosen by kind/licence, IVF shards
+    probed for their `nprobe` closest lists (unless exact=True), chunk filters, then
+    greedy MMR (lambda 0.5) over the candidates - with the candidate scores and the
+    running max-similarity-to-picked vector computed as matrix operations instead of
+    pairwise loops
+  - top_k() is plain cosine top-k without MMR (every stored row by default), the
+    reference ranking for scripts/bench_kb.py
+  - lexical() ranks chunks by BM25 from the manifest's "bm25" index (scripts/kb_lexical.py),
+    no embedding needed; search(..., text=...) is the hybrid mode: the top HYBRID_DEPTH
+    vector and BM25 candidates are pooled and scored HYBRID_ALPHA * cosine + (1 - HYBRID_ALPHA)
+    * BM25 / best BM25 score, which keeps relevance on the cosine scale MMR balances against
+
+Usage:
+  python scripts/kb_query.py --vector query.json [--index public/kb_index] [--top-k 6] [--kind note] [--exact]
+  python scripts/kb_query.py --text "RIR autoregulation" [--vector query.json]   # lexical, or hybrid with a vector
+  (query.json holds one embedding as a JSON array, e.g. from the embeddings API)
+
+Requires numpy.
+"""
+
+from __future__ import annotations
+import argparse
+import json
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from kb_ann import read_ivf, unit
+from kb_lexical import bm25_scores, read_bm25, top_docs
+from kb_vectors import read_matrix
+
+MMR_LAMBDA = 0.5
+# hybrid search: candidates taken from each ranking, and the weight of the cosine score
+HYBRID_DEPTH = 50
+HYBRID_ALPHA = 0.5
+
+
+class Shard:
+    """One loaded shard: chunk metadata, unit rows, optional IVF lists."""
+
+    def __init__(
+        self,
+        chunks: List[Dict],
+        matrix: np.ndarray,
+        ivf: Optional[Dict[str, np.ndarray]] = None,
+        nprobe: int = 0,
+        start: int = 0,
+    ):
+        self.chunks = chunks
+        self.matrix = unit(np.asarray(matrix, dtype=np.float32))
+        self.ivf = ivf
+        self.nprobe = nprobe
+        # BM25 doc id of row 0 (docs count chunks shard by shard in manifest order)
+        self.start = start
+        self.kinds = np.array([c.get("kind", "") for c in chunks])
+        self.licenses = np.array([(c.get("license") or "").lower() for c in chunks])
+
+    def allowed(self, rows: np.ndarray, kinds: List[str], licenses: List[str]) -> np.ndarray:
+        """Mask of `rows` passing the chunk filters (chunkFilter in retrieve.ts)."""
+        keep = np.ones(len(rows), dtype=bool)
+        if kinds:
+            keep &= np.isin(self.kinds[rows], kinds)
+        if licenses:
+            keep &= np.isin(self.licenses[rows], licenses)
+        return keep
+
+    def rows(self, q: np.ndarray, nprobe: Optional[int], exact: bool) -> np.ndarray:
+        if exact or self.ivf is None:
+            return np.arange(len(self.chunks))
+        ivf = self.ivf
+        lists = np.argsort(-(ivf["centroids"] @ q), kind="stable")[: nprobe or self.nprobe]
+        return np.concatenate([ivf["ids"][ivf["offsets"][j] : ivf["offsets"][j + 1]] for j in lists])
+
+
+def select_shards(manifest: Dict, kinds: Optional[Iterable[str]] = None, licenses: Optional[Iterable[str]] = None) -> List[Dict]:
+    """Same rule as selectShards in retrieve.ts."""
+    kinds = set(kinds or ())
+    lic = {x.lower() for x in licenses or ()}
+    return [
+        sh for sh in manifest.get("shards", [])
+        if (not kinds or sh["kind"] in kinds) and (not lic or any(x.lower() in lic for x in sh["licenses"]))
+    ]
+
+
+class KBIndex:
+    def __init__(self, out_dir: Path):
+        self.dir = Path(out_dir)
+        self.manifest = json.loads((self.dir / "manifest.json").read_text(encoding="utf-8"))
+        self.dim = self.manifest.get("embedding_dim")
+        self._shards: Dict[str, Shard] = {}
+        self._bm25: Optional[Dict] = None
+        self.starts: Dict[str, int] = {}
+        start = 0
+        for desc in self.manifest.get("shards", []):
+            self.starts[desc["id"]] = start
+            start += desc["chunks"]
+
+    def query_vector(self, query: Iterable[float]) -> np.ndarray:
+        """Unit query in the index's space (truncated to embedding_dim)."""
+        return unit(np.asarray(query, dtype=np.float32)[: self.dim])
+
+    def _load_shard(self, desc: Dict) -> Shard:
+        chunks = json.loads((self.dir / desc["file"]).read_text(encoding="utf-8"))
+        ivf = read_ivf(self.dir, desc["ivf"]) if desc.get("ivf") else None
+        matrix = read_matrix(self.dir, desc["embeddings"])
+        return Shard(chunks, matrix, ivf, desc.get("ivf", {}).get("nprobe", 0), self.starts[desc["id"]])
+
+    def _load_unsharded(self) -> Shard:
+        chunks: List[Dict] = []
+        for name in self.manifest["files"]:
+            chunks.extend(json.loads((self.dir / name).read_text(encoding="utf-8")))
+        if self.manifest.get("embeddings"):
+            matrix = read_matrix(self.dir, self.manifest["embeddings"])
+        else:
+            matrix = np.array([c.pop("embedding") for c in chunks], dtype=np.float32)
+        return Shard(chunks, matrix)
+
+    def shards(self, kinds: Optional[Iterable[str]] = None, licenses: Optional[Iterable[str]] = None) -> List[Shard]:
+        """Loaded shards for the filters; each shard is read from disk once."""
+        if "shards" not in self.manifest:
+            if "*" not in self._shards:
+                self._shards["*"] = self._load_unsharded()
+            return [self._shards["*"]]
+        out = []
+        for desc in select_shards(self.manifest, kinds, licenses):
+            if desc["id"] not in self._shards:
+                self._shards[desc["id"]] = self._load_shard(desc)
+            out.append(self._shards[desc["id"]])
+        return out
+
+    def bm25(self) -> Dict:
+        if "bm25" not in self.manifest:
+            raise RuntimeError(f"{self.dir / 'manifest.json'} has no bm25 index (built with --no-bm25 or before v3)")
+        if self._bm25 is None:
+            self._bm25 = read_bm25(self.dir, self.manifest["bm25"])
+        return self._bm25
+
+    def _lexical_hits(self, text: str, k: int, kinds: List[str], lic: List[str]) -> List[Tuple[Shard, int, float]]:
+        """Best `k` (shard, row, BM25 score) passing the filters."""
+        scores = bm25_scores(self.bm25(), text, self.manifest["bm25"]["stopwords"])
+        allowed = np.zeros(len(scores), dtype=bool)
+        shards = sorted(self.shards(kinds, lic), key=lambda sh: sh.start)
+        for shard in shards:
+            rows = np.arange(len(shard.chunks))
+            allowed[shard.start : shard.start + len(rows)] = shard.allowed(rows, kinds, lic)
+        starts = np.array([sh.start for sh in shards])
+        hits = []
+        for d in top_docs(scores, k, allowed):
+            shard = shards[int(np.searchsorted(starts, d, side="right")) - 1]
+            hits.append((shard, d - shard.start, float(scores[d])))
+        return hits
+
+    def lexical(
+        self,
+        text: str,
+        top_k: int = 6,
+        kinds: Optional[Iterable[str]] = None,
+        licenses: Optional[Iterable[str]] = None,
+    ) -> List[Dict]:
+        """Chunks ranked by BM25 ({..., "score"}), like search(..., { mode: 'lexical' }) in retrieve.ts."""
+        hits = self._lexical_hits(text, top_k, list(kinds or ()), [x.lower() for x in licenses or ()])
+        return [dict(shard.chunks[row], score=score) for shard, row, score in hits]
+
+    def search(
+        self,
+        query: Iterable[float],
+        top_k: int = 6,
+        kinds: Optional[Iterable[str]] = None,
+        licenses: Optional[Iterable[str]] = None,
+        nprobe: Optional[int] = None,
+        exact: bool = False,
+        lam: float = MMR_LAMBDA,
+        text: Optional[str] = None,
+    ) -> List[Dict]:
+        """Ranked chunks ({..., "score"}) like retrieve.ts `search`, for an already embedded query.
+
+        With `text` this is the hybrid mode: vector and BM25 candidates scored together; on an
+        index without bm25 it falls back to the vector ranking, like retrieve.ts.
+        """
+        kinds = list(kinds or ())
+        lic = [x.lower() for x in licenses or ()]
+        q = self.query_vector(query)
+        cands: List[Tuple[Shard, int]] = []
+        mats: List[np.ndarray] = []
+        for shard in self.shards(kinds, lic):
+            rows = shard.rows(q, nprobe, exact)
+            rows = rows[shard.allowed(rows, kinds, lic)]
+            cands.extend((shard, int(i)) for i in rows)
+            mats.append(shard.matrix[rows])
+        matrix = np.concatenate(mats) if mats else np.zeros((0, len(q)), dtype=np.float32)
+        relevance = None
+        if text is not None and "bm25" in self.manifest:
+            cands, relevance = self._fuse(text, q, matrix @ q, cands, kinds, lic)
+            matrix = np.array([shard.matrix[i] for shard, i in cands], dtype=np.float32).reshape(len(cands), -1)
+        if not cands:
+            return []
+        picked = mmr(matrix, q, top_k, lam, relevance)
+        results = [dict(cands[i][0].chunks[cands[i][1]], score=float(s)) for i, s in picked]
+        results.sort(key=lambda r: -r["score"])
+        return results
+
+    def _fuse(
+        self, text: str, q: np.ndarray, scores: np.ndarray, cands: List[Tuple[Shard, int]], kinds: List[str], lic: List[str]
+    ) -> Tuple[List[Tuple[Shard, int]], np.ndarray]:
+        """Pool of the top vector candidates (`scores`) and BM25 hits with their blended relevance."""
+        lexical: Dict[Tuple[Shard, int], float] = {}
+        hits = self._lexical_hits(text, HYBRID_DEPTH, kinds, lic)
+        for shard, row, score in hits:
+            lexical[(shard, row)] = score / hits[0][2]
+        pool = [cands[c] for c in np.argsort(-scores, kind="stable")[:HYBRID_DEPTH]]
+        seen = set(pool)
+        pool += [key for key in lexical if key not in seen]
+        cosine = np.array([shard.matrix[row] @ q for shard, row in pool], dtype=np.float32)
+        bm25 = np.array([lexical.get(key, 0.0) for key in pool], dtype=np.float32)
+        return pool, HYBRID_ALPHA * cosine + (1 - HYBRID_ALPHA) * bm25
+
+    def top_k(
+        self,
+        query: Iterable[float],
+        k: int = 10,
+        kinds: Optional[Iterable[str]] = None,
+        nprobe: Optional[int] = None,
+        exact: bool = True,
+    ) -> List[Dict]:
+        """Cosine top-k without MMR; every row of the matching shards unless exact=False (IVF probing)."""
+        kinds = list(kinds or ())
+        q = self.query_vector(query)
+        scored = []
+        for shard in self.shards(kinds):
+            rows = shard.rows(q, nprobe, exact)
+            if kinds:
+                rows = rows[np.isin(shard.kinds[rows], kinds)]
+            scores = shard.matrix[rows] @ q
+            for i in np.argsort(-scores, kind="stable")[:k]:
+                scored.append((float(scores[i]), shard.chunks[rows[i]]))
+        scored.sort(key=lambda t: -t[0])
+        return [dict(c, score=s) for s, c in scored[:k]]
+
+
+def mmr(matrix: np.ndarray, q: np.ndarray, k: int, lam: float = MMR_LAMBDA, relevance: Optional[np.ndarray] = None) -> List[tuple]:
+    """Greedy maximal marginal relevance over unit rows; [(row, relevance)] in pick order.
+
+    Relevance is the query cosine unless given (hybrid fused scores). Matches mmrSelect in
+    retrieve.ts: similarity to already picked rows starts at 0 and the first row wins ties.
+    """
+    scores = matrix @ q if relevance is None else relevance
+    max_sim = np.zeros(len(matrix), dtype=np.float32)
+    available = np.ones(len(matrix), dtype=bool)
+    picked = []
+    for _ in range(min(k, len(matrix))):
+        value = np.where(available, lam * scores - (1 - lam) * max_sim, -np.inf)
+        best = int(np.argmax(value))
+        picked.append((best, scores[best]))
+        available[best] = False
+        np.maximum(max_sim, matrix @ matrix[best], out=max_sim)
+    return picked
+
+
+def main(argv: Optional[List[str]] = None):
+    ap = argparse.ArgumentParser(description="Query a built KB index with a precomputed query embedding and/or text.")
+    ap.add_argument("--index", default="public/kb_index")
+    ap.add_argument("--vector", help="JSON file with the query embedding")
+    ap.add_argument("--text", help="query text: BM25 search, or hybrid search together with --vector")
+    ap.add_argument("--top-k", type=int, default=6)
+    ap.add_argument("--kind", action="append", help="restrict to a chunk kind (repeatable)")
+    ap.add_argument("--license", action="append", help="restrict to a licence (repeatable)")
+    ap.add_argument("--nprobe", type=int, help="override the manifest's per-shard nprobe")
+    ap.add_argument("--exact", action="store_true", help="scan every chunk instead of probing IVF lists")
+    args = ap.parse_args(argv)
+    if not args.vector and not args.text:
+        ap.error("--vector, --text or both are required")
+    index = KBIndex(Path(args.index))
+    if args.vector:
+        query = json.loads(Path(args.vector).read_text())
+        results = index.search(query, args.top_k, args.kind, args.license, args.nprobe, args.exact, text=args.text)
+    else:
+        results = index.lexical(args.text, args.top_k, args.kind, args.license)
+    for r in results:
+        print(f"{r['score']:.4f}  {r['id']}  {r.get('title', '')[:70]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""
+Binary embedding matrices for the KB index (written by build_kb_index.py, read by src/services/retrieve.ts).
+
+Behavior:
+  - write_matrix() stores all chunk vectors as one contiguous little-endian row-major
+    matrix: float32, float16, or int8 with one float32 scale per row
+    (value = int8 * scale, symmetric, scale = max|x| / 127)
+  - The returned descriptor goes into manifest.json ("embeddings"): file, dtype, shape
+    and the byte offset/length of every section. Sections start on 4-byte boundaries,
+    so the browser can view them with Float32Array/Uint16Array/Int8Array directly
+  - read_matrix() decodes a descriptor back to float32 (tests, quality reports)
+  - recall_at_k() compares exact top-k neighbours against the stored matrix, using a
+    sample of the index's own vectors as queries; the build records it in the manifest.
+    overlap_at_k() is the same measurement over row blocks visited once (one shard at a
+    time), so the build never holds more than a shard of either matrix
+
+Requires numpy.
+"""
+
+from __future__ import annotations
+from pathlib import Path
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+import numpy as np
+
+DTYPES = ("float32", "float16", "int8")
+# Little-endian NumPy type of the "vectors" section per dtype; int8 rows also get a "<f4" scale
+VECTOR_KINDS = {"float32": "<f4", "float16": "<f2", "int8": "i1"}
+
+
+def _align(n: int, to: int = 4) -> int:
+    return (n + to - 1) // to * to
+
+
+def encode(vectors: np.ndarray, dtype: str) -> Dict[str, np.ndarray]:
+    """Sections to write for `dtype`: {"vectors"} or {"vectors", "scales"}."""
+    if dtype == "float32":
+        return {"vectors": vectors.astype("<f4")}
+    if dtype == "float16":
+        return {"vectors": vectors.astype("<f2")}
+    if dtype == "int8":
+        scales = np.abs(vectors).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        q = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype("i1")
+        return {"vectors": q, "scales": scales.astype("<f4")}
+    raise ValueError(f"unknown embedding dtype {dtype!r} (expected one of {', '.join(DTYPES)})")
+
+
+def decode(sections: Dict[str, np.ndarray], dtype: str) -> np.ndarray:
+    vectors = sections["vectors"].astype(np.float32)
+    if dtype == "int8":
+        vectors *= sections["scales"][:, None]
+    return vectors
+
+
+def matrix_row_bytes(dim: int, dtype: str) -> int:
+    """Bytes one row of `dim` values takes in a matrix file (section padding aside)."""
+    return dim * np.dtype(VECTOR_KINDS[dtype]).itemsize + (4 if dtype == "int8" else 0)
+
+
+def write_matrix(path: Path, vectors: Sequence[Sequence[float]], dtype: str) -> Dict:
+    """Write the matrix file and return its manifest descriptor."""
+    matrix = np.asarray(vectors, dtype=np.float64)
+    if matrix.ndim != 2:
+        matrix = matrix.reshape(len(matrix), -1)
+    sections = encode(matrix, dtype)
+    offsets: Dict[str, Dict[str, int]] = {}
+    pos = 0
+    with path.open("wb") as f:
+        for name, arr in sections.items():
+            start = _align(pos)
+            f.write(b"\0" * (start - pos))
+            data = arr.tobytes()
+            f.write(data)
+            offsets[name] = {"offset": start, "bytes": len(data)}
+            pos = start + len(data)
+    return {
+        "file": path.name,
+        "dtype": dtype,
+        "shape": list(matrix.shape),
+        "byte_order": "little",
+        "sections": offsets,
+        "bytes": pos,
+    }
+
+
+def read_matrix(out_dir: Path, desc: Dict) -> np.ndarray:
+    """float32 (rows, dim) matrix for a manifest descriptor."""
+    raw = (Path(out_dir) / desc["file"]).read_bytes()
+    rows, dim = desc["shape"]
+    kinds = {"vectors": VECTOR_KINDS[desc["dtype"]], "scales": "<f4"}
+    sections = {}
+    for name, sec in desc["sections"].items():
+        arr = np.frombuffer(raw, dtype=kinds[name], count=sec["bytes"] // np.dtype(kinds[name]).itemsize, offset=sec["offset"])
+        sections[name] = arr.reshape(rows, dim) if name == "vectors" else arr
+    return decode(sections, desc["dtype"])
+
+
+def unit(x: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(x, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return x / norms
+
+
+def merge_top_k(best: Tuple[np.ndarray, np.ndarray], scores: np.ndarray, ids: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Running top-k per query: (scores, ids) of shape (q, <=k) merged with candidates (q, m)."""
+    s = np.concatenate([best[0], scores], axis=1)
+    i = np.concatenate([best[1], np.broadcast_to(ids, scores.shape)], axis=1)
+    if s.shape[1] > k:
+        top = np.argpartition(-s, k - 1, axis=1)[:, :k]
+        s, i = np.take_along_axis(s, top, axis=1), np.take_along_axis(i, top, axis=1)
+    return s, i
+
+
+def top_k_blocks(queries: np.ndarray, blocks: Iterable[np.ndarray], k: int, exclude: Sequence[int]) -> np.ndarray:
+    """Ids of the k rows with the highest dot product per query over `blocks` laid end to end,
+    skipping row exclude[q] for query q; (q, k) in no particular order."""
+    exclude = np.asarray(exclude)
+    qs = np.arange(len(queries))
+    best = (np.empty((len(queries), 0)), np.empty((len(queries), 0), dtype=np.int64))
+    start = 0
+    for block in blocks:
+        scores = queries @ block.T
+        own = (exclude >= start) & (exclude < start + len(block))
+        scores[qs[own], exclude[own] - start] = -np.inf
+        best = merge_top_k(best, scores, np.arange(start, start + len(block)), k)
+        start += len(block)
+    return best[1]
+
+
+def overlap_at_k(
+    qa: np.ndarray, exact: Iterable[np.ndarray], qb: np.ndarray, approx: Iterable[np.ndarray], picks: Sequence[int], k: int = 10
+) -> float:
+    """Mean top-k overlap between unit row blocks `exact` (queried by qa) and `approx` (by qb);
+    picks are the row ids the queries came from, excluded from their own results."""
+    a, b = top_k_blocks(qa, exact, k, picks), top_k_blocks(qb, approx, k, picks)
+    return float(np.mean([len(set(x.tolist()) & set(y.tolist())) / k for x, y in zip(a, b)]))
+
+
+def recall_at_k(exact: np.ndarray, approx: np.ndarray, k: int = 10, queries: int = 200, seed: int = 0) -> float:
+    """Mean overlap of cosine top-k (query excluded) between `exact` and `approx`.
+
+    Rows of `exact` are the queries; when `approx` has fewer dimensions (truncated vectors)
+    its own rows query it instead.
+    """
+    n = len(exact)
+    if n <= 1:
+        return 1.0
+    k = min(k, n - 1)
+    picks = np.random.default_rng(seed).choice(n, size=min(queries, n), replace=False)
+    a, b = unit(exact), unit(approx)
+    qa = a[picks]
+    qb = qa if a.shape[1] == b.shape[1] else b[picks]
+    return overlap_at_k(qa, [a], qb, [b], picks, k)
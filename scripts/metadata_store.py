@@ -0,0 +1,110 @@
+"""
+On-disk Europe PMC metadata store shared by fetch_papers.py, extract_notes.py and build_kb_index.py.
+
+Behavior:
+  - Keeps the full Europe PMC core record per PMID in SQLite (.cache/metadata.sqlite by
+    default) together with the time it was fetched
+  - resolve() answers from the store while a record is younger than the TTL and only
+    sends the missing or expired PMIDs to Europe PMC (batched, scripts/epmc.py); PMIDs
+    Europe PMC does not know are remembered too, so they are not asked for again
+  - With offline=True the network is never touched: expired records are still served
+    and unknown PMIDs are simply absent
+
+Environment:
+  - APTUM_METADATA_DB overrides the database path
+  - METADATA_TTL_DAYS sets the TTL (default 7; 0 always refetches)
+"""
+
+from __future__ import annotations
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+from epmc import epmc_core_bulk
+from http_client import HttpClient
+
+STORE_PATH = os.environ.get("APTUM_METADATA_DB", ".cache/metadata.sqlite")
+DEFAULT_TTL = float(os.environ.get("METADATA_TTL_DAYS", "7")) * 86400
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS records (
+    pmid TEXT PRIMARY KEY,
+    record TEXT,
+    fetched_at REAL NOT NULL
+)
+"""
+
+
+class MetadataStore:
+    """PMID -> Europe PMC core record (NULL record: Europe PMC had no match)."""
+
+    def __init__(self, path: str = STORE_PATH, ttl: float = DEFAULT_TTL):
+        self.path = path
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(SCHEMA)
+        self._db.commit()
+        self._lock = threading.Lock()
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+    def get_many(self, pmids: Iterable[str], include_expired: bool = False) -> Dict[str, Optional[dict]]:
+        """Stored entries still within the TTL (or all of them); a None value is a known miss."""
+        wanted = list(dict.fromkeys(str(p) for p in pmids))
+        cutoff = 0.0 if include_expired else time.time() - self.ttl
+        out: Dict[str, Optional[dict]] = {}
+        with self._lock:
+            # stay well below SQLite's bound-parameter limit
+            for start in range(0, len(wanted), 500):
+                batch = wanted[start : start + 500]
+                marks = ",".join("?" * len(batch))
+                rows = self._db.execute(
+                    f"SELECT pmid, record FROM records WHERE fetched_at >= ? AND pmid IN ({marks})",
+                    [cutoff, *batch],
+                ).fetchall()
+                for pmid, record in rows:
+                    out[pmid] = json.loads(record) if record else None
+        return out
+
+    def put_many(self, records: Dict[str, dict], missing: Iterable[str] = ()) -> None:
+        now = time.time()
+        rows = [(pmid, json.dumps(rec, ensure_ascii=False), now) for pmid, rec in records.items()]
+        rows += [(pmid, None, now) for pmid in missing]
+        with self._lock:
+            self._db.executemany("INSERT OR REPLACE INTO records (pmid, record, fetched_at) VALUES (?, ?, ?)", rows)
+            self._db.commit()
+
+    def resolve(
+        self,
+        pmids: Iterable[str],
+        client: Optional[HttpClient] = None,
+        offline: bool = False,
+        stats: Optional[List[Dict]] = None,
+    ) -> Dict[str, dict]:
+        """{pmid: core record} like epmc_core_bulk, fetching only missing or expired PMIDs.
+
+        `stats` receives epmc_core_bulk's per-batch entries for the PMIDs that went
+        to the network.
+        """
+        wanted = list(dict.fromkeys(str(p) for p in pmids))
+        known = self.get_many(wanted, include_expired=offline)
+        todo = [p for p in wanted if p not in known]
+        self.hits += len(wanted) - len(todo)
+        self.misses += len(todo)
+        if todo and not offline:
+            fetched = epmc_core_bulk(todo, client=client, stats=stats)
+            self.put_many(fetched, [p for p in todo if p not in fetched])
+            known.update(fetched)
+        return {p: rec for p, rec in known.items() if rec}
+
+    def summary(self) -> str:
+        return f"{self.hits} hits, {self.misses} misses ({self.path})"
@@ -0,0 +1,141 @@
+"""
+Structured run metrics for the paper archive scripts.
+
+RunMetrics collects per-paper records (keyed by PMID or registry id) and per-phase wall-clock timings from worker
+threads and writes them as one machine-readable JSON report (fetch_papers.py writes
+docs/papers/METRICS.json next to AUDIT.json). Sharded runs embed their report in the
+shard file and `fetch_papers.py --merge` combines them with merge_reports().
+
+Report layout:
+  {
+    "generatedAt": <epoch>, "wall_seconds": 12.3,
+    "phases": {"metadata": 0.8, "download": 10.1, "markdown": 1.2, "outputs": 0.1},
+    "summary": {"papers": 59, "outcomes": {"downloaded": 30, ...}, "bytes": ..., "retries": ...,
+                "download_seconds": {"p50": .., "p95": .., "max": ..}},
+    "papers": [
+      {"pmid": "...", "outcome": "downloaded",
+       "metadata": {"batch": 0, "batch_size": 59, "batch_seconds": 0.8, "found": true},
+       "download": {"attempts": [{"url", "host", "via", "status", "bytes", "retries", "seconds", "error"}],
+                    "mirror": "pmc.ncbi.nlm.nih.gov", "bytes": 123, "retries": 0, "seconds": 0.4},
+       "extract": {"outcome": "extracted", "pages": 12, "seconds": 3.1}}
+    ]
+  }
+"""
+
+from __future__ import annotations
+import json
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {"p50": 0.0, "p95": 0.0, "max": 0.0}
+    vs = sorted(values)
+
+    def pick(q: float) -> float:
+        return vs[min(len(vs) - 1, int(round(q * (len(vs) - 1))))]
+
+    return {"p50": round(pick(0.5), 4), "p95": round(pick(0.95), 4), "max": round(vs[-1], 4)}
+
+
+def summarize(papers: List[Dict]) -> Dict:
+    outcomes: Dict[str, int] = {}
+    for p in papers:
+        key = p.get("outcome") or "unknown"
+        outcomes[key] = outcomes.get(key, 0) + 1
+    return {
+        "papers": len(papers),
+        "outcomes": outcomes,
+        "bytes": sum(p["download"]["bytes"] for p in papers),
+        "retries": sum(p["download"]["retries"] for p in papers),
+        "download_seconds": percentiles([p["download"]["seconds"] for p in papers if p["download"]["attempts"]]),
+    }
+
+
+class RunMetrics:
+    def __init__(self):
+        self.started = time.time()
+        self.phases: Dict[str, float] = {}
+        self.papers: Dict[str, Dict] = {}
+        self.lock = threading.Lock()
+
+    def _paper(self, pmid: str) -> Dict:
+        rec = self.papers.get(pmid)
+        if rec is None:
+            rec = self.papers[pmid] = {
+                "pmid": pmid,
+                "outcome": None,
+                "metadata": {},
+                "download": {"attempts": [], "mirror": None, "bytes": 0, "retries": 0, "seconds": 0.0},
+                "extract": {},
+            }
+        return rec
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        t0 = time.monotonic()
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.phases[name] = round(self.phases.get(name, 0.0) + time.monotonic() - t0, 4)
+
+    def set(self, pmid: str, section: str = "", **values) -> None:
+        """Set top-level fields (section="") or fields of one section of a PMID's record."""
+        with self.lock:
+            rec = self._paper(pmid)
+            (rec[section] if section else rec).update(values)
+
+    def attempt(self, pmid: str, **attempt) -> None:
+        """Record one download attempt (a mirror, the fallback URL or a revalidation)."""
+        with self.lock:
+            dl = self._paper(pmid)["download"]
+            dl["attempts"].append(attempt)
+            dl["bytes"] += attempt.get("bytes") or 0
+            dl["retries"] += attempt.get("retries") or 0
+            dl["seconds"] = round(dl["seconds"] + (attempt.get("seconds") or 0.0), 4)
+
+    def report(self, order: Iterable[str]) -> Dict:
+        with self.lock:
+            papers = [self._paper(p) for p in order]
+            phases = dict(self.phases)
+        return {
+            "generatedAt": time.time(),
+            "wall_seconds": round(time.time() - self.started, 4),
+            "phases": phases,
+            "summary": summarize(papers),
+            "papers": papers,
+        }
+
+    def write(self, path: str, order: Iterable[str]) -> Dict:
+        rep = self.report(order)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(rep, f, indent=2)
+        return rep
+
+
+def merge_reports(reports: List[Dict], order: Iterable[str]) -> Dict:
+    """Combine the reports of shards that ran in parallel into one report.
+
+    Phase and wall times are the slowest shard's (the critical path); the summary is
+    recomputed over the merged per-paper records, listed in `order`.
+    """
+    by_id: Dict[str, Dict] = {}
+    phases: Dict[str, float] = {}
+    for rep in reports:
+        for name, secs in (rep.get("phases") or {}).items():
+            phases[name] = max(phases.get(name, 0.0), secs)
+        for p in rep.get("papers", []):
+            by_id[p["pmid"]] = p
+    papers = [by_id[p] for p in order if p in by_id]
+    return {
+        "generatedAt": time.time(),
+        "wall_seconds": max((r.get("wall_seconds", 0.0) for r in reports), default=0.0),
+        "shards": len(reports),
+        "phases": phases,
+        "summary": summarize(papers),
+        "papers": papers,
+    }
@@ -0,0 +1,103 @@
+"""
+OpenAI Batch API helpers: JSONL request files, submission, polling and result download.
+
+Behavior:
+  - request_line() formats one request in the batch input format
+    ({"custom_id", "method", "url", "body"})
+  - submit() uploads the JSONL file (purpose "batch") and creates a batch job for it
+  - wait() polls the job until it reaches a final status or the timeout passes
+  - results() downloads the output (and error) files and returns {custom_id: result line}
+  - Everything goes through the shared HttpClient, so retries/backoff apply
+
+Environment:
+  - OPENAI_BASE_URL overrides https://api.openai.com/v1 (used by tests and local stubs)
+"""
+
+from __future__ import annotations
+import json
+import os
+import time
+import uuid
+from typing import Dict, Iterable, Optional
+
+from http_client import HttpClient
+
+FINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+
+def base_url() -> str:
+    return os.environ.get("OPENAI_BASE_URL", "https://api.openai.com/v1").rstrip("/")
+
+
+def auth_headers() -> Dict[str, str]:
+    return {"Authorization": f"Bearer {os.environ.get('OPENAI_API_KEY', '')}"}
+
+
+def request_line(custom_id: str, endpoint: str, body: Dict) -> str:
+    return json.dumps({"custom_id": custom_id, "method": "POST", "url": endpoint, "body": body}, ensure_ascii=False)
+
+
+def write_requests(path: str, lines: Iterable[str]) -> int:
+    n = 0
+    with open(path, "w", encoding="utf-8") as f:
+        for line in lines:
+            f.write(line + "\n")
+            n += 1
+    return n
+
+
+def upload(client: HttpClient, path: str) -> str:
+    """Upload a JSONL file with purpose "batch"; returns the file id."""
+    boundary = uuid.uuid4().hex
+    with open(path, "rb") as f:
+        content = f.read()
+    body = (
+        f"--{boundary}\r\nContent-Disposition: form-data; name=\"purpose\"\r\n\r\nbatch\r\n"
+        f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"{os.path.basename(path)}\"\r\n"
+        "Content-Type: application/jsonl\r\n\r\n"
+    ).encode() + content + f"\r\n--{boundary}--\r\n".encode()
+    headers = {**auth_headers(), "Content-Type": f"multipart/form-data; boundary={boundary}", "Accept": "application/json"}
+    with client.request("POST", f"{base_url()}/files", headers=headers, body=body) as r:
+        return r.json()["id"]
+
+
+def submit(client: HttpClient, path: str, endpoint: str, metadata: Optional[Dict[str, str]] = None) -> Dict:
+    """Upload `path` and create a batch over it; returns the batch object."""
+    file_id = upload(client, path)
+    payload = {"input_file_id": file_id, "endpoint": endpoint, "completion_window": "24h"}
+    if metadata:
+        payload["metadata"] = metadata
+    return client.post_json(f"{base_url()}/batches", payload, headers=auth_headers())
+
+
+def status(client: HttpClient, batch_id: str) -> Dict:
+    return client.get_json(f"{base_url()}/batches/{batch_id}", headers=auth_headers())
+
+
+def wait(client: HttpClient, batch_id: str, poll: float = 30, timeout: float = 3600) -> Dict:
+    """Poll until the batch is completed/failed/expired/cancelled or `timeout` seconds pass."""
+    deadline = time.monotonic() + timeout
+    while True:
+        batch = status(client, batch_id)
+        if batch.get("status") in FINAL_STATUSES or time.monotonic() + poll > deadline:
+            return batch
+        counts = batch.get("request_counts") or {}
+        print(f"batch {batch_id}: {batch.get('status')} ({counts.get('completed', 0)}/{counts.get('total', '?')} done)")
+        time.sleep(poll)
+
+
+def download_lines(client: HttpClient, file_id: str) -> Iterable[Dict]:
+    with client.request("GET", f"{base_url()}/files/{file_id}/content", headers=auth_headers()) as r:
+        for line in r.read().decode("utf-8").splitlines():
+            if line.strip():
+                yield json.loads(line)
+
+
+def results(client: HttpClient, batch: Dict) -> Dict[str, Dict]:
+    """{custom_id: {"response": {"status_code", "body"}, "error"}} from the output and error files."""
+    out: Dict[str, Dict] = {}
+    for key in ("output_file_id", "error_file_id"):
+        if batch.get(key):
+            for item in download_lines(client, batch[key]):
+                out[item["custom_id"]] = item
+    return out
@@ -0,0 +1,110 @@
+"""Embedding cache: only misses reach the API, and an interrupted build resumes."""
+
+from __future__ import annotations
+import os
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import build_kb_index  # noqa: E402
+from embedding_cache import EmbeddingCache, embedding_key  # noqa: E402
+
+
+class FakeEmbeddings:
+    """openai_embed_batch stand-in; raises on call number `fail_on`."""
+
+    def __init__(self, fail_on=None):
+        self.calls = []
+        self.fail_on = fail_on
+
+    def __call__(self, texts, model=build_kb_index.EMBED_MODEL, limiter=None, dimensions=None):
+        self.calls.append(list(texts))
+        self.dimensions = dimensions
+        if len(self.calls) == self.fail_on:
+            raise RuntimeError("connection reset")
+        return [[float(len(t)), 0.1 * len(t), -1.0 / 3] for t in texts]
+
+
+class EmbeddingCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db = os.path.join(self.tmp.name, "emb.sqlite")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_key_covers_model_and_dim(self):
+        k = embedding_key("text", "m", 1536)
+        self.assertNotEqual(k, embedding_key("text", "m", 512))
+        self.assertNotEqual(k, embedding_key("text", "m2", 1536))
+        self.assertNotEqual(k, embedding_key("text ", "m", 1536))
+
+    def test_vectors_round_trip_exactly(self):
+        cache = EmbeddingCache(self.db)
+        cache.put_many({"a": [0.1, -1.0 / 3, 1e-12]})
+        self.assertEqual(cache.get_many(["a", "b"]), {"a": [0.1, -1.0 / 3, 1e-12]})
+        cache.close()
+
+    def test_interrupted_build_resumes_and_rebuild_only_embeds_new_text(self):
+        texts = [f"chunk {n}" * (n + 1) for n in range(10)]
+        fake = FakeEmbeddings(fail_on=3)
+        cache = EmbeddingCache(self.db)
+        with mock.patch.object(build_kb_index, "openai_embed_batch", fake):
+            with self.assertRaises(RuntimeError):
+                build_kb_index.embed_texts(texts, cache, max_inputs=3, workers=1)
+        cache.close()
+
+        # every batch but the failed third one was saved
+        cache = EmbeddingCache(self.db)
+        fake = FakeEmbeddings()
+        with mock.patch.object(build_kb_index, "openai_embed_batch", fake):
+            vectors, stats = build_kb_index.embed_texts(texts, cache, max_inputs=3, workers=1)
+        self.assertEqual(fake.calls, [texts[6:9]])
+        self.assertEqual(stats["requests"], 1)
+        self.assertEqual((cache.hits, cache.misses), (7, 3))
+        self.assertEqual(vectors, FakeEmbeddings()(texts))
+
+        fake = FakeEmbeddings()
+        with mock.patch.object(build_kb_index, "openai_embed_batch", fake):
+            _, stats = build_kb_index.embed_texts(texts + ["new paper", "new paper"], cache, max_inputs=3)
+        self.assertEqual(fake.calls, [["new paper"]])
+        self.assertEqual(stats["requests"], 1)
+
+        # API-reduced vectors are cached apart from the full ones
+        fake = FakeEmbeddings()
+        with mock.patch.object(build_kb_index, "openai_embed_batch", fake):
+            build_kb_index.embed_texts(texts[:2], cache, dimensions=256)
+        self.assertEqual((fake.calls, fake.dimensions), ([texts[:2]], 256))
+        cache.close()
+
+    def test_stream_embeds_one_window_at_a_time(self):
+        texts = [f"chunk {n} " + "w" * 36 for n in range(10)]  # 12 estimated tokens each
+        fake = FakeEmbeddings()
+        cache = EmbeddingCache(self.db)
+        seen = []
+
+        def source():
+            for t in texts:
+                seen.append(t)
+                yield {"id": t, "text": t}
+
+        stats = {}
+        with mock.patch.object(build_kb_index, "openai_embed_batch", fake):
+            stream = build_kb_index.embed_stream(source(), cache, stats, window_tokens=40, workers=1)
+            first = next(stream)
+            self.assertEqual(len(seen), 4)  # only the first window was pulled
+            pairs = [first] + list(stream)
+        cache.close()
+        self.assertEqual([e["id"] for e, _ in pairs], texts)
+        self.assertEqual([v for _, v in pairs], FakeEmbeddings()(texts))
+        self.assertEqual(fake.calls, [texts[0:4], texts[4:8], texts[8:10]])
+        self.assertEqual(stats["requests"], 3)
+        self.assertIn("peak", stats["concurrency"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,94 @@
+"""Bulk Europe PMC resolver against a local stub serving canned resultList pages."""
+
+from __future__ import annotations
+import json
+import os
+import sys
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from epmc import build_query, epmc_core_bulk  # noqa: E402
+from http_client import HttpClient  # noqa: E402
+
+# query -> {cursorMark: (results, nextCursorMark)}
+PAGES = {
+    build_query(["111", "222"]): {
+        "*": ([{"pmid": "111", "title": "One"}], "AoE1"),
+        "AoE1": ([{"pmid": "222", "title": "Two"}], "AoE2"),
+        "AoE2": ([], "AoE2"),
+    },
+    build_query(["333"]): {
+        "*": ([{"pmid": "333", "title": "Three"}, {"pmid": "999", "title": "Unrequested"}], "*"),
+    },
+}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    calls: list = []
+
+    def do_GET(self):
+        qs = parse_qs(urlparse(self.path).query)
+        query = qs["query"][0]
+        cursor = qs["cursorMark"][0]
+        StubHandler.calls.append((query, cursor, qs["pageSize"][0]))
+        results, nxt = PAGES[query][cursor]
+        body = json.dumps({"nextCursorMark": nxt, "resultList": {"result": results}}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class EpmcBulkTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.prev_url = os.environ.get("EPMC_SEARCH_URL")
+        os.environ["EPMC_SEARCH_URL"] = f"http://127.0.0.1:{cls.server.server_port}/search"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        if cls.prev_url is None:
+            os.environ.pop("EPMC_SEARCH_URL", None)
+        else:
+            os.environ["EPMC_SEARCH_URL"] = cls.prev_url
+
+    def setUp(self):
+        StubHandler.calls = []
+
+    def test_batches_and_follows_cursor(self):
+        out = epmc_core_bulk(["111", "222", "333", "111"], batch_size=2, page_size=50)
+        self.assertEqual(sorted(out), ["111", "222", "333"])
+        self.assertEqual(out["222"]["title"], "Two")
+        # two pages + terminating empty page for the first batch, one page for the second
+        self.assertEqual([c[1] for c in StubHandler.calls], ["*", "AoE1", "AoE2", "*"])
+        self.assertTrue(all(c[2] == "50" for c in StubHandler.calls))
+
+    def test_uses_callers_client(self):
+        class RecordingLimiter:
+            def __init__(self):
+                self.seen = []
+
+            def wait(self, url):
+                self.seen.append(url)
+
+        limiter = RecordingLimiter()
+        epmc_core_bulk(["333"], client=HttpClient(rate_limiter=limiter))
+        self.assertEqual(len(limiter.seen), 1)
+        self.assertIn("/search?", limiter.seen[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,105 @@
+"""Hedged mirror racing in fetch_papers.fetch_first_pdf, with fetch_pdf faked per URL."""
+
+from __future__ import annotations
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from pathlib import Path
+from unittest import mock
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import fetch_papers  # noqa: E402
+from fetch_papers import FetchCache, fetch_first_pdf, mirror_key  # noqa: E402
+from metrics import RunMetrics  # noqa: E402
+
+SLOW, FAST, BROKEN = "https://slow/PMC1/pdf", "https://fast/PMC1/pdf", "https://broken/PMC1/pdf"
+
+
+class FakeMirrors:
+    """fetch_pdf stand-in: SLOW takes 2 s (or until cancelled), FAST 0.05 s, BROKEN fails at once."""
+
+    def __init__(self):
+        self.calls = []
+        self.cancelled = []
+        self.lock = threading.Lock()
+
+    def __call__(self, pmid, url, dest, via, headers=None, cancel=None, timeout=None):
+        with self.lock:
+            self.calls.append((url, via))
+        if url == BROKEN:
+            return None, "text/html", {"error": "not a pdf"}
+        deadline = time.monotonic() + (2.0 if url == SLOW else 0.05)
+        while time.monotonic() < deadline:
+            if cancel is not None and cancel.is_set():
+                with self.lock:
+                    self.cancelled.append(url)
+                return None, "", {"error": "cancelled"}
+            time.sleep(0.01)
+        return dest + ".part", "application/pdf", {"sha256": "x", "bytes": 1}
+
+
+class HedgeTest(unittest.TestCase):
+    def test_slow_mirror_is_hedged_and_cancelled(self):
+        fake = FakeMirrors()
+        with mock.patch.object(fetch_papers, "fetch_pdf", fake):
+            t0 = time.monotonic()
+            part, _, _, won = fetch_first_pdf("1", [SLOW, FAST], "out.pdf", hedge_after=0.1)
+            elapsed = time.monotonic() - t0
+        self.assertEqual(won, FAST)
+        self.assertEqual(part, "out.pdf.m1.part")
+        self.assertLess(elapsed, 1.0)
+        self.assertEqual(fake.calls, [(SLOW, "mirror"), (FAST, "hedge")])
+        time.sleep(0.1)
+        self.assertEqual(fake.cancelled, [SLOW])
+
+    def test_winner_returns_at_once_and_late_losers_are_cleaned_up(self):
+        timeouts = []
+
+        def fetch(url, dest, headers=None, cancel=None, timeout=None):
+            # both finish: the slow one ignores the cancel flag and writes its file anyway
+            timeouts.append(timeout)
+            time.sleep(0.5 if url == SLOW else 0.05)
+            Path(dest + ".part").write_bytes(b"%PDF-1.7")
+            return dest + ".part", "application/pdf", {"sha256": "x", "bytes": 8}
+
+        metrics = RunMetrics()
+        with tempfile.TemporaryDirectory() as d, mock.patch.object(fetch_papers, "http_fetch", fetch), \
+                mock.patch.object(fetch_papers, "METRICS", metrics):
+            dest = os.path.join(d, "out.pdf")
+            t0 = time.monotonic()
+            part, _, _, won = fetch_first_pdf("1", [SLOW, FAST], dest, hedge_after=0.1)
+            self.assertLess(time.monotonic() - t0, 0.4)
+            self.assertEqual((won, part), (FAST, dest + ".m1.part"))
+            time.sleep(0.6)  # the loser returns late and its file is removed then
+            self.assertEqual(os.listdir(d), ["out.pdf.m1.part"])
+        self.assertEqual(timeouts, [fetch_papers.HEDGE_TIMEOUT] * 2)
+        # the loser finished too, but only the winner is recorded
+        self.assertEqual(metrics.report(["1"])["papers"][0]["download"]["mirror"], "fast")
+
+    def test_failure_starts_next_candidate_immediately(self):
+        fake = FakeMirrors()
+        with mock.patch.object(fetch_papers, "fetch_pdf", fake):
+            _, _, _, won = fetch_first_pdf("1", [BROKEN, FAST], "out.pdf", hedge_after=5)
+        self.assertEqual(won, FAST)
+        self.assertEqual(fake.calls, [(BROKEN, "mirror"), (FAST, "mirror")])
+
+    def test_sequential_when_disabled(self):
+        fake = FakeMirrors()
+        with mock.patch.object(fetch_papers, "fetch_pdf", fake):
+            _, _, _, won = fetch_first_pdf("1", [BROKEN, FAST], "out.pdf", hedge_after=0)
+        self.assertEqual(won, FAST)
+
+    def test_winning_mirror_is_preferred(self):
+        cache = FetchCache(path="/nonexistent/cache.json")
+        cands = ["https://a/articles/PMC9/pdf", "https://b/articles/PMC9/pdf", "https://c/articles/PMC9?x"]
+        cache.record_win(mirror_key("https://b/articles/PMC1/pdf", "PMC1"))
+        self.assertEqual(cache.rank_mirrors(cands, "PMC9"), [cands[1], cands[0], cands[2]])
+        self.assertEqual(cache.rank_mirrors(cands, "PMC9", preferred=cands[2])[0], cands[2])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,77 @@
+"""Redirect handling of the shared HttpClient against two local stub hosts."""
+
+from __future__ import annotations
+import sys
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from http_client import HttpClient  # noqa: E402
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    seen = []
+    other = ""
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        StubHandler.seen.append((self.server.server_port, self.path, self.headers.get("Authorization"), self.headers.get("Cookie")))
+        if self.path == "/same":
+            return self.reply(302, {"Location": "/final"})
+        if self.path == "/away":
+            return self.reply(302, {"Location": f"{StubHandler.other}/final"})
+        self.reply(200)
+
+    def reply(self, status, headers=None):
+        self.send_response(status)
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"ok")
+
+
+class RedirectTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.servers = [ThreadingHTTPServer(("127.0.0.1", 0), StubHandler) for _ in range(2)]
+        for s in cls.servers:
+            threading.Thread(target=s.serve_forever, daemon=True).start()
+        cls.base = f"http://127.0.0.1:{cls.servers[0].server_port}"
+        StubHandler.other = f"http://127.0.0.1:{cls.servers[1].server_port}"
+
+    @classmethod
+    def tearDownClass(cls):
+        for s in cls.servers:
+            s.shutdown()
+            s.server_close()
+
+    def setUp(self):
+        StubHandler.seen = []
+        self.client = HttpClient()
+        self.headers = {"Authorization": "Bearer secret", "Cookie": "session=1", "Accept": "*/*"}
+
+    def tearDown(self):
+        self.client.close()
+
+    def test_same_host_redirect_keeps_credentials(self):
+        with self.client.request("GET", f"{self.base}/same", headers=self.headers) as r:
+            self.assertEqual(r.read(), b"ok")
+        self.assertEqual([s[1:] for s in StubHandler.seen], [("/same", "Bearer secret", "session=1"), ("/final", "Bearer secret", "session=1")])
+
+    def test_cross_host_redirect_drops_credentials(self):
+        with self.client.request("GET", f"{self.base}/away", headers=self.headers) as r:
+            self.assertEqual(r.read(), b"ok")
+        first, final = StubHandler.seen
+        self.assertEqual(first[2:], ("Bearer secret", "session=1"))
+        self.assertEqual(final, (self.servers[1].server_port, "/final", None, None))
+
+
+if __name__ == "__main__":
+    unittest.main()
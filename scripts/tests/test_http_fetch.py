@@ -0,0 +1,122 @@
+"""fetch_papers.http_fetch: the shared client owns connection retries; broken bodies are resumed, also across runs."""
+
+from __future__ import annotations
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+from unittest import mock
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import fetch_papers  # noqa: E402
+
+
+class FakeResponse:
+    def __init__(self, blocks, fail_after=None, status=200):
+        self.status = status
+        self.blocks = blocks
+        self.fail_after = fail_after
+        self.headers = {"Content-Type": "application/pdf", "ETag": '"v1"',
+                        "Content-Length": str(sum(len(b) for b in blocks))}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def iter_content(self, size):
+        for i, block in enumerate(self.blocks):
+            if i == self.fail_after:
+                raise ConnectionResetError("connection reset mid-body")
+            yield block
+
+
+class HttpFetchTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dest = os.path.join(self.tmp.name, "1.pdf")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_dead_host_is_not_retried_on_top_of_the_client(self):
+        request = mock.Mock(side_effect=ConnectionRefusedError("refused"))
+        with mock.patch.object(fetch_papers.CLIENT, "request", request):
+            part, _, info = fetch_papers.http_fetch("https://dead.example/1.pdf", self.dest, retries=3)
+        self.assertIsNone(part)
+        self.assertEqual(request.call_count, 1)
+        self.assertIn("refused", info["error"])
+
+    def test_broken_body_is_resumed_with_range(self):
+        blocks = [b"%PDF-1.7 ", b"rest of the file"]
+        responses = [FakeResponse(blocks, fail_after=1), FakeResponse(blocks[1:], status=206)]
+        request = mock.Mock(side_effect=responses)
+        with mock.patch.object(fetch_papers.CLIENT, "request", request), \
+                mock.patch.object(fetch_papers.CLIENT, "backoff_delay", return_value=0):
+            part, _, info = fetch_papers.http_fetch("https://ok.example/1.pdf", self.dest, retries=3)
+        self.assertEqual(Path(part).read_bytes(), b"".join(blocks))
+        self.assertEqual(info["resumed_at"], len(blocks[0]))
+        self.assertEqual(request.call_args.kwargs["headers"]["Range"], f"bytes={len(blocks[0])}-")
+
+    def test_interrupted_download_is_resumed_by_the_next_run(self):
+        blocks = [b"%PDF-1.7 ", b"rest of the file"]
+        request = mock.Mock(side_effect=[FakeResponse(blocks, fail_after=1)] + [ConnectionResetError("gone")] * 2)
+        with mock.patch.object(fetch_papers.CLIENT, "request", request), \
+                mock.patch.object(fetch_papers.CLIENT, "backoff_delay", return_value=0):
+            part, _, info = fetch_papers.http_fetch("https://ok.example/1.pdf", self.dest, retries=3)
+        self.assertIsNone(part)
+        self.assertEqual(Path(self.dest + ".part").read_bytes(), blocks[0])
+        self.assertEqual(json.loads(Path(self.dest + ".part.json").read_text())["validator"], '"v1"')
+
+        request = mock.Mock(return_value=FakeResponse(blocks[1:], status=206))
+        with mock.patch.object(fetch_papers.CLIENT, "request", request):
+            part, _, info = fetch_papers.http_fetch("https://ok.example/1.pdf", self.dest, retries=3)
+        headers = request.call_args.kwargs["headers"]
+        self.assertEqual((headers["Range"], headers["If-Range"]), (f"bytes={len(blocks[0])}-", '"v1"'))
+        self.assertEqual(Path(part).read_bytes(), b"".join(blocks))
+        self.assertEqual(info["sha256"], hashlib.sha256(b"".join(blocks)).hexdigest())
+        self.assertFalse(os.path.exists(self.dest + ".part.json"))
+
+    def test_changed_file_is_downloaded_again(self):
+        Path(self.dest + ".part").write_bytes(b"%PDF-1.6 stale")
+        Path(self.dest + ".part.json").write_text(json.dumps({"url": "https://ok.example/1.pdf", "validator": '"v0"'}))
+        blocks = [b"%PDF-1.7 ", b"new file"]
+        request = mock.Mock(return_value=FakeResponse(blocks))  # If-Range did not match: 200
+        with mock.patch.object(fetch_papers.CLIENT, "request", request):
+            part, _, info = fetch_papers.http_fetch("https://ok.example/1.pdf", self.dest, retries=3)
+        self.assertEqual(request.call_args.kwargs["headers"]["If-Range"], '"v0"')
+        self.assertEqual(Path(part).read_bytes(), b"".join(blocks))
+        self.assertNotIn("resumed_at", info)
+
+    def test_permanent_failure_drops_the_partial_file(self):
+        Path(self.dest + ".part").write_bytes(b"%PDF-1.6 stale")
+        Path(self.dest + ".part.json").write_text(json.dumps({"url": "https://ok.example/1.pdf", "validator": '"v0"'}))
+        request = mock.Mock(return_value=FakeResponse([b"<html>"], status=200))
+        request.return_value.headers["Content-Type"] = "text/html"
+        with mock.patch.object(fetch_papers.CLIENT, "request", request):
+            part, _, info = fetch_papers.http_fetch("https://ok.example/1.pdf", self.dest, retries=3)
+        self.assertIsNone(part)
+        self.assertEqual(os.listdir(self.tmp.name), [])
+
+    def test_cancel_stops_the_clients_retries(self):
+        cancel = threading.Event()
+
+        def request(method, url, headers=None, timeout=None, retries=None, on_retry=None):
+            cancel.set()  # cancelled while the client was backing off
+            on_retry(1, 503, None)
+            self.fail("on_retry should have aborted the request")
+
+        with mock.patch.object(fetch_papers.CLIENT, "request", request):
+            part, _, info = fetch_papers.http_fetch("https://slow.example/1.pdf", self.dest, cancel=cancel, timeout=5)
+        self.assertIsNone(part)
+        self.assertEqual(info["error"], "cancelled")
+
+
+if __name__ == "__main__":
+    unittest.main()
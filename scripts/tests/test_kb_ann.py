@@ -0,0 +1,79 @@
+"""IVF index: clustering, serialization, nprobe tuning and recall against exact search."""
+
+from __future__ import annotations
+import json
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import build_kb_index  # noqa: E402
+from kb_ann import build_ivf, ivf_recall, probe, read_ivf, tune_nprobe, unit, write_ivf  # noqa: E402
+
+
+def clustered(n=600, dim=32, clusters=24, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim))
+    return unit(centers[rng.integers(0, clusters, n)] + rng.normal(scale=0.3, size=(n, dim)))
+
+
+class IvfTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = Path(self.tmp.name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_posting_lists_partition_rows(self):
+        x = clustered()
+        ivf = build_ivf(x)
+        self.assertEqual(len(ivf["centroids"]), 24)  # round(sqrt(600))
+        self.assertEqual(sorted(ivf["ids"].tolist()), list(range(600)))
+        self.assertEqual(ivf["offsets"][0], 0)
+        self.assertEqual(ivf["offsets"][-1], 600)
+        # every row sits in the list of its nearest centroid
+        nearest = np.argmax(x @ ivf["centroids"].T, axis=1)
+        for j in range(len(ivf["centroids"])):
+            rows = ivf["ids"][ivf["offsets"][j] : ivf["offsets"][j + 1]]
+            self.assertTrue(np.all(nearest[rows] == j))
+
+    def test_round_trip_and_probe(self):
+        x = clustered()
+        ivf = build_ivf(x)
+        desc = write_ivf(self.dir / "ivf.bin", ivf)
+        back = read_ivf(self.dir, desc)
+        for name in ("centroids", "offsets", "ids"):
+            np.testing.assert_array_equal(back[name], ivf[name])
+        self.assertEqual(len(probe(x[0], back, nprobe=len(back["centroids"]))), 600)
+
+    def test_tuning_reaches_target_while_scanning_less(self):
+        x = clustered()
+        ivf = build_ivf(x)
+        tuned = tune_nprobe(x, ivf, target=0.9)
+        self.assertGreaterEqual(tuned["recall_at_10"], 0.9)
+        self.assertLess(tuned["scanned"], 0.5)
+        self.assertEqual(ivf_recall(x, ivf, nprobe=len(ivf["centroids"]))[0], 1.0)
+
+    def test_write_index_records_ann(self):
+        x = clustered(n=400)
+        entries = [{"id": str(i), "text": "t", "kind": "paper" if i < 300 else "note", "license": "cc by"} for i in range(400)]
+        manifest = build_kb_index.write_index(self.dir, entries, x.tolist(), "float32", shard_bytes=1 << 30)
+        paper, note = [sh for sh in manifest["shards"] if sh["kind"] == "paper"], [sh for sh in manifest["shards"] if sh["kind"] == "note"]
+        self.assertIn("ivf", paper[0])
+        self.assertNotIn("ivf", note[0])  # below MIN_ROWS
+        self.assertTrue((self.dir / paper[0]["ivf"]["file"]).exists())
+        self.assertGreaterEqual(manifest["ann"]["recall_at_10"], 0.9)
+        self.assertLess(manifest["ann"]["scanned"], 1.0)
+        self.assertEqual(json.loads((self.dir / "manifest.json").read_text())["ann"]["type"], "ivf")
+        no_ann = build_kb_index.write_index(self.dir, entries, x.tolist(), "float32", ann=False)
+        self.assertNotIn("ann", no_ann)
+        self.assertEqual(list(self.dir.glob("ivf-*.bin")), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
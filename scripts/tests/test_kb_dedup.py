@@ -0,0 +1,94 @@
+"""Near-duplicate elimination: boilerplate lines, MinHash grouping, attributions and the report."""
+
+from __future__ import annotations
+import random
+import sys
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from kb_dedup import dedup, dedup_stream, jaccard, near_duplicates, shingles, strip_boilerplate  # noqa: E402
+
+random.seed(0)
+VOCAB = ["".join(random.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(random.randint(3, 9))) for _ in range(3000)]
+
+
+def prose(n=150):
+    return " ".join(random.choice(VOCAB) for _ in range(n))
+
+
+def paper(pmid, i, text):
+    return {"id": f"paper:PMID:{pmid}:c{i}", "text": text, "kind": "paper", "license": "cc by", "pmid": pmid,
+            "title": f"Paper {pmid}", "sourceUrl": f"/public/papers/{pmid}.pdf", "pageStart": i + 1, "pageEnd": i + 1}
+
+
+class DedupTest(unittest.TestCase):
+    def test_near_identical_chunks_merge_with_attribution(self):
+        base = prose()
+        words = base.split()
+        words[70] = "changed"
+        note = {"id": "note:PMID:2:c0", "text": " ".join(words), "kind": "note", "license": "derived", "pmid": "2",
+                "title": "Note 2", "sourceUrl": "/docs/papers_notes/2.md"}
+        entries = [paper("1", 0, base), paper("1", 1, prose()), note, paper("3", 0, prose())]
+        self.assertGreater(jaccard(shingles(base), shingles(note["text"])), 0.85)
+
+        kept, report = dedup(entries)
+        self.assertEqual([e["id"] for e in kept], ["paper:PMID:1:c0", "paper:PMID:1:c1", "paper:PMID:3:c0"])
+        self.assertEqual(kept[0]["alsoIn"], [{"id": "note:PMID:2:c0", "kind": "note", "title": "Note 2",
+                                              "sourceUrl": "/docs/papers_notes/2.md", "pmid": "2"}])
+        self.assertNotIn("alsoIn", kept[1])
+        self.assertNotIn("alsoIn", entries[0])  # inputs are not modified
+        self.assertEqual((report["input_chunks"], report["kept_chunks"], report["dropped"]), (4, 3, 1))
+        self.assertEqual(report["chars_before"] - report["chars_after"], len(note["text"]))
+
+    def test_overlap_and_distinct_text_are_kept(self):
+        a = prose()
+        b = a[-200:] + " " + prose()  # the chunk_text overlap tail
+        self.assertEqual(near_duplicates([a, b, prose(), "", "short claim"]), [0, 1, 2, 3, 4])
+        self.assertEqual(near_duplicates(["Same claim text.", "same claim, text", "other"]), [0, 0, 2])
+
+    def test_stream_pulls_one_source_at_a_time(self):
+        base = prose()
+        pulled = []
+
+        def sources():
+            for src in ([paper("1", 0, base), paper("1", 1, prose())], [paper("2", 0, base + " extra")], [paper("3", 0, prose())]):
+                pulled.append(src[0]["pmid"])
+                yield src
+
+        merged, report = {}, {}
+        stream = dedup_stream(sources(), merged, report)
+        self.assertEqual(next(stream)["id"], "paper:PMID:1:c0")
+        self.assertEqual(pulled, ["1"])
+        self.assertEqual([e["id"] for e in stream], ["paper:PMID:1:c1", "paper:PMID:3:c0"])
+        self.assertEqual(pulled, ["1", "2", "3"])
+        self.assertEqual([a["id"] for a in merged["paper:PMID:1:c0"]], ["paper:PMID:2:c0"])
+        self.assertEqual((report["input_chunks"], report["kept_chunks"], report["dropped"]), (4, 3, 1))
+
+    def test_repeated_paper_lines_are_stripped(self):
+        header = "Journal of Strength Research 2021; 12: 345-360"
+        chunks = [paper("9", i, f"{header.replace('345', str(345 + i))}\n{prose(40)}\nPage {i + 1} of 6 - CC BY 4.0 licence") for i in range(6)]
+        chunks.append(paper("9", 6, f"{header}\nPage 7 of 7 - CC BY 4.0 licence"))
+        note = {"id": "note:PMID:9:c0", "text": f"{header}\n{prose(20)}", "kind": "note", "pmid": "9"}
+        out, lines = strip_boilerplate(chunks + [note] * 4)
+        self.assertEqual(lines, 2)
+        self.assertEqual(len(out), 6 + 4)  # the header-only chunk is gone
+        for e in out[:6]:
+            self.assertEqual(len(e["text"].splitlines()), 1)
+        self.assertTrue(out[-1]["text"].startswith(header))  # notes untouched
+
+        kept, report = dedup(chunks)
+        self.assertEqual((report["empty_after_boilerplate"], report["boilerplate_lines"]), (1, 2))
+        self.assertEqual(len(kept), 6)
+
+    def test_lines_recurring_in_a_few_chunks_of_a_long_paper_are_kept(self):
+        line = "Randomized crossover design"
+        chunks = [paper("8", i, f"{line if i % 5 == 0 else 'Results'}\n{prose(40)}") for i in range(20)]
+        out, lines = strip_boilerplate(chunks)
+        self.assertEqual(lines, 0)
+        self.assertEqual(out, chunks)
+
+
+if __name__ == "__main__":
+    unittest.main()
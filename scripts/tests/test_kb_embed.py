@@ -0,0 +1,106 @@
+"""Token-aware concurrent embedding against a stub /v1/embeddings server that rate-limits."""
+
+from __future__ import annotations
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from unittest import mock
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import build_kb_index  # noqa: E402
+from embedding_cache import EmbeddingCache  # noqa: E402
+
+CAPACITY = 3
+
+
+class Stub:
+    active = 0
+    peak = 0
+    throttled = 0
+    requests = []
+    lock = threading.Lock()
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        with Stub.lock:
+            over = Stub.active >= CAPACITY
+            if over:
+                Stub.throttled += 1
+            else:
+                Stub.active += 1
+                Stub.peak = max(Stub.peak, Stub.active)
+                Stub.requests.append(payload["input"])
+        if over:
+            return self.reply(429, {"error": {"message": "rate limited"}}, {"Retry-After": "0.05"})
+        try:
+            time.sleep(0.05)
+            # answer out of order; the client must sort by "index"
+            data = [{"index": i, "embedding": [float(len(t)), float(i)]} for i, t in enumerate(payload["input"])]
+            self.reply(200, {"data": data[::-1]})
+        finally:
+            with Stub.lock:
+                Stub.active -= 1
+
+    def reply(self, status, obj, headers=None):
+        body = json.dumps(obj).encode()
+        self.send_response(status)
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class EmbedBatchingTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+
+    def test_token_batches(self):
+        texts = ["x" * 400] * 5 + ["y" * 8] * 6
+        batches = build_kb_index.token_batches(texts, max_tokens=250, max_inputs=4)
+        self.assertEqual(batches, [[0, 1], [2, 3], [4, 5, 6, 7], [8, 9, 10]])
+        # a single text over the budget still gets a request of its own
+        self.assertEqual(build_kb_index.token_batches(["z" * 4000], max_tokens=10), [[0]])
+
+    def test_concurrent_batches_keep_input_order(self):
+        Stub.requests, Stub.peak = [], 0
+        texts = [f"chunk {n} " + "w" * (n % 7 * 300) for n in range(60)]
+        env = {"OPENAI_API_KEY": "test", "OPENAI_BASE_URL": f"http://127.0.0.1:{self.server.server_port}/v1"}
+        with tempfile.TemporaryDirectory() as d, mock.patch.dict(os.environ, env), \
+                mock.patch.object(build_kb_index.CLIENT, "backoff", 0.01), \
+                mock.patch.object(build_kb_index, "EMBED_RETRIES", 8):
+            cache = EmbeddingCache(os.path.join(d, "emb.sqlite"))
+            vectors, stats = build_kb_index.embed_texts(texts, cache, max_tokens=600, workers=8)
+            cache.close()
+
+        self.assertEqual([v[0] for v in vectors], [float(len(t)) for t in texts])
+        self.assertEqual(stats["requests"], len(Stub.requests))
+        for sent in Stub.requests:
+            self.assertTrue(len(sent) == 1 or sum(build_kb_index.estimate_tokens(t) for t in sent) <= 600)
+        self.assertGreater(Stub.peak, 1)
+        self.assertLessEqual(stats["concurrency"]["peak"], 8)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,100 @@
+"""BM25 index: tokenizer, scores against the formula, serialization, lexical and hybrid search."""
+
+from __future__ import annotations
+import math
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import build_kb_index  # noqa: E402
+from kb_lexical import Bm25Builder, bm25_scores, build_bm25, read_bm25, tokenize  # noqa: E402
+from kb_query import KBIndex  # noqa: E402
+
+TEXTS = [
+    "Block periodization for strength athletes: accumulation and transmutation blocks.",
+    "Heart rate variability (HRV) guided training versus a fixed plan.",
+    "RIR-based autoregulation: sets ended 2 reps in reserve (RIR 2).",
+    "Daily undulating periodization and HRV in rowers.",
+    "Protein intake and muscle protein synthesis after training.",
+]
+
+
+class LexicalTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = Path(self.tmp.name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_tokenize(self):
+        self.assertEqual(tokenize("RIR-based Autoregulation: the 2 reps in reserve"), ["rir", "based", "autoregulation", "2", "reps", "reserve"])
+        self.assertEqual(tokenize("Größe"), ["gr", "e"])  # ASCII runs only, same as retrieve.ts
+
+    def test_scores_match_formula(self):
+        index = build_bm25(TEXTS)
+        docs = [tokenize(t) for t in TEXTS]
+        avgdl = sum(map(len, docs)) / len(docs)
+        query = "HRV periodization"
+        expected = []
+        for doc in docs:
+            s = 0.0
+            for term in tokenize(query):
+                df = sum(term in d for d in docs)
+                tf = doc.count(term)
+                idf = math.log(1 + (len(docs) - df + 0.5) / (df + 0.5))
+                s += idf * tf * 2.2 / (tf + 1.2 * (0.25 + 0.75 * len(doc) / avgdl))
+            expected.append(s)
+        np.testing.assert_allclose(bm25_scores(index, query), expected, rtol=1e-6)
+        self.assertEqual(bm25_scores(index, "creatine").tolist(), [0.0] * 5)
+
+    def test_builder_lays_parts_out_in_the_given_order(self):
+        builder = Bm25Builder()
+        self.assertEqual([builder.add(TEXTS[:2]), builder.add(TEXTS[2:3]), builder.add(TEXTS[3:])], [0, 1, 2])
+        parts = builder.finish([2, 0, 1])
+        whole = build_bm25(TEXTS[3:] + TEXTS[:3])
+        self.assertEqual(parts["terms"], whole["terms"])
+        for key in ("offsets", "docs", "tfs", "doc_len", "idf"):
+            np.testing.assert_array_equal(parts[key], whole[key], key)
+        self.assertEqual(parts["avgdl"], whole["avgdl"])
+
+    def test_write_index_records_bm25_in_shard_order(self):
+        x = np.eye(5, 8)
+        entries = [
+            {"id": str(i), "text": t, "kind": "note" if i % 2 else "paper", "license": "derived" if i % 2 else "cc by"}
+            for i, t in enumerate(TEXTS)
+        ]
+        manifest = build_kb_index.write_index(self.dir, entries, x.tolist(), "float32")
+        desc = manifest["bm25"]
+        self.assertEqual((desc["docs"], desc["k1"], desc["b"]), (5, 1.2, 0.75))
+        back = read_bm25(self.dir, desc)
+        shard_order = [e["text"] for sh in ("note", "paper") for e in entries if e["kind"] == sh]
+        np.testing.assert_allclose(bm25_scores(back, "HRV"), bm25_scores(build_bm25(shard_order), "HRV"), rtol=1e-4)
+
+        index = KBIndex(self.dir)
+        self.assertEqual([r["id"] for r in index.lexical("HRV")], ["3", "1"])  # shorter chunk first
+        self.assertEqual([r["id"] for r in index.lexical("HRV", kinds=["paper"])], [])
+        self.assertEqual([r["id"] for r in index.lexical("RIR autoregulation")], ["2"])
+        self.assertEqual(index.lexical("block periodization")[0]["id"], "0")
+
+        # hybrid: half cosine, half BM25 relative to the best lexical hit
+        hybrid = index.search(x[4], top_k=2, text="RIR")
+        self.assertEqual([(r["id"], round(r["score"], 4)) for r in hybrid], [("4", 0.5), ("2", 0.5)])
+        self.assertEqual(index.search(x[2], top_k=1, text="RIR")[0]["score"], 1.0)
+
+        build_kb_index.write_index(self.dir, entries, x.tolist(), "float32", bm25=False)
+        self.assertEqual(list(self.dir.glob("bm25*")), [])
+        no_bm25 = KBIndex(self.dir)
+        with self.assertRaises(RuntimeError):
+            no_bm25.lexical("HRV")
+        # hybrid without a BM25 index is the plain vector ranking
+        self.assertEqual(no_bm25.search(x[4], top_k=2, text="RIR"), no_bm25.search(x[4], top_k=2))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,144 @@
+"""Python reference engine: vectorized MMR matches retrieve.ts, filters, IVF probing and the bench."""
+
+from __future__ import annotations
+import io
+import json
+import sys
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import bench_kb  # noqa: E402
+import build_kb_index  # noqa: E402
+from kb_ann import unit  # noqa: E402
+from kb_query import KBIndex, mmr  # noqa: E402
+from test_kb_ann import clustered  # noqa: E402
+
+
+def mmr_loop(query, cands, k, lam=0.5):
+    """Line-by-line port of mmrSelect in src/services/retrieve.ts."""
+    def cosine(a, b):
+        return float(np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b)))
+
+    scores = [cosine(query, c) for c in cands]
+    picked, out = [], []
+    while len(picked) < min(k, len(cands)):
+        best, best_score = -1, -np.inf
+        for i in range(len(cands)):
+            if i in picked:
+                continue
+            max_sim = max([0.0] + [cosine(cands[i], cands[j]) for j in picked])
+            value = lam * scores[i] - (1 - lam) * max_sim
+            if value > best_score:
+                best, best_score = i, value
+        picked.append(best)
+        out.append((best, scores[best]))
+    return out
+
+
+class KBQueryTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = Path(self.tmp.name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_vectorized_mmr_matches_pairwise_loop(self):
+        x = clustered(n=120, dim=16)
+        rng = np.random.default_rng(1)
+        for _ in range(5):
+            q = unit(rng.normal(size=16))
+            fast = mmr(x.astype(np.float32), q.astype(np.float32), 8)
+            slow = mmr_loop(q, x, 8)
+            self.assertEqual([i for i, _ in fast], [i for i, _ in slow])
+            np.testing.assert_allclose([s for _, s in fast], [s for _, s in slow], atol=1e-5)
+
+    def test_search_filters_and_probes_ivf(self):
+        x = clustered(n=700, dim=32)
+        entries = [
+            {"id": str(i), "text": "t", "kind": "paper" if i < 600 else "note", "license": "cc by" if i % 2 else "cc0"}
+            for i in range(700)
+        ]
+        build_kb_index.write_index(self.dir, entries, x.tolist(), "float16", shard_bytes=1 << 30)
+        index = KBIndex(self.dir)
+        q = x[650]
+        notes = index.search(q, 5, kinds=["note"])
+        self.assertEqual(notes[0]["id"], "650")
+        self.assertTrue(all(r["kind"] == "note" for r in notes))
+        self.assertEqual([s.chunks[0]["kind"] for s in index.shards(["note"])], ["note"])
+        self.assertTrue(all(r["license"] == "cc0" for r in index.search(q, 5, licenses=["CC0"])))
+
+        exact = [r["id"] for r in index.top_k(x[3], 10)]
+        probed = [r["id"] for r in index.top_k(x[3], 10, exact=False)]
+        self.assertEqual(exact[0], "3")
+        self.assertGreaterEqual(len(set(exact) & set(probed)), 8)
+        self.assertEqual(len(index.top_k(x[3], 10, nprobe=10_000, exact=False)), 10)
+
+    def test_truncated_index_fits_full_queries(self):
+        x = clustered(n=300, dim=32)
+        entries = [{"id": str(i), "text": "t", "kind": "paper", "license": "cc by"} for i in range(300)]
+        build_kb_index.write_index(self.dir, entries, build_kb_index.reduce_dim(x, 16), "float32", ann=False)
+        index = KBIndex(self.dir)
+        self.assertEqual(index.query_vector(x[7] * 3).shape, (16,))
+        self.assertEqual(index.top_k(x[7], 1)[0]["id"], "7")
+        self.assertAlmostEqual(index.top_k(x[7], 1)[0]["score"], 1.0, places=5)
+
+    def test_bench_reports_every_variant(self):
+        out, golden = self.dir / "bench.json", self.dir / "golden.json"
+        corpus = ["--synthetic", "600", "--dim", "32"]
+        with redirect_stdout(io.StringIO()):
+            bench_kb.main(corpus + ["--golden", str(golden), "--golden-queries", "8", "--write-golden"])
+            bench_kb.main(corpus + ["--golden", str(golden), "--queries", "20", "--repeat", "1", "--out", str(out)])
+        report = json.loads(out.read_text())
+        self.assertEqual((report["golden"], report["queries"]), (8, 20))
+        rows = {r["variant"]: r for r in report["results"]}
+        self.assertEqual(set(rows), set(bench_kb.VARIANTS))
+        self.assertEqual(rows["exact"]["recall@10"], 1.0)
+        self.assertEqual(rows["exact"]["mmr_overlap"], 1.0)
+        self.assertLess(rows["int8"]["bytes"], rows["float16"]["bytes"])
+        self.assertEqual((rows["half"]["dim"], rows["quarter"]["dim"]), (16, 8))
+        for r in rows.values():
+            self.assertLessEqual(r["p50_ms"], r["p99_ms"])
+            self.assertTrue(0 < r["golden_recall@10"] <= 1 and 0 < r["golden_ndcg@10"] <= 1)
+            if r["dim"] == 32:
+                self.assertGreaterEqual(r["recall@10"], 0.8)
+
+    def test_golden_set_is_used_only_for_its_corpus(self):
+        entries, vectors = bench_kb.synthetic_corpus(300, 16, 0)
+        golden = self.dir / "golden.json"
+        corpus = {"synthetic": 300, "dim": 16, "seed": 0}
+        bench_kb.write_golden(golden, corpus, bench_kb.golden_queries(entries, vectors, 8, 0))
+        queries = bench_kb.load_golden(golden, corpus, entries)
+        self.assertEqual(len(queries), 8)
+        self.assertEqual(queries[3]["kinds"], bench_kb.DERIVED_KINDS)
+        for q in queries:
+            topic = int(q["id"].split("-")[1])
+            self.assertTrue(all(entries[int(i[4:])]["topic"] == topic for i in q["relevant"]))
+        self.assertIsNone(bench_kb.load_golden(golden, dict(corpus, seed=1), entries))
+
+    def test_checked_in_golden_set_is_reproducible(self):
+        doc = json.loads(bench_kb.GOLDEN.read_text(encoding="utf-8"))
+        c = doc["corpus"]
+        entries, vectors = bench_kb.synthetic_corpus(c["synthetic"], c["dim"], c["seed"])
+        fresh = bench_kb.golden_queries(entries, vectors, len(doc["queries"]), c["seed"])
+        self.assertEqual([(q["id"], q["relevant"]) for q in doc["queries"]], [(q["id"], q["relevant"]) for q in fresh])
+        np.testing.assert_allclose([q["vector"] for q in doc["queries"]], [q["vector"] for q in fresh], atol=1e-5)
+
+    def test_sampled_queries_stay_near_their_rows(self):
+        corpus = clustered(n=50, dim=32)
+        queries = bench_kb.sample_queries(corpus, 10, 0)
+        self.assertEqual(len(queries), 10)
+        for q in queries:
+            row = int(q["id"][3:])
+            v = np.asarray(q["vector"])
+            self.assertEqual(int(np.argmax(corpus @ (v / np.linalg.norm(v)))), row)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,140 @@
+"""KB index sharding: per-kind (and licence) partitions, size bounds and the manifest descriptors."""
+
+from __future__ import annotations
+import json
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import build_kb_index  # noqa: E402
+from kb_vectors import read_matrix, recall_at_k  # noqa: E402
+
+
+def corpus():
+    entries, vectors = [], []
+    rng = np.random.default_rng(0)
+    for kind, lic, n in (("paper", "cc by", 30), ("paper", "cc0", 5), ("note", "derived", 12), ("video_claim", "derived", 3)):
+        for i in range(n):
+            entries.append({"id": f"{kind}:{lic}:{i}", "text": "x" * 200, "kind": kind, "license": lic})
+            vectors.append(rng.normal(size=8).tolist())
+    # interleave kinds so grouping has to reorder
+    order = rng.permutation(len(entries))
+    return [entries[i] for i in order], [vectors[i] for i in order]
+
+
+class KBShardsTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = Path(self.tmp.name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_shards_are_per_kind_and_bounded(self):
+        entries, vectors = corpus()
+        (self.dir / "chunks-000.json").write_text("[]")  # leftover from an older build
+        manifest = build_kb_index.write_index(self.dir, entries, vectors, "float32", shard_bytes=3000)
+        self.assertFalse((self.dir / "chunks-000.json").exists())
+        shards = manifest["shards"]
+        self.assertEqual(sum(sh["chunks"] for sh in shards), len(entries))
+        self.assertEqual([sh["id"] for sh in shards if sh["kind"] == "note"], ["note-000", "note-001"])
+        self.assertEqual(manifest["files"], [sh["file"] for sh in shards])
+        by_id = {e["id"]: np.asarray(v) / np.linalg.norm(v) for e, v in zip(entries, vectors)}
+        for sh in shards:
+            chunks = json.loads((self.dir / sh["file"]).read_text())
+            self.assertEqual({c["kind"] for c in chunks}, {sh["kind"]})
+            self.assertEqual(sh["licenses"], sorted({c["license"] for c in chunks}))
+            self.assertLessEqual(sh["bytes"], 3000)
+            self.assertEqual(sh["bytes"], (self.dir / sh["file"]).stat().st_size + sh["embeddings"]["bytes"])
+            # row i of the shard matrix is the unit vector of chunk i of the shard JSON
+            matrix = read_matrix(self.dir, sh["embeddings"])
+            for c, row in zip(chunks, matrix):
+                np.testing.assert_allclose(row, by_id[c["id"]], rtol=1e-6)
+        self.assertEqual(manifest["recall_at_10"], 1.0)
+        self.assertEqual((manifest["embedding_dim"], manifest["normalized"]), (8, True))
+        self.assertNotIn("dimension_reduction", manifest)
+
+    def test_truncated_dimension(self):
+        entries, vectors = corpus()
+        reduced = build_kb_index.reduce_dim(vectors, 4)
+        np.testing.assert_allclose(np.linalg.norm(reduced, axis=1), 1.0)
+        np.testing.assert_allclose(reduced[0] * np.linalg.norm(vectors[0][:4]), vectors[0][:4])
+        reduction = {"method": "truncate", "source_dim": 8, "recall_at_10": 0.5}
+        manifest = build_kb_index.write_index(self.dir, entries, reduced, "float32", reduction=reduction)
+        self.assertEqual(manifest["embedding_dim"], 4)
+        self.assertEqual(manifest["shards"][0]["embeddings"]["shape"][1], 4)
+        self.assertEqual(manifest["dimension_reduction"], reduction)
+        self.assertLess(recall_at_k(build_kb_index.reduce_dim(vectors), reduced), 1.0)
+
+    def test_streaming_writer_writes_full_shards_before_finish(self):
+        entries, vectors = corpus()
+        merged = {}
+        writer = build_kb_index.IndexWriter(self.dir, "float32", shard_bytes=3000)
+        for e, v in zip(entries, vectors):
+            writer.add(e, v, merged)
+        self.assertTrue((self.dir / "chunks-paper-000.json").exists())
+        self.assertFalse((self.dir / "manifest.json").exists())
+        # a later duplicate of a chunk whose shard is already on disk
+        first = json.loads((self.dir / "chunks-paper-000.json").read_text())[0]["id"]
+        merged[first] = [{"id": "note:dup", "kind": "note"}]
+        manifest = writer.finish(merged)
+        self.assertEqual(merged, {})
+        chunks = json.loads((self.dir / "chunks-paper-000.json").read_text())
+        self.assertEqual(chunks[0]["alsoIn"], [{"id": "note:dup", "kind": "note"}])
+        for sh in manifest["shards"]:
+            self.assertEqual(sh["bytes"], (self.dir / sh["file"]).stat().st_size + sh["embeddings"]["bytes"])
+        self.assertFalse(Path(writer.tmp.name).exists())  # temporary row files are gone
+
+        with tempfile.TemporaryDirectory() as other:
+            in_memory = build_kb_index.write_index(Path(other), entries, vectors, "float32", shard_bytes=3000)
+            self.assertEqual([(sh["id"], sh["chunks"]) for sh in manifest["shards"]],
+                             [(sh["id"], sh["chunks"]) for sh in in_memory["shards"]])
+            self.assertEqual(manifest["bm25"]["sections"], in_memory["bm25"]["sections"])
+
+    def test_attributions_from_before_and_after_a_shard_is_written_add_up(self):
+        text = "x" * 200
+        entries = [{"id": f"paper:{p}:c0", "text": text, "kind": "paper", "license": "cc by"} for p in "ADEFG"]
+        merged = {}
+        writer = build_kb_index.IndexWriter(self.dir, "float32", shard_bytes=900, ann=False)
+        writer.add(entries[0], [1.0, 0.0], merged)
+        merged["paper:A:c0"] = [{"id": "paper:B:c0", "kind": "paper"}]  # B dropped while A's shard is open
+        for e in entries[1:]:
+            writer.add(e, [0.0, 1.0], merged)
+        self.assertTrue((self.dir / "chunks-paper-000.json").exists())
+        merged["paper:A:c0"] = [{"id": "paper:C:c0", "kind": "paper"}]  # C dropped after it was written
+        writer.finish(merged)
+        chunk = json.loads((self.dir / "chunks-paper-000.json").read_text())[0]
+        self.assertEqual([a["id"] for a in chunk["alsoIn"]], ["paper:B:c0", "paper:C:c0"])
+
+    def test_writer_truncates_and_measures_the_reduction(self):
+        entries, vectors = corpus()
+        writer = build_kb_index.IndexWriter(self.dir, "float32", dim=4)
+        for e, v in zip(entries, vectors):
+            writer.add(e, v)
+        reduction = {"method": "truncate", "source_dim": 8}
+        manifest = writer.finish(reduction=reduction)
+        self.assertEqual(manifest["embedding_dim"], 4)
+        ordered = [v for sh in manifest["shards"] for c in json.loads((self.dir / sh["file"]).read_text())
+                   for e, v in zip(entries, vectors) if e["id"] == c["id"]]
+        expected = recall_at_k(build_kb_index.reduce_dim(ordered), build_kb_index.reduce_dim(ordered, 4))
+        self.assertAlmostEqual(manifest["dimension_reduction"]["recall_at_10"], expected, places=4)
+
+    def test_split_license(self):
+        entries, vectors = corpus()
+        manifest = build_kb_index.write_index(self.dir, entries, vectors, "float16", split_license=True)
+        ids = [(sh["id"], sh["license"], sh["chunks"]) for sh in manifest["shards"]]
+        self.assertEqual(ids, [
+            ("note-derived-000", "derived", 12),
+            ("paper-cc_by-000", "cc by", 30),
+            ("paper-cc0-000", "cc0", 5),
+            ("video_claim-derived-000", "derived", 3),
+        ])
+
+
+if __name__ == "__main__":
+    unittest.main()
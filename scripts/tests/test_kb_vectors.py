@@ -0,0 +1,68 @@
+"""Binary KB embedding matrices: layout, round trip per dtype, and the recall report."""
+
+from __future__ import annotations
+import json
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import build_kb_index  # noqa: E402
+from kb_vectors import DTYPES, matrix_row_bytes, read_matrix, recall_at_k, write_matrix  # noqa: E402
+
+
+def clustered(n=300, dim=64, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(20, dim))
+    x = centers[rng.integers(0, 20, n)] + rng.normal(scale=0.5, size=(n, dim))
+    return x / np.linalg.norm(x, axis=1, keepdims=True)
+
+
+class KBVectorsTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = Path(self.tmp.name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_round_trip_per_dtype(self):
+        x = clustered()
+        tolerance = {"float32": 1e-7, "float16": 1e-3, "int8": 1e-2}
+        for dtype in DTYPES:
+            desc = write_matrix(self.dir / f"{dtype}.bin", x, dtype)
+            self.assertEqual(desc["shape"], [300, 64])
+            self.assertEqual(desc["bytes"], (self.dir / desc["file"]).stat().st_size)
+            self.assertEqual(desc["bytes"], 300 * matrix_row_bytes(64, dtype))  # what IndexWriter sizes shards by
+            for sec in desc["sections"].values():
+                self.assertEqual(sec["offset"] % 4, 0)
+            back = read_matrix(self.dir, desc)
+            self.assertEqual(back.dtype, np.float32)
+            self.assertLess(np.abs(back - x).max(), tolerance[dtype], dtype)
+            self.assertGreaterEqual(recall_at_k(x, back), 0.95, dtype)
+
+    def test_int8_layout(self):
+        x = np.array([[0.5, -1.0, 0.25], [0.0, 0.0, 0.0]])
+        desc = write_matrix(self.dir / "q.bin", x, "int8")
+        raw = (self.dir / "q.bin").read_bytes()
+        self.assertEqual(list(np.frombuffer(raw[:6], dtype="i1")), [64, -127, 32, 0, 0, 0])
+        self.assertEqual(desc["sections"]["scales"], {"offset": 8, "bytes": 8})
+        self.assertAlmostEqual(float(np.frombuffer(raw, "<f4", 1, 8)[0]), 1 / 127, places=6)
+
+    def test_write_index_keeps_metadata_out_of_the_matrix(self):
+        x = clustered(n=40, dim=16)
+        entries = [{"id": f"c{i}", "text": f"t{i}", "kind": "note"} for i in range(40)]
+        manifest = build_kb_index.write_index(self.dir, entries, x.tolist(), "int8")
+        chunks = json.loads((self.dir / "chunks-note-000.json").read_text())
+        self.assertNotIn("embedding", chunks[0])
+        self.assertEqual(manifest["shards"][0]["embeddings"]["shape"], [40, 16])
+        self.assertGreater(manifest["recall_at_10"], 0.9)
+        self.assertEqual(json.loads((self.dir / "manifest.json").read_text())["embedding_dtype"], "int8")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,97 @@
+"""Metadata store: TTL, negative caching and offline reads against a stub Europe PMC search."""
+
+from __future__ import annotations
+import json
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from http_client import HttpClient  # noqa: E402
+from metadata_store import MetadataStore  # noqa: E402
+
+KNOWN = {"111", "222", "333"}
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    asked = []
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query)["query"][0]
+        pmids = re.findall(r"EXT_ID:(\d+)", query)
+        Handler.asked.append(pmids)
+        results = [{"pmid": p, "title": f"Paper {p}", "abstractText": "..."} for p in pmids if p in KNOWN]
+        body = json.dumps({"nextCursorMark": "*", "resultList": {"result": results}}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class MetadataStoreTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.env = mock.patch.dict(os.environ, {"EPMC_SEARCH_URL": f"http://127.0.0.1:{cls.server.server_port}/search"})
+        cls.env.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.env.stop()
+        cls.server.shutdown()
+
+    def setUp(self):
+        Handler.asked = []
+        self.tmp = tempfile.TemporaryDirectory()
+        self.db = os.path.join(self.tmp.name, "meta.sqlite")
+        self.client = HttpClient(retries=1)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_network_only_on_miss(self):
+        store = MetadataStore(self.db, ttl=3600)
+        first = store.resolve(["111", "999"], client=self.client)
+        self.assertEqual(sorted(first), ["111"])
+        second = store.resolve(["111", "999", "222"], client=self.client)
+        self.assertEqual(sorted(second), ["111", "222"])
+        # 999 is a remembered miss; only 222 went out the second time
+        self.assertEqual(Handler.asked, [["111", "999"], ["222"]])
+        self.assertEqual((store.hits, store.misses), (2, 3))
+        store.close()
+
+        reopened = MetadataStore(self.db, ttl=3600)
+        self.assertEqual(reopened.resolve(["111"], client=self.client)["111"]["title"], "Paper 111")
+        self.assertEqual(len(Handler.asked), 2)
+        reopened.close()
+
+    def test_expiry_and_offline(self):
+        store = MetadataStore(self.db, ttl=3600)
+        store.resolve(["111"], client=self.client)
+        store.ttl = 0.01
+        time.sleep(0.05)
+        # expired: offline still serves it, online refetches it
+        self.assertIn("111", store.resolve(["111", "333"], offline=True))
+        self.assertEqual(len(Handler.asked), 1)
+        store.resolve(["111"], client=self.client)
+        self.assertEqual(Handler.asked[-1], ["111"])
+        store.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,222 @@
+"""Concurrent note generation against a stub chat-completions server that rate-limits."""
+
+from __future__ import annotations
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from unittest import mock
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import extract_notes  # noqa: E402
+from http_client import AdaptiveLimiter  # noqa: E402
+
+CAPACITY = 3
+
+
+class Stub:
+    active = 0
+    peak = 0
+    throttled = 0
+    fail_pmids = set()
+    # packed replies leave `drop` out and give `garble` a non-text value
+    drop = set()
+    garble = set()
+    packed_requests = []
+    single_requests = []
+    lock = threading.Lock()
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        if "response_format" in payload:
+            return self.packed(payload)
+        meta = json.loads(payload["messages"][1]["content"].split("\n")[1])
+        Stub.single_requests.append(meta["pmid"])
+        with Stub.lock:
+            over = Stub.active >= CAPACITY
+            if over:
+                Stub.throttled += 1
+            else:
+                Stub.active += 1
+                Stub.peak = max(Stub.peak, Stub.active)
+        if over:
+            return self.reply(429, {"error": {"message": "rate limited"}}, {"Retry-After": "0.05"})
+        try:
+            time.sleep(0.05)
+            if meta["pmid"] in Stub.fail_pmids:
+                return self.reply(500, {"error": {"message": "boom"}})
+            remaining = CAPACITY - Stub.active
+            self.reply(200, {"choices": [{"message": {"content": f"- note for {meta['pmid']}"}}]},
+                       {"x-ratelimit-limit-requests": "100", "x-ratelimit-remaining-requests": str(50 + remaining)})
+        finally:
+            with Stub.lock:
+                Stub.active -= 1
+
+    def packed(self, payload):
+        papers = json.loads(payload["messages"][1]["content"].split("\n")[1])
+        Stub.packed_requests.append([p["pmid"] for p in papers])
+        notes = {p["pmid"]: 42 if p["pmid"] in Stub.garble else f"- packed note for {p['pmid']}"
+                 for p in papers if p["pmid"] not in Stub.drop}
+        content = json.dumps({"notes": notes})
+        self.reply(200, {"choices": [{"message": {"content": content}}]})
+
+    def reply(self, status, obj, headers=None):
+        body = json.dumps(obj).encode()
+        self.send_response(status)
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class NotesTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+
+    def test_rate_limited_run_uses_llm_and_reports_fallbacks(self):
+        Stub.fail_pmids = {"7"}
+        jobs = [{"pmid": str(n), "meta": {"pmid": str(n), "title": f"T{n}"}, "abstract": "An abstract."} for n in range(24)]
+        env = {"OPENAI_API_KEY": "test", "OPENAI_MODEL": "stub-model"}
+        with tempfile.TemporaryDirectory() as d, mock.patch.dict(os.environ, env), \
+                mock.patch.object(extract_notes.CLIENT, "host_override", f"http://127.0.0.1:{self.server.server_port}"), \
+                mock.patch.object(extract_notes.CLIENT, "backoff", 0.01), \
+                mock.patch.object(extract_notes, "NOTES_RETRIES", 8):
+            report = extract_notes.generate_notes(jobs, Path(d), workers=8)
+            note = (Path(d) / "3.md").read_text()
+            fallback_note = (Path(d) / "7.md").read_text()
+
+        self.assertEqual((report["llm"], report["fallback"]), (23, 1))
+        failed = [r for r in report["notes"] if r["generator"] == "fallback"]
+        self.assertEqual(failed[0]["pmid"], "7")
+        self.assertIn("500", failed[0]["reason"])
+        self.assertIn('generator: "llm:stub-model"', note)
+        self.assertIn("- note for 3", note)
+        self.assertIn('generator: "fallback"', fallback_note)
+        self.assertGreater(Stub.peak, 1)
+
+
+class PackingTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+
+    def test_pack_jobs_respects_budget(self):
+        jobs = [{"pmid": str(n), "meta": {"pmid": str(n)}, "abstract": "x" * 800} for n in range(10)]
+        groups = extract_notes.pack_jobs(jobs, budget=2000)
+        self.assertEqual([j["pmid"] for g in groups for j in g], [str(n) for n in range(10)])
+        # ~120 tokens of prompt, then ~610 per paper (abstract + reserved completion)
+        self.assertEqual([len(g) for g in groups], [3, 3, 3, 1])
+        self.assertEqual([len(g) for g in extract_notes.pack_jobs(jobs, budget=1)], [1] * 10)
+
+    def test_parse_packed(self):
+        reply = json.dumps({"notes": {"1": "- a", "2": ["first", "- second"], "3": 7, "4": ""}})
+        self.assertEqual(extract_notes.parse_packed(reply, ["1", "2", "3", "4", "5"]),
+                         {"1": "- a", "2": "- first\n- second"})
+        self.assertEqual(extract_notes.parse_packed("not json", ["1"]), {})
+        self.assertEqual(extract_notes.parse_packed('{"1": "- top level"}', ["1"]), {"1": "- top level"})
+
+    def test_missing_and_malformed_entries_fall_back_to_single_requests(self):
+        Stub.fail_pmids, Stub.drop, Stub.garble = set(), {"4"}, {"9"}
+        Stub.packed_requests, Stub.single_requests = [], []
+        jobs = [{"pmid": str(n), "meta": {"pmid": str(n), "title": f"T{n}"}, "abstract": "An abstract."} for n in range(12)]
+        env = {"OPENAI_API_KEY": "test", "OPENAI_MODEL": "stub-model"}
+        with tempfile.TemporaryDirectory() as d, mock.patch.dict(os.environ, env), \
+                mock.patch.object(extract_notes.CLIENT, "host_override", f"http://127.0.0.1:{self.server.server_port}"), \
+                mock.patch.object(extract_notes.CLIENT, "backoff", 0.01):
+            report = extract_notes.generate_notes(jobs, Path(d), workers=4, pack_tokens=2500)
+            packed_note = (Path(d) / "0.md").read_text()
+            single_note = (Path(d) / "4.md").read_text()
+
+        self.assertEqual((report["llm"], report["fallback"]), (12, 0))
+        self.assertEqual(sorted(Stub.single_requests), ["4", "9"])
+        self.assertEqual(len(Stub.packed_requests), report["packing"]["packs"])
+        self.assertLess(len(Stub.packed_requests), 12)
+        self.assertEqual((report["packing"]["packed"], report["packing"]["single"]), (10, 2))
+        self.assertEqual([r["pmid"] for r in report["notes"]], [str(n) for n in range(12)])
+        self.assertIn("- packed note for 0", packed_note)
+        self.assertIn("- note for 4", single_note)
+        self.assertIn('generator: "llm:stub-model"', packed_note)
+        with mock.patch.dict(os.environ, env):
+            self.assertIn(extract_notes.note_fingerprint("An abstract.", packed=True), packed_note)
+            self.assertIn(extract_notes.note_fingerprint("An abstract."), single_note)
+
+
+class MemoTest(unittest.TestCase):
+    def test_only_changed_notes_regenerate(self):
+        job = {"pmid": "1", "meta": {"pmid": "1", "title": "T"}, "abstract": "First abstract."}
+        with tempfile.TemporaryDirectory() as d, mock.patch.dict(os.environ, {"OPENAI_MODEL": "m1"}), \
+                mock.patch.object(extract_notes, "openai_notes", return_value="- llm text"):
+            target = Path(d) / "1.md"
+            extract_notes.write_note("1", job["meta"], job["abstract"], Path(d))
+            fp = extract_notes.note_fingerprint(job["abstract"])
+            self.assertTrue(extract_notes.is_note_current(target, fp))
+            self.assertFalse(extract_notes.is_note_current(target, extract_notes.note_fingerprint("Changed.")))
+            os.environ["OPENAI_MODEL"] = "m2"
+            self.assertFalse(extract_notes.is_note_current(target, extract_notes.note_fingerprint(job["abstract"])))
+            with mock.patch.object(extract_notes, "TEMPERATURE", 0.7):
+                self.assertNotEqual(extract_notes.note_fingerprint(job["abstract"]), fp)
+
+    def test_packed_notes_have_their_own_fingerprint(self):
+        with tempfile.TemporaryDirectory() as d:
+            target = Path(d) / "1.md"
+            extract_notes.write_note("1", {"pmid": "1"}, "Abstract.", Path(d), completion={"content": "- b"}, packed=True)
+            single, packed = extract_notes.note_fingerprint("Abstract."), extract_notes.note_fingerprint("Abstract.", packed=True)
+            self.assertNotEqual(single, packed)
+            self.assertFalse(extract_notes.is_note_current(target, single))
+            self.assertTrue(extract_notes.is_note_current(target, single, packed))
+            with mock.patch.object(extract_notes, "PACK_PROMPT", "Reply with JSON."):
+                self.assertNotEqual(extract_notes.note_fingerprint("Abstract.", packed=True), packed)
+
+    def test_fallback_notes_are_not_cached(self):
+        with tempfile.TemporaryDirectory() as d, mock.patch.object(extract_notes, "openai_notes", return_value=""):
+            extract_notes.write_note("2", {"pmid": "2"}, "Abstract.", Path(d))
+            self.assertFalse(extract_notes.is_note_current(Path(d) / "2.md", extract_notes.note_fingerprint("Abstract.")))
+
+
+class AdaptiveLimiterTest(unittest.TestCase):
+    def test_aimd(self):
+        lim = AdaptiveLimiter(initial=4, maximum=6, cooldown=0)
+        for _ in range(4):
+            lim.observe(200, {})
+        self.assertEqual(lim.limit, 5)
+        lim.observe(429, {})
+        self.assertEqual(lim.limit, 2)
+        lim.observe(200, {"x-ratelimit-remaining-requests": "3", "x-ratelimit-limit-requests": "100"})
+        self.assertEqual(lim.limit, 1)
+        self.assertEqual(lim.stats(), {"limit": 1, "peak": 5, "throttled": 1})
+
+    def test_one_burst_of_429s_halves_once(self):
+        lim = AdaptiveLimiter(initial=8, maximum=8, cooldown=60)
+        for _ in range(5):
+            lim.observe(429, {})
+        self.assertEqual(lim.limit, 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,129 @@
+"""Batch API note generation against a stub /v1/files + /v1/batches server."""
+
+from __future__ import annotations
+import json
+import os
+import sys
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from unittest import mock
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import extract_notes  # noqa: E402
+
+
+class Stub:
+    requests = []
+    batches_created = 0
+    polls = 0
+    lock = threading.Lock()
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        raw = self.rfile.read(int(self.headers["Content-Length"]))
+        if self.path == "/v1/files":
+            # the JSONL payload sits between the file part's headers and the closing boundary
+            content = raw.split(b"Content-Type: application/jsonl\r\n\r\n", 1)[1].rsplit(b"\r\n--", 1)[0]
+            Stub.requests = [json.loads(line) for line in content.decode().splitlines() if line]
+            return self.reply({"id": "file-in", "purpose": "batch"})
+        if self.path == "/v1/batches":
+            payload = json.loads(raw)
+            assert payload["input_file_id"] == "file-in" and payload["endpoint"] == "/v1/chat/completions"
+            Stub.batches_created += 1
+            return self.reply({"id": "batch_1", "status": "validating"})
+        self.reply({"error": "not found"}, 404)
+
+    def do_GET(self):
+        if self.path == "/v1/batches/batch_1":
+            with Stub.lock:
+                Stub.polls += 1
+                done = Stub.polls > 1
+            if not done:
+                return self.reply({"id": "batch_1", "status": "in_progress", "request_counts": {"total": 3, "completed": 0}})
+            return self.reply({
+                "id": "batch_1", "status": "completed", "output_file_id": "file-out", "error_file_id": "file-err",
+                "request_counts": {"total": 3, "completed": 1, "failed": 1},
+            })
+        if self.path == "/v1/files/file-out/content":
+            lines = [{
+                "custom_id": r["custom_id"],
+                "response": {"status_code": 200, "body": {"choices": [{"message": {"content": f"- batch note {r['custom_id']}"}}]}},
+                "error": None,
+            } for r in Stub.requests if r["custom_id"] == "1"]
+            return self.reply_lines(lines)
+        if self.path == "/v1/files/file-err/content":
+            return self.reply_lines([{
+                "custom_id": "2",
+                "response": {"status_code": 400, "body": {"error": {"message": "context too long"}}},
+                "error": None,
+            }])
+        self.reply({"error": "not found"}, 404)
+
+    def reply(self, obj, status=200):
+        self.send_body(status, json.dumps(obj).encode())
+
+    def reply_lines(self, items):
+        self.send_body(200, "".join(json.dumps(i) + "\n" for i in items).encode())
+
+    def send_body(self, status, body):
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class BatchNotesTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+
+    def test_submit_resume_and_ingest(self):
+        jobs = [{"pmid": str(n), "meta": {"pmid": str(n), "title": f"T{n}"}, "abstract": "An abstract."} for n in (1, 2, 3)]
+        lookup = {j["pmid"]: j for j in jobs}
+        env = {"OPENAI_API_KEY": "test", "OPENAI_MODEL": "stub-model",
+               "OPENAI_BASE_URL": f"http://127.0.0.1:{self.server.server_port}/v1"}
+        with tempfile.TemporaryDirectory() as d, mock.patch.dict(os.environ, env), \
+                mock.patch.object(extract_notes, "BATCH_INPUT", os.path.join(d, "cache", "batch.jsonl")), \
+                mock.patch.object(extract_notes, "BATCH_STATE", os.path.join(d, "cache", "batch.json")):
+            notes_dir = Path(d) / "notes"
+            notes_dir.mkdir()
+            # first run gives up while the job is in progress and leaves the state behind
+            self.assertIsNone(extract_notes.run_batch(jobs, lookup, notes_dir, poll=0, timeout=0))
+            self.assertTrue(os.path.exists(extract_notes.BATCH_STATE))
+            self.assertEqual([r["custom_id"] for r in Stub.requests], ["1", "2", "3"])
+            self.assertEqual(Stub.requests[0]["body"]["model"], "stub-model")
+
+            report = extract_notes.run_batch(jobs, lookup, notes_dir, poll=0, timeout=0)
+            self.assertEqual(Stub.batches_created, 1)
+            self.assertFalse(os.path.exists(extract_notes.BATCH_STATE))
+            note = (notes_dir / "1.md").read_text()
+            fallback_note = (notes_dir / "2.md").read_text()
+
+        self.assertEqual((report["llm"], report["fallback"]), (1, 2))
+        self.assertEqual(report["batch"]["status"], "completed")
+        self.assertIn("- batch note 1", note)
+        self.assertIn('generator: "llm:stub-model"', note)
+        self.assertIn('generator: "fallback"', fallback_note)
+        reasons = {r["pmid"]: r["reason"] for r in report["notes"]}
+        self.assertIn("context too long", reasons["2"])
+        self.assertIn("no result", reasons["3"])
+
+
+if __name__ == "__main__":
+    unittest.main()
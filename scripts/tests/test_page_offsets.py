@@ -0,0 +1,47 @@
+"""Page-offset maps from streamed extraction and the page ranges build_kb_index derives from them."""
+
+from __future__ import annotations
+import io
+import sys
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from build_kb_index import chunk_spans, chunk_text, page_range  # noqa: E402
+from extract_markdown import write_pages  # noqa: E402
+
+PAGES = [
+    "\n\n  Title of the paper\n\nAbstract text.\n\n\f",
+    "   \n\f",
+    "Methods para one.\n\nMethods para two.\n\n\f",
+    "Results.\n\n\f",
+]
+
+
+class PageOffsetTest(unittest.TestCase):
+    def test_body_matches_joined_text_and_offsets_point_at_pages(self):
+        out = io.StringIO()
+        offsets = write_pages(out, iter(PAGES))
+        body = out.getvalue()
+        self.assertEqual(body, "".join(PAGES).strip() + "\n")
+        self.assertEqual([o["page"] for o in offsets], [1, 2, 3, 4])
+        for o, text in zip(offsets, PAGES):
+            self.assertEqual(body[o["start"]:o["end"]], text.strip())
+        self.assertEqual(offsets[1]["start"], offsets[1]["end"])
+
+    def test_chunks_get_page_ranges(self):
+        out = io.StringIO()
+        offsets = write_pages(out, iter(PAGES))
+        body = out.getvalue()
+        spans = chunk_spans(body, target_chars=40, overlap=0)
+        self.assertEqual([c for c, _, _ in spans], chunk_text(body, target_chars=40, overlap=0))
+        ranges = [page_range(offsets, s, e) for _, s, e in spans]
+        self.assertEqual(ranges[0], (1, 1))
+        self.assertEqual(ranges[-1], (4, 4))
+        self.assertIn((3, 3), ranges)
+        self.assertEqual(page_range(offsets, 0, len(body)), (1, 4))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+"""Registry sharding and the shard merge step of fetch_papers.py."""
+
+from __future__ import annotations
+import json
+import os
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import fetch_papers  # noqa: E402
+from fetch_papers import FetchCache, load_registry, merge_shards, shard_of, shard_path  # noqa: E402
+
+REGISTRY = Path(__file__).resolve().parents[2] / "docs" / "papers" / "registry.json"
+
+
+def shard_file(i: int, n: int, papers, cache=None) -> dict:
+    report = {"phases": {"download": 1.0 + i}, "wall_seconds": 2.0 + i,
+              "papers": [{"pmid": fetch_papers.paper_id(m), "outcome": "linked",
+                          "download": {"attempts": [], "bytes": 0, "retries": 0, "seconds": 0.0}} for m in papers]}
+    return {"shard": i, "of": n, "papers": papers, "cache": cache or {}, "metrics": report}
+
+
+class ShardTest(unittest.TestCase):
+    def test_registry_ids_and_partition(self):
+        entries = load_registry(str(REGISTRY))
+        ids = [e["id"] for e in entries]
+        self.assertEqual(len(ids), len(set(ids)))
+        # externals only stay archived with a free license; a tracked PDF without one is orphaned
+        root = REGISTRY.parents[2]
+        for e in entries:
+            if not e.get("pmid") and (root / fetch_papers.pdf_path(e["id"])).exists():
+                self.assertIn(e.get("license"), fetch_papers.FREE_LICENSES, e["id"])
+        self.assertIn("arxiv:2505.20859", ids)
+        shards = [[pid for pid in ids if shard_of(pid, 4) == i] for i in range(4)]
+        self.assertEqual(sorted(sum(shards, [])), sorted(ids))
+        self.assertTrue(all(shards))
+
+    def test_merge_orders_by_registry_and_requires_all_shards(self):
+        registry = [{"id": "3", "pmid": "3"}, {"id": "1", "pmid": "1"}, {"id": "arxiv:x", "arxiv": "x"}]
+        with tempfile.TemporaryDirectory() as d:
+            files = {
+                0: shard_file(0, 2, [{"pmid": "1"}, {"id": "arxiv:x", "pmid": None}], {"1": {"fingerprint": "f1"}}),
+                1: shard_file(1, 2, [{"pmid": "3"}]),
+            }
+            with open(shard_path(0, 2, d), "w") as f:
+                json.dump(files[0], f)
+            with self.assertRaises(SystemExit):
+                merge_shards(2, registry, FetchCache(os.path.join(d, "cache.json")), d)
+
+            with open(shard_path(1, 2, d), "w") as f:
+                json.dump(files[1], f)
+            cache = FetchCache(os.path.join(d, "cache.json"))
+            papers, reports = merge_shards(2, registry, cache, d)
+            self.assertEqual([fetch_papers.paper_id(m) for m in papers], ["3", "1", "arxiv:x"])
+            self.assertEqual(cache.get("1"), {"fingerprint": "f1"})
+
+            merged = fetch_papers.merge_reports(reports, ["3", "1", "arxiv:x"])
+            self.assertEqual(merged["phases"]["download"], 2.0)
+            self.assertEqual([p["pmid"] for p in merged["papers"]], ["3", "1", "arxiv:x"])
+
+
+if __name__ == "__main__":
+    unittest.main()
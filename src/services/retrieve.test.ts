@@ -0,0 +1,48 @@
+import { afterEach, describe, expect, it, vi } from 'vitest';
+
+vi.mock('./llm', () => ({ embed: vi.fn(async () => [[1, 0]]) }));
+
+import { search } from './retrieve';
+
+// v1 index (no shards, no bm25): chunks carry their embeddings inline
+const manifest = {
+  version: '1.0',
+  created_at: 0,
+  embedding_model: 'text-embedding-3-small',
+  embedding_dim: 2,
+  total_chunks: 2,
+  files: ['chunks-000.json'],
+};
+const chunks = [
+  { id: 'near', text: 'RIR autoregulation', embedding: [1, 0], kind: 'paper', license: 'cc by' },
+  { id: 'far', text: 'HRV monitoring', embedding: [0, 1], kind: 'note', license: 'derived' },
+];
+
+function serve(files: Record<string, unknown>) {
+  vi.stubGlobal(
+    'fetch',
+    vi.fn(async (url: string) => {
+      const name = url.split('/').pop()!;
+      return name in files ? new Response(JSON.stringify(files[name])) : new Response('', { status: 404 });
+    })
+  );
+}
+
+describe('search on an index without bm25', () => {
+  afterEach(() => {
+    vi.unstubAllGlobals();
+  });
+
+  it('falls back to vector ranking in hybrid mode', async () => {
+    serve({ 'manifest.json': manifest, 'chunks-000.json': chunks });
+    const vector = await search('RIR', { baseUrl: '/kb-vector', topK: 2 });
+    const hybrid = await search('RIR', { baseUrl: '/kb-hybrid', topK: 2, mode: 'hybrid' });
+    expect(hybrid.map(r => r.id)).toEqual(['near', 'far']);
+    expect(hybrid.map(r => [r.id, r.score])).toEqual(vector.map(r => [r.id, r.score]));
+  });
+
+  it('still rejects an explicit lexical search', async () => {
+    serve({ 'manifest.json': manifest, 'chunks-000.json': chunks });
+    await expect(search('RIR', { baseUrl: '/kb-lexical', mode: 'lexical' })).rejects.toThrow('no bm25');
+  });
+});
@@ -3,22 +3,103 @@ import { embed } from './llm';
 export type KBChunk = {
   id: string;
   text: string;
-  embedding: number[];
+  // number[] in v1 JSON indexes; a Float32Array row of the shared matrix for binary ones
+  embedding: ArrayLike<number>;
   kind: 'paper' | 'note' | 'video_note' | 'video_claim';
   license: string;
   pmid?: string;
   videoId?: string;
   title?: string;
   sourceUrl?: string;
+  // 1-based PDF pages the chunk text came from (papers with a page-offset map only)
+  pageStart?: number;
+  pageEnd?: number;
+  // near-identical chunks merged into this one at build time (scripts/kb_dedup.py)
+  alsoIn?: KBAttribution[];
 };
 
+export type KBAttribution = Pick<KBChunk, 'id' | 'kind'> &
+  Partial<Pick<KBChunk, 'title' | 'sourceUrl' | 'pmid' | 'videoId' | 'pageStart' | 'pageEnd'>>;
+
 export type KBManifest = {
   version: string;
   created_at: number;
   embedding_model: string;
   embedding_dim: number;
+  // stored rows have unit length, so cosine is a plain dot product
+  normalized?: boolean;
+  // set when the vectors were cut below the model's native dimension (Matryoshka truncation or
+  // the API's `dimensions` parameter); queries are truncated to embedding_dim the same way
+  dimension_reduction?: { method: 'truncate' | 'api'; source_dim: number; recall_at_10?: number };
   total_chunks: number;
   files: string[];
+  // v2: embeddings live in one binary matrix instead of the chunk JSON
+  embeddings?: KBEmbeddings;
+  // v3: chunks and embeddings are split into per-kind shards that load on demand
+  shards?: KBShard[];
+  embedding_dtype?: KBEmbeddings['dtype'];
+  recall_at_10?: number;
+  total_bytes?: number;
+  // BM25 lexical index over all chunks; absent in indexes built with --no-bm25 or before v3
+  bm25?: KBBm25;
+  // present when at least one shard carries an IVF index
+  ann?: { type: 'ivf'; metric: 'cosine'; min_rows: number; target_recall: number; recall_at_10: number; scanned: number };
+};
+
+// Inverted-file ANN index of one shard (scripts/kb_ann.py): unit centroids, and the shard
+// rows of list j are ids[offsets[j] .. offsets[j + 1])
+export type KBIvf = {
+  file: string;
+  nlist: number;
+  nprobe: number;
+  bytes: number;
+  recall_at_10?: number;
+  scanned?: number;
+  sections: { centroids: KBSection; offsets: KBSection; ids: KBSection };
+};
+
+// BM25 index (scripts/kb_lexical.py). Term j of the `terms` JSON array has the postings
+// docs/tfs[offsets[j] .. offsets[j + 1]); doc d is chunk d of the shards laid end to end in
+// manifest order
+export type KBBm25 = {
+  file: string;
+  terms: string;
+  docs: number;
+  vocab: number;
+  postings: number;
+  avgdl: number;
+  k1: number;
+  b: number;
+  tokenizer?: string;
+  stopwords: string[];
+  bytes: number;
+  sections: { offsets: KBSection; docs: KBSection; tfs: KBSection; doc_len: KBSection; idf: KBSection };
+};
+
+export type KBShard = {
+  id: string;
+  kind: KBChunk['kind'];
+  // set when the index was partitioned by licence as well
+  license?: string;
+  licenses: string[];
+  chunks: number;
+  bytes: number;
+  file: string;
+  embeddings: KBEmbeddings;
+  ivf?: KBIvf;
+};
+
+type KBSection = { offset: number; bytes: number };
+
+export type KBEmbeddings = {
+  file: string;
+  dtype: 'float32' | 'float16' | 'int8';
+  shape: [number, number];
+  byte_order: 'little';
+  bytes: number;
+  // int8 rows are value = int8 * scales[row]
+  sections: { vectors: KBSection; scales?: KBSection };
+  recall_at_10?: number;
 };
 
 export type RetrieveFilters = {
@@ -26,9 +107,45 @@ export type RetrieveFilters = {
   licenses?: string[];
 };
 
-type LoadedIndex = { manifest: KBManifest; chunks: KBChunk[] };
+type LoadedIvf = { centroids: Float32Array; offsets: Int32Array; ids: Int32Array; dim: number; nprobe: number };
 
-let cachedIndex: LoadedIndex | null = null;
+type LoadedShard = { chunks: KBChunk[]; ivf?: LoadedIvf };
+
+type LoadedBm25 = {
+  terms: Map<string, number>;
+  offsets: Int32Array;
+  docs: Int32Array;
+  tfs: Uint16Array;
+  docLen: Int32Array;
+  idf: Float32Array;
+  k1: number;
+  b: number;
+  avgdl: number;
+  stopwords: Set<string>;
+};
+
+export type SearchMode = 'vector' | 'lexical' | 'hybrid';
+
+type LexicalHit = { chunk: KBChunk; score: number };
+
+type LoadedIndex = { manifest: KBManifest; chunks: KBChunk[]; shards: LoadedShard[] };
+
+// Manifest and every shard (and chunk file, and the BM25 index) fetched so far, per base URL;
+// failed loads are dropped so they can be retried
+type IndexCache = {
+  baseUrl: string;
+  manifest: Promise<KBManifest>;
+  shards: Map<string, Promise<LoadedShard>>;
+  chunks: Map<string, Promise<KBChunk[]>>;
+  bm25?: Promise<LoadedBm25>;
+};
+
+const DEFAULT_BASE_URL = '/kb_index';
+// hybrid search: candidates taken from each ranking, and the weight of the cosine score
+const HYBRID_DEPTH = 50;
+const HYBRID_ALPHA = 0.5;
+
+let cachedIndex: IndexCache | null = null;
 
 async function fetchJSON<T>(url: string): Promise<T> {
   const res = await fetch(url);
@@ -36,8 +153,57 @@ async function fetchJSON<T>(url: string): Promise<T> {
   return res.json();
 }
 
-export async function loadIndex(baseUrl = '/kb_index'): Promise<LoadedIndex> {
-  if (cachedIndex) return cachedIndex;
+async function fetchBinary(url: string): Promise<ArrayBuffer> {
+  const res = await fetch(url);
+  if (!res.ok) throw new Error(`Failed to fetch ${url}: ${res.status}`);
+  return res.arrayBuffer();
+}
+
+function halfToFloat(h: number): number {
+  const sign = h & 0x8000 ? -1 : 1;
+  const exp = (h >> 10) & 0x1f;
+  const frac = h & 0x3ff;
+  if (exp === 0) return sign * frac * 2 ** -24;
+  if (exp === 0x1f) return frac ? NaN : sign * Infinity;
+  return sign * (1 + frac / 1024) * 2 ** (exp - 15);
+}
+
+// Decode the matrix into one Float32Array (rows * dim). float32 is a view on the
+// downloaded buffer; float16/int8 are expanded once. Assumes a little-endian host,
+// which covers every browser platform we ship to.
+export function decodeEmbeddings(buf: ArrayBuffer, desc: KBEmbeddings): Float32Array {
+  const [rows, dim] = desc.shape;
+  const n = rows * dim;
+  const { vectors, scales } = desc.sections;
+  if (desc.dtype === 'float32') return new Float32Array(buf, vectors.offset, n);
+  const out = new Float32Array(n);
+  if (desc.dtype === 'float16') {
+    const half = new Uint16Array(buf, vectors.offset, n);
+    for (let i = 0; i < n; i++) out[i] = halfToFloat(half[i]!);
+    return out;
+  }
+  if (desc.dtype === 'int8' && scales) {
+    const q = new Int8Array(buf, vectors.offset, n);
+    const s = new Float32Array(buf, scales.offset, rows);
+    for (let r = 0; r < rows; r++) {
+      const scale = s[r]!;
+      for (let i = r * dim, end = i + dim; i < end; i++) out[i] = q[i]! * scale;
+    }
+    return out;
+  }
+  throw new Error(`Unsupported KB embedding dtype ${desc.dtype}`);
+}
+
+function attachEmbeddings(chunks: KBChunk[], desc: KBEmbeddings, buf: ArrayBuffer): void {
+  const [rows, dim] = desc.shape;
+  if (rows !== chunks.length) throw new Error(`KB embeddings have ${rows} rows for ${chunks.length} chunks`);
+  const matrix = decodeEmbeddings(buf, desc);
+  chunks.forEach((c, i) => {
+    c.embedding = matrix.subarray(i * dim, (i + 1) * dim);
+  });
+}
+
+async function fetchManifest(baseUrl: string): Promise<KBManifest> {
   const manifest = await fetchJSON<KBManifest>(`${baseUrl}/manifest.json`);
   // Warn in dev if manifest embedding model doesn't match client encoder choice
   try {
@@ -49,38 +215,254 @@ export async function loadIndex(baseUrl = '/kb_index'): Promise<LoadedIndex> {
   } catch (e) {
     // ignore
   }
+  return manifest;
+}
+
+// v1/v2 indexes: every chunk file plus the optional single matrix
+async function loadUnsharded(baseUrl: string, manifest: KBManifest): Promise<LoadedShard> {
   const chunksAll: KBChunk[] = [];
   for (const f of manifest.files) {
     const part = await fetchJSON<KBChunk[]>(`${baseUrl}/${f}`);
     chunksAll.push(...part);
   }
-  cachedIndex = { manifest, chunks: chunksAll };
+  if (manifest.embeddings) {
+    attachEmbeddings(chunksAll, manifest.embeddings, await fetchBinary(`${baseUrl}/${manifest.embeddings.file}`));
+  }
+  return { chunks: chunksAll };
+}
+
+// `chunks` comes from cachedChunks, so lexical hits and loaded shards share chunk objects
+async function loadShard(baseUrl: string, shard: KBShard, chunksFile: Promise<KBChunk[]>): Promise<LoadedShard> {
+  const { ivf } = shard;
+  const [chunks, buf, ivfBuf] = await Promise.all([
+    chunksFile,
+    fetchBinary(`${baseUrl}/${shard.embeddings.file}`),
+    ivf ? fetchBinary(`${baseUrl}/${ivf.file}`) : Promise.resolve(null),
+  ]);
+  attachEmbeddings(chunks, shard.embeddings, buf);
+  if (!ivf || !ivfBuf) return { chunks };
+  const { centroids, offsets, ids } = ivf.sections;
+  return {
+    chunks,
+    ivf: {
+      centroids: new Float32Array(ivfBuf, centroids.offset, centroids.bytes / 4),
+      offsets: new Int32Array(ivfBuf, offsets.offset, offsets.bytes / 4),
+      ids: new Int32Array(ivfBuf, ids.offset, ids.bytes / 4),
+      dim: shard.embeddings.shape[1],
+      nprobe: ivf.nprobe,
+    },
+  };
+}
+
+// Chunks worth scoring for the query: the rows of the `nprobe` lists whose centroids are
+// closest, or every chunk when the shard has no IVF index
+function probeShard(shard: LoadedShard, query: ArrayLike<number>, nprobe?: number): KBChunk[] {
+  const { ivf, chunks } = shard;
+  if (!ivf) return chunks;
+  const nlist = ivf.offsets.length - 1;
+  const lists = Array.from({ length: nlist }, (_, j) => ({
+    j,
+    score: dot(query, ivf.centroids.subarray(j * ivf.dim, (j + 1) * ivf.dim)),
+  }));
+  lists.sort((a, b) => b.score - a.score);
+  const out: KBChunk[] = [];
+  for (const { j } of lists.slice(0, nprobe ?? ivf.nprobe)) {
+    for (let r = ivf.offsets[j]!; r < ivf.offsets[j + 1]!; r++) out.push(chunks[ivf.ids[r]!]!);
+  }
+  return out;
+}
+
+function indexCache(baseUrl: string): IndexCache {
+  if (!cachedIndex || cachedIndex.baseUrl !== baseUrl) {
+    const cache: IndexCache = { baseUrl, manifest: fetchManifest(baseUrl), shards: new Map(), chunks: new Map() };
+    cache.manifest.catch(() => {
+      if (cachedIndex === cache) cachedIndex = null;
+    });
+    cachedIndex = cache;
+  }
   return cachedIndex;
 }
 
-function dot(a: number[], b: number[]): number {
+function cachedShard(cache: IndexCache, key: string, load: () => Promise<LoadedShard>): Promise<LoadedShard> {
+  let pending = cache.shards.get(key);
+  if (!pending) {
+    pending = load();
+    pending.catch(() => cache.shards.delete(key));
+    cache.shards.set(key, pending);
+  }
+  return pending;
+}
+
+function cachedChunks(cache: IndexCache, file: string): Promise<KBChunk[]> {
+  let pending = cache.chunks.get(file);
+  if (!pending) {
+    pending = fetchJSON<KBChunk[]>(`${cache.baseUrl}/${file}`);
+    pending.catch(() => cache.chunks.delete(file));
+    cache.chunks.set(file, pending);
+  }
+  return pending;
+}
+
+async function loadBm25(baseUrl: string, desc: KBBm25): Promise<LoadedBm25> {
+  const [buf, terms] = await Promise.all([fetchBinary(`${baseUrl}/${desc.file}`), fetchJSON<string[]>(`${baseUrl}/${desc.terms}`)]);
+  const { offsets, docs, tfs, doc_len, idf } = desc.sections;
+  return {
+    terms: new Map(terms.map((t, j): [string, number] => [t, j])),
+    offsets: new Int32Array(buf, offsets.offset, offsets.bytes / 4),
+    docs: new Int32Array(buf, docs.offset, docs.bytes / 4),
+    tfs: new Uint16Array(buf, tfs.offset, tfs.bytes / 2),
+    docLen: new Int32Array(buf, doc_len.offset, doc_len.bytes / 4),
+    idf: new Float32Array(buf, idf.offset, idf.bytes / 4),
+    k1: desc.k1,
+    b: desc.b,
+    avgdl: desc.avgdl || 1,
+    stopwords: new Set(desc.stopwords),
+  };
+}
+
+function cachedBm25(cache: IndexCache, desc: KBBm25): Promise<LoadedBm25> {
+  if (!cache.bm25) {
+    const pending = loadBm25(cache.baseUrl, desc);
+    pending.catch(() => {
+      if (cache.bm25 === pending) cache.bm25 = undefined;
+    });
+    cache.bm25 = pending;
+  }
+  return cache.bm25;
+}
+
+// Same rule as tokenize() in scripts/kb_lexical.py: lowercase [a-z0-9] runs minus stopwords
+export function tokenize(text: string, stopwords: Set<string>): string[] {
+  return (text.toLowerCase().match(/[a-z0-9]+/g) || []).filter(t => !stopwords.has(t));
+}
+
+// Okapi BM25 score of every doc sharing a term with the query
+function bm25Scores(index: LoadedBm25, query: string): Map<number, number> {
+  const { k1, b, avgdl } = index;
+  const scores = new Map<number, number>();
+  for (const term of tokenize(query, index.stopwords)) {
+    const j = index.terms.get(term);
+    if (j === undefined) continue;
+    const idf = index.idf[j]!;
+    for (let p = index.offsets[j]!; p < index.offsets[j + 1]!; p++) {
+      const d = index.docs[p]!;
+      const tf = index.tfs[p]!;
+      const norm = k1 * (1 - b + (b * index.docLen[d]!) / avgdl);
+      scores.set(d, (scores.get(d) ?? 0) + (idf * tf * (k1 + 1)) / (tf + norm));
+    }
+  }
+  return scores;
+}
+
+// Best `limit` chunks by BM25 that pass the filters. Only chunk JSON is fetched (for the shards
+// with hits), so this needs neither embeddings nor an API key
+async function lexicalHits(
+  cache: IndexCache,
+  manifest: KBManifest,
+  query: string,
+  filters: RetrieveFilters | undefined,
+  limit: number
+): Promise<LexicalHit[]> {
+  if (!manifest.bm25) throw new Error('KB index has no bm25 lexical index');
+  const index = await cachedBm25(cache, manifest.bm25);
+  const selected = new Set(selectShards(manifest, filters).map(sh => sh.id));
+  const ranges: { shard: KBShard; start: number }[] = [];
+  let start = 0;
+  for (const shard of manifest.shards || []) {
+    if (selected.has(shard.id)) ranges.push({ shard, start });
+    start += shard.chunks;
+  }
+  const hits = [...bm25Scores(index, query)]
+    .filter(([, score]) => score > 0)
+    .map(([d, score]) => ({ d, score, range: ranges.find(r => d >= r.start && d < r.start + r.shard.chunks) }))
+    .filter(h => h.range)
+    .sort((a, b) => b.score - a.score || a.d - b.d);
+  const files = new Map(
+    await Promise.all(
+      [...new Set(hits.map(h => h.range!.shard.file))].map(async f => [f, await cachedChunks(cache, f)] as const)
+    )
+  );
+  const keep = chunkFilter(filters);
+  const out: LexicalHit[] = [];
+  for (const { d, score, range } of hits) {
+    const chunk = files.get(range!.shard.file)![d - range!.start]!;
+    if (!keep(chunk)) continue;
+    out.push({ chunk, score });
+    if (out.length >= limit) break;
+  }
+  return out;
+}
+
+// Shards that can hold chunks matching the filters (all shards when there are none)
+export function selectShards(manifest: KBManifest, filters?: RetrieveFilters): KBShard[] {
+  const kinds = filters?.kinds?.length ? new Set(filters.kinds) : null;
+  const licenses = filters?.licenses?.length ? new Set(filters.licenses.map(x => x.toLowerCase())) : null;
+  return (manifest.shards || []).filter(
+    sh => (!kinds || kinds.has(sh.kind)) && (!licenses || sh.licenses.some(l => licenses.has(l.toLowerCase())))
+  );
+}
+
+// Loads the manifest and only the shards the filters need; shards stay cached for later queries
+export async function loadIndex(baseUrl = DEFAULT_BASE_URL, filters?: RetrieveFilters): Promise<LoadedIndex> {
+  const cache = indexCache(baseUrl);
+  const manifest = await cache.manifest;
+  const shards = manifest.shards
+    ? await Promise.all(
+        selectShards(manifest, filters).map(sh => cachedShard(cache, sh.id, () => loadShard(baseUrl, sh, cachedChunks(cache, sh.file))))
+      )
+    : [await cachedShard(cache, '*', () => loadUnsharded(baseUrl, manifest))];
+  return { manifest, chunks: shards.flatMap(s => s.chunks), shards };
+}
+
+// Link to the cited page when the source is a PDF and the chunk carries a page range
+export function citationUrl(chunk: Pick<KBChunk, 'sourceUrl' | 'pageStart'>): string | undefined {
+  const url = chunk.sourceUrl;
+  if (!url || !chunk.pageStart || !/\.pdf($|[?#])/i.test(url) || url.includes('#')) return url;
+  return `${url}#page=${chunk.pageStart}`;
+}
+
+function dot(a: ArrayLike<number>, b: ArrayLike<number>): number {
   let s = 0;
   for (let i = 0; i < a.length && i < b.length; i++) s += (a[i] ?? 0) * (b[i] ?? 0);
   return s;
 }
 
-function l2(a: number[]): number {
+function l2(a: ArrayLike<number>): number {
   let s = 0;
   for (let i = 0; i < a.length; i++) s += (a[i] ?? 0) * (a[i] ?? 0);
   return Math.sqrt(s);
 }
 
-function cosine(a: number[], b: number[]): number {
+function cosine(a: ArrayLike<number>, b: ArrayLike<number>): number {
   const na = l2(a);
   const nb = l2(b);
   if (na === 0 || nb === 0) return 0;
   return dot(a, b) / (na * nb);
 }
 
-function mmrSelect(query: number[], cands: KBChunk[], k: number, lambda = 0.5): { idx: number; score: number }[] {
+// Query embedding in the index's space: cut to embedding_dim and scaled to unit length
+export function fitQuery(vec: ArrayLike<number>, manifest: Pick<KBManifest, 'embedding_dim'>): Float32Array {
+  const dim = manifest.embedding_dim && manifest.embedding_dim < vec.length ? manifest.embedding_dim : vec.length;
+  const out = Float32Array.from({ length: dim }, (_, i) => vec[i] ?? 0);
+  const n = l2(out);
+  if (n > 0) for (let i = 0; i < dim; i++) out[i] = out[i]! / n;
+  return out;
+}
+
+type Similarity = (a: ArrayLike<number>, b: ArrayLike<number>) => number;
+
+// `relevance` replaces the query similarity (hybrid search passes the blended scores)
+function mmrSelect(
+  query: ArrayLike<number>,
+  cands: KBChunk[],
+  k: number,
+  lambda = 0.5,
+  sim: Similarity = cosine,
+  relevance?: number[]
+): { idx: number; score: number }[] {
   // Greedy Maximal Marginal Relevance selection
   const picked: number[] = [];
-  const scores: number[] = cands.map(c => cosine(query, c.embedding));
+  const scores: number[] = relevance ?? cands.map(c => sim(query, c.embedding));
   const out: { idx: number; score: number }[] = [];
   while (picked.length < Math.min(k, cands.length)) {
     let bestIdx = -1;
@@ -90,8 +472,8 @@ function mmrSelect(query: number[], cands: KBChunk[], k: number, lambda = 0.5):
       const simToQuery = scores[i] ?? 0;
       let maxSimToPicked = 0;
       for (const pj of picked) {
-        const sim = cosine(cands[i]!.embedding, cands[pj]!.embedding);
-        if (sim > maxSimToPicked) maxSimToPicked = sim;
+        const s = sim(cands[i]!.embedding, cands[pj]!.embedding);
+        if (s > maxSimToPicked) maxSimToPicked = s;
       }
       const mmr = lambda * simToQuery - (1 - lambda) * maxSimToPicked;
       if (mmr > bestScore) {
@@ -106,24 +488,56 @@ function mmrSelect(query: number[], cands: KBChunk[], k: number, lambda = 0.5):
   return out;
 }
 
-export async function search(query: string, opts?: { topK?: number; filters?: RetrieveFilters; baseUrl?: string }) {
-  const { topK = 6, filters, baseUrl } = opts || {};
-  const { chunks } = await loadIndex(baseUrl);
-  // Filter candidates
-  let cands = chunks;
-  if (filters?.kinds && filters.kinds.length) {
-    const s = new Set(filters.kinds);
-    cands = cands.filter(c => s.has(c.kind));
+function chunkFilter(filters?: RetrieveFilters): (c: KBChunk) => boolean {
+  const kinds = filters?.kinds?.length ? new Set(filters.kinds) : null;
+  const licenses = filters?.licenses?.length ? new Set(filters.licenses.map(x => x.toLowerCase())) : null;
+  return c => (!kinds || kinds.has(c.kind)) && (!licenses || licenses.has((c.license || '').toLowerCase()));
+}
+
+// `nprobe` overrides the per-shard IVF setting from the manifest; `exact` scans every chunk.
+// `mode`: 'vector' (default) embeds the query; 'lexical' ranks by BM25 only - no embeddings
+// call or key, and the returned chunks carry no embedding; 'hybrid' pools the top vector and
+// BM25 candidates and scores them HYBRID_ALPHA * similarity + (1 - HYBRID_ALPHA) * BM25 / best
+// BM25 score before MMR (the same rule as scripts/kb_query.py). On an index without bm25 (built
+// with --no-bm25 or before v3) 'hybrid' ranks by vectors alone; only 'lexical' fails there
+export async function search(
+  query: string,
+  opts?: { topK?: number; filters?: RetrieveFilters; baseUrl?: string; nprobe?: number; exact?: boolean; mode?: SearchMode }
+) {
+  const { topK = 6, filters, baseUrl = DEFAULT_BASE_URL, nprobe, exact = false, mode = 'vector' } = opts || {};
+  if (mode === 'lexical') {
+    const cache = indexCache(baseUrl);
+    const hits = await lexicalHits(cache, await cache.manifest, query, filters, topK);
+    return hits.map(({ chunk, score }) => ({ ...chunk, score }));
   }
-  if (filters?.licenses && filters.licenses.length) {
-    const s = new Set(filters.licenses.map(x => x.toLowerCase()));
-    cands = cands.filter(c => s.has((c.license || '').toLowerCase()));
+  const { manifest, chunks, shards } = await loadIndex(baseUrl, filters);
+  const keep = chunkFilter(filters);
+  if (!chunks.some(keep)) return [] as Array<KBChunk & { score: number }>;
+
+  const hybrid = mode === 'hybrid' && !!manifest.bm25;
+  const [emb, lexical] = await Promise.all([
+    embed([query]),
+    hybrid ? lexicalHits(indexCache(baseUrl), manifest, query, filters, HYBRID_DEPTH) : Promise.resolve([] as LexicalHit[]),
+  ]);
+  const qvec = fitQuery(emb[0] || [], manifest);
+  // normalized indexes skip the per-chunk norms of cosine()
+  const sim = manifest.normalized ? dot : cosine;
+  let cands = shards.flatMap(s => (exact ? s.chunks : probeShard(s, qvec, nprobe))).filter(keep);
+  let relevance: number[] | undefined;
+  if (hybrid) {
+    const best = lexical[0]?.score ?? 1;
+    const bm25 = new Map(lexical.map(({ chunk, score }) => [chunk, score / best] as const));
+    const pool = cands
+      .map((c, i) => ({ c, i, s: sim(qvec, c.embedding) }))
+      .sort((a, b) => b.s - a.s || a.i - b.i)
+      .slice(0, HYBRID_DEPTH)
+      .map(({ c }) => c);
+    const seen = new Set(pool);
+    cands = [...pool, ...lexical.map(h => h.chunk).filter(c => !seen.has(c))];
+    relevance = cands.map(c => HYBRID_ALPHA * sim(qvec, c.embedding) + (1 - HYBRID_ALPHA) * (bm25.get(c) ?? 0));
   }
   if (cands.length === 0) return [] as Array<KBChunk & { score: number }>;
-
-  const emb = await embed([query]);
-  const qvec = emb[0] || [];
-  const picked = mmrSelect(qvec, cands, topK, 0.5);
+  const picked = mmrSelect(qvec, cands, topK, 0.5, sim, relevance);
   const results = picked.map(({ idx, score }) => ({ ...cands[idx], score }));
   // Sort desc by score
   results.sort((a, b) => b.score - a.score);
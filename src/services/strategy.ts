@@ -1,6 +1,6 @@
 import type { SessionContext } from './orchestrator';
 import type { Plan } from '@/schemas/product';
-import { search as kbSearch } from './retrieve';
+import { citationUrl, search as kbSearch } from './retrieve';
 
 export interface StrategyService {
   proposePlan(sc: SessionContext): Promise<Plan>;
@@ -25,7 +25,7 @@ export const strategy: StrategyService = {
         title: r.title,
         pmid: r.pmid,
         videoId: r.videoId,
-        url: r.sourceUrl
+        url: citationUrl(r)
       }));
     } catch {
       // ignore retrieval errors; plan remains valid